@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Compiles alignment filter expressions into fast per-read predicates.
+
+Expressions combine terms with and, or, not, and parentheses, e.g.
+
+    not unmapped and not secondary and MAPQ >= 20 and NM <= 1 and SOFTCLIP == 0
+
+Terms are:
+
+    flag names       unmapped, reverse, paired, proper_pair, mate_unmapped, mate_reverse, read1, read2,
+                     secondary, qcfail, duplicate, supplementary
+    FLAG:<int>       all bits of the decimal or 0x-prefixed hexadecimal mask are set
+    MAPQ, LEN        mapping quality and query length compared to a number
+    SOFTCLIP         total soft-clipped bases compared to a number
+    MDMM             number of mismatches in the MD tag compared to a number
+    <TAG>            any two-character numeric tag, e.g. NM or AS, compared to a number
+    has(<TAG>)       tag presence
+
+Comparisons on a missing or non-numeric tag are false rather than an error. Expressions are parsed once, operands of
+each and/or are reordered so cheap flag and core-field checks short-circuit before tag decoding, and the result is
+compiled to a single Python function.
+"""
+
+import re
+
+FLAG_BITS = {"paired": 0x1, "proper_pair": 0x2, "unmapped": 0x4, "mate_unmapped": 0x8, "reverse": 0x10,
+             "mate_reverse": 0x20, "read1": 0x40, "read2": 0x80, "secondary": 0x100, "qcfail": 0x200,
+             "duplicate": 0x400, "supplementary": 0x800}
+
+COMPARISON_OPS = {"<", "<=", ">", ">=", "==", "!="}
+KEYWORDS = {"and", "or", "not"}
+CIGAR_SOFT_CLIP = 4
+MD_DELETION_RE = re.compile(r"\^[A-Z]+")
+MD_MISMATCH_RE = re.compile(r"[A-Z]")
+TAG_RE = re.compile(r"^[A-Za-z][A-Za-z0-9]$")
+NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|(<=|>=|==|!=|<|>)|(-?\d+(?:\.\d+)?)|(has\(\s*\w\w\s*\))"
+                      r"|(FLAG:(?:0[xX][0-9a-fA-F]+|\d+))"
+                      r"|([A-Za-z_][A-Za-z0-9_]*))")
+
+# Relative cost of evaluating each kind of term
+FIELD_COSTS = {"MAPQ": 0, "LEN": 0, "SOFTCLIP": 1, "MDMM": 3}
+FLAG_COST = 0
+TAG_COST = 2
+
+FIELD_CODE = {"MAPQ": "r.mapping_quality", "LEN": "r.query_length", "SOFTCLIP": "_softclip(r)",
+              "MDMM": "_md_mismatches(r)"}
+
+
+def _tag(read_aln, tag):
+    """Gets a tag value, or None if the tag is missing.
+
+    :param pysam.AlignedSegment read_aln: alignment
+    :param str tag: two-character tag
+    :return int | float | str | None: tag value
+    """
+
+    if read_aln.has_tag(tag):
+        return read_aln.get_tag(tag)
+    return None
+
+
+def _softclip(read_aln):
+    """Gets the total number of soft-clipped bases.
+
+    :param pysam.AlignedSegment read_aln: alignment
+    :return int: soft-clipped bases at both ends
+    """
+
+    if read_aln.cigartuples is None:
+        return 0
+    return sum(op_len for op, op_len in read_aln.cigartuples if op == CIGAR_SOFT_CLIP)
+
+
+def _md_mismatches(read_aln):
+    """Counts mismatches in the MD tag, excluding deleted reference bases.
+
+    :param pysam.AlignedSegment read_aln: alignment
+    :return int | None: number of mismatched bases, or None if the MD tag is missing
+    """
+
+    if not read_aln.has_tag("MD"):
+        return None
+    return len(MD_MISMATCH_RE.findall(MD_DELETION_RE.sub("", read_aln.get_tag("MD"))))
+
+
+PREDICATE_NAMESPACE = {"_tag": _tag, "_softclip": _softclip, "_md_mismatches": _md_mismatches}
+
+
+def tokenize(expression):
+    """Splits a filter expression into tokens.
+
+    :param str expression: filter expression
+    :return list: tokens
+    """
+
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if match is None or match.end() == pos:
+            raise NotImplementedError("Invalid filter expression at position %i: %s" % (pos, expression))
+        tokens.append(match.group().strip())
+        pos = match.end()
+
+    return tokens
+
+
+class _Parser(object):
+    """Recursive-descent parser producing a nested-tuple syntax tree."""
+
+    def __init__(self, tokens):
+        """Constructor for _Parser.
+
+        :param list tokens: tokens from tokenize
+        """
+
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        """Gets the next token without consuming it."""
+
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        """Consumes the next token."""
+
+        token = self.peek()
+        if token is None:
+            raise NotImplementedError("Unexpected end of filter expression.")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        """Parses the full expression.
+
+        :return tuple: syntax tree
+        """
+
+        tree = self.parse_or()
+        if self.peek() is not None:
+            raise NotImplementedError("Unexpected token in filter expression: %s" % self.peek())
+        return tree
+
+    def parse_or(self):
+        """Parses an or-expression."""
+
+        operands = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else ("or", operands)
+
+    def parse_and(self):
+        """Parses an and-expression."""
+
+        operands = [self.parse_not()]
+        while self.peek() == "and":
+            self.take()
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else ("and", operands)
+
+    def parse_not(self):
+        """Parses a negation."""
+
+        if self.peek() == "not":
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        """Parses a parenthesized expression or a term."""
+
+        token = self.take()
+
+        if token == "(":
+            tree = self.parse_or()
+            if self.take() != ")":
+                raise NotImplementedError("Unbalanced parentheses in filter expression.")
+            return tree
+
+        if token.startswith("has("):
+            tag = token[4:-1].strip()
+            return ("has", tag)
+
+        if token.startswith("FLAG:"):
+            mask = token[5:]
+            return ("flag", int(mask, 16) if mask.lower().startswith("0x") else int(mask))
+
+        if token in FLAG_BITS:
+            return ("flag", FLAG_BITS[token])
+
+        if token in FIELD_CODE or TAG_RE.match(token):
+            op = self.take()
+            if op not in COMPARISON_OPS:
+                raise NotImplementedError("Expected a comparison after %s, got %s" % (token, op))
+            value = self.take()
+            if not NUMBER_RE.match(value):
+                raise NotImplementedError("Expected a number after %s %s, got %s" % (token, op, value))
+            value = float(value)
+            return ("cmp", token, op, int(value) if value.is_integer() else value)
+
+        raise NotImplementedError("Unknown term in filter expression: %s" % token)
+
+
+def parse_expression(expression):
+    """Parses a filter expression into a syntax tree.
+
+    :param str expression: filter expression
+    :return tuple: syntax tree
+    """
+
+    tree = _Parser(tokenize(expression)).parse()
+    return tree
+
+
+def get_cost(tree):
+    """Estimates the relative cost of evaluating a syntax tree.
+
+    :param tuple tree: syntax tree
+    :return int: cost
+    """
+
+    kind = tree[0]
+
+    if kind in {"and", "or"}:
+        return sum(get_cost(e) for e in tree[1])
+    if kind == "not":
+        return get_cost(tree[1])
+    if kind == "flag":
+        return FLAG_COST
+    if kind == "has":
+        return TAG_COST
+
+    return FIELD_COSTS.get(tree[1], TAG_COST)
+
+
+def generate_code(tree):
+    """Generates a Python expression for a syntax tree, cheapest operands first.
+
+    :param tuple tree: syntax tree
+    :return str: Python expression over an alignment r
+    """
+
+    kind = tree[0]
+
+    if kind in {"and", "or"}:
+        # Terms have no side effects and cannot raise, so reordering for short-circuiting does not change the result
+        operands = sorted(tree[1], key=get_cost)
+        return "(" + (" %s " % kind).join(generate_code(e) for e in operands) + ")"
+
+    if kind == "not":
+        return "(not %s)" % generate_code(tree[1])
+
+    if kind == "flag":
+        return "(r.flag & %i == %i)" % (tree[1], tree[1])
+
+    if kind == "has":
+        return "r.has_tag(%r)" % tree[1]
+
+    _, field, op, value = tree
+
+    if field in {"MAPQ", "LEN", "SOFTCLIP"}:
+        return "(%s %s %r)" % (FIELD_CODE[field], op, value)
+
+    # Missing tags and MD strings evaluate to None, and string or array tags are not numbers; both fail every
+    # comparison rather than raising TypeError mid-stream
+    value_code = FIELD_CODE[field] if field == "MDMM" else "_tag(r, %r)" % field
+    return "(isinstance((_v := %s), (int, float)) and _v %s %r)" % (value_code, op, value)
+
+
+def compile_expression(expression):
+    """Compiles a filter expression into a predicate.
+
+    :param str expression: filter expression
+    :return function: predicate taking a pysam.AlignedSegment and returning a bool
+    """
+
+    code = generate_code(parse_expression(expression))
+    predicate = eval("lambda r: bool(%s)" % code, dict(PREDICATE_NAMESPACE))
+    return predicate
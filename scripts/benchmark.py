@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+"""Benchmarks the scripts on deterministic synthetic data.
+
+Generates a GTF, genome FASTA, APPRIS-style transcriptome FASTA, flank-bearing unaligned BAM, aligned BAM with NM and
+MD tags, and CCLE-shaped CSV matrix at a chosen scale, then runs each tool as a subprocess, recording the best wall
+time, records per second, and peak RSS of its repeats to JSON. Given a prior results JSON as baseline, benchmarks
+slower or larger than the baseline by more than a tolerance are reported as regressions.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import numpy as np
+import os
+import platform
+import pysam
+import random
+import subprocess
+import sys
+import time
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+CSV_DELIM = ","
+HEADER_DELIM = "|"
+FASTA_LINE_LEN = 60
+BASES = "ACGT"
+DEFAULT_OUTDIR = "."
+DEFAULT_SCALE = "small"
+DEFAULT_REPEATS = 3
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_SEED = 0
+RESULTS_FILE = "benchmark.json"
+MANIFEST_FILE = "manifest.json"
+DATA_DIR = "data"
+RUNS_DIR = "runs"
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Synthetic data sizes per scale
+SCALES = {
+    "small": {"genes": 500, "contigs": 3, "aligned_reads": 50000, "flank_reads": 50000, "cell_lines": 200,
+              "ccle_genes": 2000, "selected": 100},
+    "medium": {"genes": 5000, "contigs": 6, "aligned_reads": 500000, "flank_reads": 500000, "cell_lines": 1000,
+               "ccle_genes": 10000, "selected": 1000},
+    "large": {"genes": 20000, "contigs": 12, "aligned_reads": 5000000, "flank_reads": 5000000, "cell_lines": 1500,
+              "ccle_genes": 50000, "selected": 5000},
+}
+
+GENE_SPACING = 10000
+READ_LEN = 100
+TRX_PER_GENE = 2
+MAX_EXONS = 6
+MISMATCH_WEIGHTS = (0.6, 0.25, 0.15,)
+LEFT_FLANK = "GTTGCAGGCTAGCT"
+RIGHT_FLANK = "GACCGATCGGATCA"
+MISSING_FLANK_RATE = 0.1
+FLANK_MISMATCH_RATE = 0.2
+
+# The kernel carries a parent's peak RSS into its children, so tools report their own high-water mark on exit
+RSS_REPORT = "BENCHMARK_PEAK_RSS_KB"
+RSS_RUNNER = """
+import os, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status_fh:
+            hwm = [e.split()[1] for e in status_fh if e.startswith("VmHWM:")]
+        sys.stderr.write("%s %s\\n" % ("""+ repr(RSS_REPORT) + """, hwm[0]))
+"""
+
+# Benchmark: (script, arguments, record count key, record unit); {name} fields are filled from the data files
+BENCHMARKS = collections.OrderedDict((
+    ("filter_gtf", ("filter_gtf.py", "-g {gtf} -i {trx_ids} -o {outdir}", "gtf_lines", "GTF lines")),
+    ("filter_gtf_index", ("filter_gtf.py", "-g {gtf} -i {trx_ids} -x -o {outdir}", "gtf_lines", "GTF lines")),
+    ("trx_id_to_gene", ("trx_id_to_gene.py", "-g {gtf} -i {trx_ids} -o {outdir}", "gtf_lines", "GTF lines")),
+    ("trx_id_to_gene_index", ("trx_id_to_gene.py", "-g {gtf} -i {trx_ids} -x -o {outdir}", "gtf_lines",
+                              "GTF lines")),
+    ("extract_transcript_sequences", ("extract_transcript_sequences.py",
+                                      "-i {trx_ids} -t {gtf} -g {genome} -o {outdir}", "transcripts", "transcripts")),
+    ("extract_sequences_from_trx_ids", ("extract_sequences_from_trx_ids.py", "-i {trx_ids} -f {transcriptome} "
+                                        "-o {outdir}", "transcriptome_records", "FASTA records")),
+    ("extract_sequences_from_trx_ids_index", ("extract_sequences_from_trx_ids.py", "-i {trx_ids} -f {transcriptome} "
+                                              "-x -o {outdir}", "transcriptome_records", "FASTA records")),
+    ("extract_sequences_from_genes", ("extract_sequences_from_genes.py", "-i {gene_names} -f {transcriptome} "
+                                      "-o {outdir}", "transcriptome_records", "FASTA records")),
+    ("trim_bam", ("trim_bam.py", "-b {flank_bam} -f %s,%s -o {outdir}" % (LEFT_FLANK, RIGHT_FLANK), "flank_reads",
+                  "reads")),
+    ("trim_bam_bgzip", ("trim_bam.py", "-b {flank_bam} -f %s,%s -z bgzip -o {outdir}" % (LEFT_FLANK, RIGHT_FLANK),
+                        "flank_reads", "reads")),
+    ("trim_bam_collapse", ("trim_bam.py", "-b {flank_bam} -f %s,%s -c -n -o {outdir}" % (LEFT_FLANK, RIGHT_FLANK),
+                           "flank_reads", "reads")),
+    ("run_alignment_filter", ("run_alignment_filter.py", "-a {aligned_bam} -o {outdir}", "aligned_reads", "reads")),
+    ("run_alignment_filter_expression", ("run_alignment_filter.py", "-a {aligned_bam} -f low=NM<=1 -o {outdir}",
+                                         "aligned_reads", "reads")),
+    ("filter_CCLE_matrix", ("filter_CCLE_matrix.py", "-m {ccle} -g {ccle_genes} -d {depmap_ids} -o {outdir}",
+                            "cell_lines", "rows")),
+    ("filter_CCLE_matrix_index", ("filter_CCLE_matrix.py", "-m {ccle} -g {ccle_genes} -d {depmap_ids} -x "
+                                  "-o {outdir}", "cell_lines", "rows")),
+    ("filter_CCLE_matrix_cache", ("filter_CCLE_matrix.py", "-m {ccle} -g {ccle_genes} -d {depmap_ids} -c "
+                                  "-o {outdir}", "cell_lines", "rows")),
+))
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "benchmark_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-s", "--scale", type=str, default=DEFAULT_SCALE, choices=sorted(SCALES),
+                        help='Synthetic data scale. Default %s.' % DEFAULT_SCALE)
+
+    parser.add_argument("-k", "--benchmarks", type=str, default=None,
+                        help='Comma-separated benchmarks to run, from %s. Default all.' % ", ".join(BENCHMARKS))
+
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS,
+                        help='Runs per benchmark; the fastest is reported. Default %i.' % DEFAULT_REPEATS)
+
+    parser.add_argument("-b", "--baseline", type=str, default=None,
+                        help='Optional results JSON from an earlier run to compare against.')
+
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help='Fractional increase in wall time or peak RSS over the baseline reported as a '
+                             'regression. Default %s.' % DEFAULT_TOLERANCE)
+
+    parser.add_argument("-e", "--seed", type=int, default=DEFAULT_SEED,
+                        help='Random seed for the synthetic data. Default %i.' % DEFAULT_SEED)
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory for data, tool outputs, and results. '
+                             'Default current working directory.')
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def random_seq(rng, length):
+    """Generates a random DNA sequence.
+
+    :param random.Random rng: random generator
+    :param int length: sequence length
+    :return str: sequence
+    """
+
+    res = "".join(rng.choices(BASES, k=length))
+    return res
+
+
+def write_fasta_record(out_fh, name, seq, line_len=FASTA_LINE_LEN):
+    """Writes a wrapped FASTA record.
+
+    :param file out_fh: open output file
+    :param str name: record name
+    :param str seq: sequence
+    :param int line_len: line length
+    """
+
+    out_fh.write(">" + name + FILE_NEWLINE)
+    out_fh.write(FILE_NEWLINE.join(seq[i:i + line_len] for i in range(0, len(seq), line_len)) + FILE_NEWLINE)
+
+
+def write_genome(outfile, contig_lens, rng):
+    """Writes a random genome FASTA and its faidx index.
+
+    :param str outfile: output FASTA
+    :param dict contig_lens: {contig: length}
+    :param random.Random rng: random generator
+    :return dict: {contig: sequence}
+    """
+
+    genome = {contig: random_seq(rng, length) for contig, length in contig_lens.items()}
+
+    with open(outfile, "w") as out_fh:
+        for contig, seq in genome.items():
+            write_fasta_record(out_fh, contig, seq)
+
+    pysam.faidx(outfile)
+    return genome
+
+
+def get_gtf_attrs(gene_id, gene_name, trx_id=None):
+    """Formats Gencode-style GTF attributes.
+
+    :param str gene_id: gene ID with version
+    :param str gene_name: gene name
+    :param str | None trx_id: transcript ID with version, or None for gene records
+    :return str: attribute field
+    """
+
+    if trx_id is None:
+        return 'gene_id "%s"; gene_type "protein_coding"; gene_name "%s";' % (gene_id, gene_name)
+
+    return 'gene_id "%s"; transcript_id "%s"; gene_type "protein_coding"; gene_name "%s"; ' \
+           'transcript_type "protein_coding";' % (gene_id, trx_id, gene_name)
+
+
+def write_gtf(outfile, n_genes, contigs, rng):
+    """Writes a Gencode-style GTF of protein-coding genes with exon, CDS, and UTR records.
+
+    :param str outfile: output GTF
+    :param int n_genes: number of genes
+    :param list contigs: contig names; genes are dealt across them
+    :param random.Random rng: random generator
+    :return tuple: (list of (transcript ID without version, gene name) tuples, number of GTF lines)
+    """
+
+    transcripts = []
+    n_lines = 1
+
+    with open(outfile, "w") as out_fh:
+        out_fh.write("##description: synthetic benchmark annotation" + FILE_NEWLINE)
+
+        for g in range(n_genes):
+
+            contig = contigs[g % len(contigs)]
+            strand = "+" if g % 2 == 0 else "-"
+            gene_start = GENE_SPACING // 10 + (g // len(contigs)) * GENE_SPACING
+            gene_id, gene_name = "ENSG%011d.1" % g, "GENE%d" % g
+
+            records = [("gene", gene_start, gene_start + GENE_SPACING // 2, get_gtf_attrs(gene_id, gene_name))]
+
+            for t in range(TRX_PER_GENE):
+
+                trx_id = "ENST%011d.1" % (g * TRX_PER_GENE + t)
+                attrs = get_gtf_attrs(gene_id, gene_name, trx_id)
+                transcripts.append((trx_id.split(".")[0], gene_name,))
+
+                exons, pos = [], gene_start + t * 10
+                for _ in range(rng.randint(1, MAX_EXONS)):
+                    exon_start = pos + rng.randint(10, 500)
+                    pos = exon_start + rng.randint(50, 400)
+                    exons.append((exon_start, pos,))
+
+                cds_start, cds_end = exons[0][0] + 20, exons[-1][1] - 20
+                records.append(("transcript", exons[0][0], exons[-1][1], attrs))
+
+                for exon_start, exon_end in (exons if strand == "+" else exons[::-1]):
+
+                    records.append(("exon", exon_start, exon_end, attrs))
+
+                    if max(exon_start, cds_start) <= min(exon_end, cds_end):
+                        records.append(("CDS", max(exon_start, cds_start), min(exon_end, cds_end), attrs))
+
+                    for utr_start, utr_end in ((exon_start, min(exon_end, cds_start - 1)),
+                                               (max(exon_start, cds_end + 1), exon_end)):
+                        if utr_start <= utr_end:
+                            records.append(("UTR", utr_start, utr_end, attrs))
+
+            for feature, start, end, attrs in records:
+                out_fh.write(FILE_DELIM.join(
+                    (contig, "HAVANA", feature, str(start), str(end), ".", strand, ".", attrs)) + FILE_NEWLINE)
+
+            n_lines += len(records)
+
+    return transcripts, n_lines
+
+
+def write_transcriptome(outfile, transcripts, rng):
+    """Writes an APPRIS-style transcriptome FASTA with pipe-delimited region headers.
+
+    :param str outfile: output FASTA
+    :param list transcripts: (transcript ID without version, gene name) tuples
+    :param random.Random rng: random generator
+    :return int: number of records
+    """
+
+    with open(outfile, "w") as out_fh:
+        for i, (trx_id, gene_name) in enumerate(transcripts):
+
+            utr5_len, cds_len, utr3_len = rng.randint(1, 200), 3 * rng.randint(50, 800), rng.randint(1, 600)
+            trx_len = utr5_len + cds_len + utr3_len
+
+            header = HEADER_DELIM.join((
+                trx_id + ".1", "ENSG%011d.1" % (i // TRX_PER_GENE), "OTTHUMG", "OTTHUMT",
+                "%s-%i" % (gene_name, 201 + i % TRX_PER_GENE), gene_name, str(trx_len),
+                "UTR5:1-%i" % utr5_len, "CDS:%i-%i" % (utr5_len + 1, utr5_len + cds_len),
+                "UTR3:%i-%i" % (utr5_len + cds_len + 1, trx_len), ""))
+
+            write_fasta_record(out_fh, header, random_seq(rng, trx_len))
+
+    return len(transcripts)
+
+
+def mutate(seq, n_mismatches, rng):
+    """Substitutes random positions of a sequence.
+
+    :param str seq: sequence
+    :param int n_mismatches: number of substitutions
+    :param random.Random rng: random generator
+    :return tuple: (mutated sequence, sorted substituted positions)
+    """
+
+    positions = sorted(rng.sample(range(len(seq)), n_mismatches))
+    seq_list = list(seq)
+    for p in positions:
+        seq_list[p] = rng.choice([b for b in BASES if b != seq[p]])
+
+    return "".join(seq_list), positions
+
+
+def get_md(ref_seq, positions):
+    """Gets the MD tag of an ungapped alignment.
+
+    :param str ref_seq: reference sequence of the aligned span
+    :param list positions: sorted mismatch positions
+    :return str: MD tag
+    """
+
+    md, last = [], 0
+    for p in positions:
+        md.append("%i%s" % (p - last, ref_seq[p]))
+        last = p + 1
+
+    md.append(str(len(ref_seq) - last))
+    return "".join(md)
+
+
+def write_aligned_bam(outfile, genome, n_reads, rng):
+    """Writes a coordinate-sorted, indexed BAM of ungapped alignments with NM and MD tags.
+
+    :param str outfile: output BAM
+    :param dict genome: {contig: sequence}
+    :param int n_reads: number of reads
+    :param random.Random rng: random generator
+    """
+
+    contigs = list(genome)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": contig, "LN": len(seq)} for contig, seq in genome.items()]}
+
+    # Reads are dealt to contigs, then sorted by position within each
+    starts = collections.defaultdict(list)
+    for _ in range(n_reads):
+        contig = rng.randrange(len(contigs))
+        starts[contig].append(rng.randrange(len(genome[contigs[contig]]) - READ_LEN))
+
+    quals = pysam.qualitystring_to_array("I" * READ_LEN)
+    with pysam.AlignmentFile(outfile, "wb", header=header) as out_af:
+        n = 0
+        for contig in sorted(starts):
+
+            seq = genome[contigs[contig]]
+            for start in sorted(starts[contig]):
+
+                ref_seq = seq[start:start + READ_LEN]
+                n_mismatches = rng.choices(range(len(MISMATCH_WEIGHTS)), MISMATCH_WEIGHTS)[0]
+                read_seq, positions = mutate(ref_seq, n_mismatches, rng)
+
+                align_seg = pysam.AlignedSegment(out_af.header)
+                align_seg.query_name = "r%i" % n
+                align_seg.flag = rng.choice((0, 16,))
+                align_seg.reference_id = contig
+                align_seg.reference_start = start
+                align_seg.mapping_quality = 60
+                align_seg.cigarstring = "%iM" % READ_LEN
+                align_seg.query_sequence = read_seq
+                align_seg.query_qualities = quals
+                align_seg.set_tags([("NM", n_mismatches), ("MD", get_md(ref_seq, positions))])
+                out_af.write(align_seg)
+                n += 1
+
+    pysam.index(outfile)
+
+
+def write_flank_bam(outfile, n_reads, rng):
+    """Writes an unaligned BAM of amplicon reads carrying flanking sequences, some with mismatches or missing.
+
+    :param str outfile: output BAM
+    :param int n_reads: number of reads
+    :param random.Random rng: random generator
+    """
+
+    header = {"HD": {"VN": "1.6", "SO": "unsorted"}}
+
+    with pysam.AlignmentFile(outfile, "wb", header=header) as out_af:
+        for i in range(n_reads):
+
+            left = mutate(LEFT_FLANK, 1, rng)[0] if rng.random() < FLANK_MISMATCH_RATE else LEFT_FLANK
+            right = RIGHT_FLANK if rng.random() >= MISSING_FLANK_RATE else random_seq(rng, len(RIGHT_FLANK))
+
+            seq = random_seq(rng, rng.randint(2, 8)) + left + random_seq(rng, rng.randint(40, 80)) + right + \
+                random_seq(rng, rng.randint(2, 8))
+
+            align_seg = pysam.AlignedSegment(out_af.header)
+            align_seg.query_name = "q%i" % i
+            align_seg.flag = 4
+            align_seg.query_sequence = seq
+            align_seg.query_qualities = pysam.qualitystring_to_array("".join(rng.choices("#?@ABCDEFGHI", k=len(seq))))
+            out_af.write(align_seg)
+
+
+def write_ccle(outfile, n_cell_lines, n_genes, rng):
+    """Writes a CCLE-shaped CSV expression matrix.
+
+    :param str outfile: output CSV
+    :param int n_cell_lines: number of depMap ID rows
+    :param int n_genes: number of gene columns
+    :param random.Random rng: random generator
+    :return tuple: (list of depMap IDs, list of gene names)
+    """
+
+    np_rng = np.random.RandomState(rng.randrange(2 ** 32))
+    genes = ["G%i" % i for i in range(n_genes)]
+    cell_lines = ["ACH-%06d" % i for i in range(n_cell_lines)]
+
+    with open(outfile, "w") as out_fh:
+
+        out_fh.write(CSV_DELIM.join([""] + ["%s (%i)" % (gene, 1000 + i) for i, gene in enumerate(genes)]) +
+                     FILE_NEWLINE)
+
+        for cell_line in cell_lines:
+            values = np.char.mod("%.6f", np_rng.exponential(2, n_genes))
+            out_fh.write(cell_line + CSV_DELIM + CSV_DELIM.join(values) + FILE_NEWLINE)
+
+    return cell_lines, genes
+
+
+def write_list(outfile, values):
+    """Writes values one per line.
+
+    :param str outfile: output file
+    :param iterable values: values
+    """
+
+    with open(outfile, "w") as out_fh:
+        out_fh.write(FILE_NEWLINE.join(values) + FILE_NEWLINE)
+
+
+def generate_data(data_dir, scale=DEFAULT_SCALE, seed=DEFAULT_SEED):
+    """Generates the synthetic data set, reusing an existing one of the same scale and seed.
+
+    :param str data_dir: data directory
+    :param str scale: data scale
+    :param int seed: random seed
+    :return dict: data file paths and record counts
+    """
+
+    manifest_file = os.path.join(data_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as manifest_fh:
+            manifest = json.load(manifest_fh)
+        if manifest["scale"] == scale and manifest["seed"] == seed:
+            logger.warning("Reusing %s data in %s." % (scale, data_dir))
+            return manifest
+
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    sizes = SCALES[scale]
+    rng = random.Random(seed)
+    paths = {k: os.path.join(data_dir, v) for k, v in (
+        ("gtf", "synthetic.gtf"), ("genome", "genome.fa"), ("transcriptome", "appris.fa"),
+        ("aligned_bam", "aligned.bam"), ("flank_bam", "amplicons.bam"), ("ccle", "ccle.csv"),
+        ("trx_ids", "trx_ids.txt"), ("gene_names", "gene_names.txt"), ("ccle_genes", "ccle_genes.txt"),
+        ("depmap_ids", "depmap_ids.txt"))}
+
+    start_time = time.time()
+    contigs = ["chr%i" % (i + 1) for i in range(sizes["contigs"])]
+    contig_len = (sizes["genes"] // len(contigs) + 2) * GENE_SPACING
+
+    transcripts, n_gtf_lines = write_gtf(paths["gtf"], sizes["genes"], contigs, rng)
+    genome = write_genome(paths["genome"], {contig: contig_len for contig in contigs}, rng)
+    n_trx_records = write_transcriptome(paths["transcriptome"], transcripts, rng)
+    write_aligned_bam(paths["aligned_bam"], genome, sizes["aligned_reads"], rng)
+    write_flank_bam(paths["flank_bam"], sizes["flank_reads"], rng)
+    cell_lines, ccle_genes = write_ccle(paths["ccle"], sizes["cell_lines"], sizes["ccle_genes"], rng)
+
+    n_selected = sizes["selected"]
+    selected_trx = rng.sample(transcripts, min(n_selected, len(transcripts)))
+    write_list(paths["trx_ids"], [e[0] for e in selected_trx])
+    write_list(paths["gene_names"], sorted({e[1] for e in selected_trx}))
+    write_list(paths["ccle_genes"], rng.sample(ccle_genes, min(n_selected, len(ccle_genes))))
+    write_list(paths["depmap_ids"], rng.sample(cell_lines, min(n_selected, len(cell_lines))))
+
+    manifest = {"scale": scale, "seed": seed, "paths": paths,
+                "counts": {"gtf_lines": n_gtf_lines, "transcripts": len(transcripts),
+                           "transcriptome_records": n_trx_records, "aligned_reads": sizes["aligned_reads"],
+                           "flank_reads": sizes["flank_reads"], "cell_lines": sizes["cell_lines"]}}
+
+    with open(manifest_file, "w") as manifest_fh:
+        json.dump(manifest, manifest_fh, indent=2)
+
+    logger.warning("Generated %s data in %s in %.1f s." % (scale, data_dir, time.time() - start_time))
+    return manifest
+
+
+def get_peak_rss_mb(stderr, rusage):
+    """Gets the peak resident set size of a tool run under RSS_RUNNER.
+
+    :param bytes stderr: tool stderr, ending with the runner's RSS report on Linux
+    :param resource.struct_rusage rusage: child resource usage, used where /proc is unavailable
+    :return float: peak RSS in MiB
+    """
+
+    for line in reversed(stderr.decode(errors="replace").splitlines()):
+        if line.startswith(RSS_REPORT):
+            return int(line.split()[1]) / 1024
+
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere, and includes the RSS inherited from this process
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return rusage.ru_maxrss / scale
+
+
+def run_tool(cmd, cwd):
+    """Runs a tool and measures it.
+
+    :param list cmd: script and arguments
+    :param str cwd: working directory
+    :return tuple: (wall seconds, CPU seconds, peak RSS MiB)
+    """
+
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", RSS_RUNNER] + cmd, cwd=cwd, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+
+    # wait4 gives the resource usage of this child and its reaped children alone
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start_time
+    process.returncode = status
+
+    if status != 0:
+        raise RuntimeError("%s failed:\n%s" % (" ".join(cmd), stderr.decode(errors="replace")))
+
+    return wall, rusage.ru_utime + rusage.ru_stime, get_peak_rss_mb(stderr, rusage)
+
+
+def run_benchmark(name, manifest, runs_dir, repeats=DEFAULT_REPEATS):
+    """Runs one benchmark.
+
+    :param str name: benchmark name
+    :param dict manifest: data manifest from generate_data
+    :param str runs_dir: directory for tool outputs
+    :param int repeats: runs; the fastest is reported
+    :return dict: wall and CPU seconds, peak RSS, records, and records per second
+    """
+
+    script, args, count_key, unit = BENCHMARKS[name]
+    outdir = os.path.abspath(os.path.join(runs_dir, name))
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    fields = {k: os.path.abspath(v) for k, v in manifest["paths"].items()}
+    fields["outdir"] = outdir
+    cmd = [os.path.join(os.path.dirname(os.path.abspath(__file__)), script)] + args.format(**fields).split()
+
+    runs = [run_tool(cmd, outdir) for _ in range(max(repeats, 1))]
+    wall, cpu, _ = min(runs)
+    n_records = manifest["counts"][count_key]
+
+    res = {"wall_s": round(wall, 4), "cpu_s": round(cpu, 4), "peak_rss_mb": round(max(e[2] for e in runs), 2),
+           "records": n_records, "unit": unit, "records_per_s": round(n_records / max(wall, 1e-9), 1)}
+
+    logger.warning("%s: %.3f s, %.0f %s/s, %.1f MiB peak RSS." % (
+        name, res["wall_s"], res["records_per_s"], unit, res["peak_rss_mb"]))
+
+    return res
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares results against a baseline.
+
+    :param dict results: benchmark results by name
+    :param dict baseline: earlier benchmark results by name
+    :param float tolerance: fractional increase reported as a regression
+    :return dict: {name: {metric: ratio to baseline}} of regressed benchmarks
+    """
+
+    regressions = {}
+    for name, res in results.items():
+
+        if name not in baseline:
+            continue
+
+        for metric in ("wall_s", "peak_rss_mb",):
+            base_value = baseline[name].get(metric)
+            if not base_value:
+                continue
+
+            ratio = res[metric] / base_value
+            if ratio > 1 + tolerance:
+                regressions.setdefault(name, {})[metric] = round(ratio, 3)
+                logger.warning("Regression in %s: %s is %.2fx the baseline (%s vs %s)." % (
+                    name, metric, ratio, res[metric], base_value))
+
+    return regressions
+
+
+def workflow(scale=DEFAULT_SCALE, benchmarks=None, repeats=DEFAULT_REPEATS, baseline=None,
+             tolerance=DEFAULT_TOLERANCE, seed=DEFAULT_SEED, output_dir=DEFAULT_OUTDIR):
+    """Generates synthetic data and benchmarks the tools on it.
+
+    :param str scale: data scale
+    :param str | None benchmarks: comma-separated benchmark names; None for all
+    :param int repeats: runs per benchmark
+    :param str | None baseline: optional results JSON to compare against
+    :param float tolerance: fractional increase over the baseline reported as a regression
+    :param int seed: random seed for the data
+    :param str output_dir: output directory
+    :return dict: results, including regressions when a baseline is given
+    """
+
+    names = list(BENCHMARKS) if benchmarks is None else benchmarks.split(",")
+    unknown = [e for e in names if e not in BENCHMARKS]
+    if unknown:
+        raise NotImplementedError("Unknown benchmarks %s. Choose from %s." % (
+            ", ".join(unknown), ", ".join(BENCHMARKS)))
+
+    manifest = generate_data(os.path.join(output_dir, DATA_DIR, scale), scale, seed)
+    runs_dir = os.path.join(output_dir, RUNS_DIR, scale)
+
+    results = {"scale": scale, "seed": seed, "repeats": repeats, "python": platform.python_version(),
+               "platform": platform.platform(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "benchmarks": collections.OrderedDict((name, run_benchmark(name, manifest, runs_dir, repeats))
+                                                     for name in names)}
+
+    if baseline is not None:
+        with open(baseline, "r") as baseline_fh:
+            baseline_results = json.load(baseline_fh)
+
+        if baseline_results.get("scale") != scale:
+            logger.warning("Baseline scale %s differs from %s." % (baseline_results.get("scale"), scale))
+
+        results["baseline"] = baseline
+        results["regressions"] = compare_results(results["benchmarks"], baseline_results["benchmarks"], tolerance)
+
+        if not results["regressions"]:
+            logger.warning("No regressions against %s." % baseline)
+
+    with open(os.path.join(output_dir, RESULTS_FILE), "w") as results_fh:
+        json.dump(results, results_fh, indent=2)
+
+    return results
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    results = workflow(scale=parsed_args["scale"], benchmarks=parsed_args["benchmarks"],
+                       repeats=parsed_args["repeats"], baseline=parsed_args["baseline"],
+                       tolerance=parsed_args["tolerance"], seed=parsed_args["seed"], output_dir=outdir)
+
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""Builds and queries persistent sidecars of a CCLE matrix: a memory-mapped binary cache and a row-offset index."""
+
+# See https://depmap.org/portal/download/all/
+
+import argparse
+import compressed_io
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import sys
+
+FILE_NEWLINE = "\n"
+CSV_DELIM = ","
+GENE_NAME_DELIM = " "
+CACHE_EXT = "ccache"
+ROW_INDEX_EXT = "ridx"
+CACHE_VERSION = "1"
+MATRIX_FILE = "matrix.f32"
+ROWS_FILE = "rows.txt"
+COLS_FILE = "cols.txt"
+META_FILE = "meta.json"
+MATRIX_DTYPE = np.float32
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-m", "--CCLE_matrix", type=str, required=True,
+                        help='CCLE matrix CSV with depMap IDs in first column and gene names in first row.')
+
+    parser.add_argument("-c", "--cache_dir", type=str, default=None,
+                        help="Optional cache directory. Default the matrix path with extension .%s." % CACHE_EXT)
+
+    parser.add_argument("-r", "--row_index", action="store_true",
+                        help="Flag to build the depMap ID to byte offset row index instead of the binary cache.")
+
+    parser.add_argument("-i", "--index_file", type=str, default=None,
+                        help="Optional row index path. Default the matrix path with extension .%s." % ROW_INDEX_EXT)
+
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Flag to rebuild the cache or index even if it is current.")
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def get_cache_path(ccle_matrix, cache_dir=None):
+    """Gets the path of the cache directory for a CCLE matrix.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None cache_dir: optional explicit cache directory
+    :return str: cache directory path
+    """
+
+    if cache_dir is not None:
+        return cache_dir
+
+    return ".".join((ccle_matrix, CACHE_EXT,))
+
+
+def get_source_signature(ccle_matrix):
+    """Gets the values used to detect changes to the source matrix.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :return dict: signature with absolute path, size, and modification time
+    """
+
+    matrix_stat = os.stat(ccle_matrix)
+    signature = {"version": CACHE_VERSION, "source": os.path.abspath(ccle_matrix),
+                 "size": matrix_stat.st_size, "mtime_ns": matrix_stat.st_mtime_ns}
+    return signature
+
+
+def is_cache_current(ccle_matrix, cache_dir=None):
+    """Determines if a cache exists and was built from the current matrix.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None cache_dir: optional explicit cache directory
+    :return bool: whether the cache may be reused
+    """
+
+    meta_file = os.path.join(get_cache_path(ccle_matrix, cache_dir), META_FILE)
+
+    if not os.path.exists(meta_file):
+        return False
+
+    with open(meta_file, "r") as meta_fh:
+        meta = json.load(meta_fh)
+
+    return meta.get("signature") == get_source_signature(ccle_matrix)
+
+
+def parse_values(fields):
+    """Parses the expression values of a matrix row.
+
+    :param list fields: value fields, without the depMap ID
+    :return numpy.ndarray: float32 values, NaN for empty or non-numeric fields
+    """
+
+    try:
+        return np.array(fields, dtype=MATRIX_DTYPE)
+    except ValueError:
+        pass
+
+    values = np.full(len(fields), np.nan, dtype=MATRIX_DTYPE)
+    for i, field in enumerate(fields):
+        try:
+            values[i] = float(field)
+        except ValueError:
+            continue
+
+    return values
+
+
+def build_cache(ccle_matrix, cache_dir=None):
+    """Converts a CCLE matrix CSV to a row-major float32 matrix with row and column name indexes in one pass.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None cache_dir: optional explicit cache directory
+    :return str: cache directory path
+    """
+
+    cache_path = get_cache_path(ccle_matrix, cache_dir)
+    temp_path = ".".join((cache_path, "tmp",))
+
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.mkdir(temp_path)
+
+    logger.info("Building CCLE cache %s" % cache_path)
+
+    row_names = []
+    with compressed_io.open_input(ccle_matrix) as ccle_fh, \
+            open(os.path.join(temp_path, MATRIX_FILE), "wb") as matrix_fh:
+
+        col_names = ccle_fh.readline().rstrip(FILE_NEWLINE).split(CSV_DELIM)[1:]
+
+        for line in ccle_fh:
+
+            line_split = line.rstrip(FILE_NEWLINE).split(CSV_DELIM)
+            if len(line_split) != len(col_names) + 1:
+                raise NotImplementedError("Row %s has %i fields; expected %i." %
+                                          (line_split[0], len(line_split), len(col_names) + 1))
+
+            row_names.append(line_split[0])
+            matrix_fh.write(parse_values(line_split[1:]).tobytes())
+
+    for names, names_file in ((row_names, ROWS_FILE,), (col_names, COLS_FILE,)):
+        with open(os.path.join(temp_path, names_file), "w") as names_fh:
+            names_fh.write("".join(name + FILE_NEWLINE for name in names))
+
+    with open(os.path.join(temp_path, META_FILE), "w") as meta_fh:
+        json.dump({"signature": get_source_signature(ccle_matrix), "shape": [len(row_names), len(col_names)],
+                   "dtype": np.dtype(MATRIX_DTYPE).str}, meta_fh)
+
+    # Only replace a prior cache once the new one is complete
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+    os.replace(temp_path, cache_path)
+
+    logger.info("Cached %i cell lines by %i genes." % (len(row_names), len(col_names)))
+    return cache_path
+
+
+def load_cache(ccle_matrix, cache_dir=None):
+    """Opens the cache for a CCLE matrix, building it first if it is missing or stale.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None cache_dir: optional explicit cache directory
+    :return dict: {"matrix": read-only numpy.memmap, "rows": list of depMap IDs, "cols": list of column names}
+    """
+
+    if not is_cache_current(ccle_matrix, cache_dir):
+        build_cache(ccle_matrix, cache_dir)
+
+    cache_path = get_cache_path(ccle_matrix, cache_dir)
+
+    with open(os.path.join(cache_path, META_FILE), "r") as meta_fh:
+        meta = json.load(meta_fh)
+
+    names = {}
+    for key, names_file in (("rows", ROWS_FILE,), ("cols", COLS_FILE,)):
+        with open(os.path.join(cache_path, names_file), "r") as names_fh:
+            names[key] = names_fh.read().splitlines()
+
+    n_rows, n_cols = meta["shape"]
+    if n_rows * n_cols == 0:
+        matrix = np.zeros((n_rows, n_cols), dtype=meta["dtype"])
+    else:
+        matrix = np.memmap(os.path.join(cache_path, MATRIX_FILE), dtype=meta["dtype"], mode="r",
+                           shape=(n_rows, n_cols))
+
+    cache = {"matrix": matrix, "rows": names["rows"], "cols": names["cols"]}
+    return cache
+
+
+def get_row_index_path(ccle_matrix, index_file=None):
+    """Gets the path of the row index for a CCLE matrix.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    if index_file is not None:
+        return index_file
+
+    return ".".join((ccle_matrix, ROW_INDEX_EXT,))
+
+
+def is_row_index_current(ccle_matrix, index_file=None):
+    """Determines if a row index exists and was built from the current matrix.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None index_file: optional explicit index path
+    :return bool: whether the index may be reused
+    """
+
+    index_path = get_row_index_path(ccle_matrix, index_file)
+
+    if not os.path.exists(index_path):
+        return False
+
+    with open(index_path, "r") as index_fh:
+        index = json.load(index_fh)
+
+    return index.get("signature") == get_source_signature(ccle_matrix)
+
+
+def get_row_id(line):
+    """Gets the depMap ID of a matrix row without decoding and splitting the whole row.
+
+    :param bytes line: matrix row
+    :return str: depMap ID; the whole row, less the newline, if it has no delimiter
+    """
+
+    end = line.find(CSV_DELIM.encode())
+
+    if end < 0:
+        return line.rstrip(b"\r\n").decode()
+
+    return line[:end].decode()
+
+
+def build_row_index(ccle_matrix, index_file=None):
+    """Records the byte offset and length of each cell-line row of a CCLE matrix CSV.
+
+    Offsets of a gzipped or bgzipped matrix are into the uncompressed data, so row lookups decompress the matrix up to
+    the last selected row.
+
+    :param str ccle_matrix: CCLE matrix CSV, plain, gzipped, or bgzipped
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    if ccle_matrix.endswith((".bz", ".bz2",)):
+        raise NotImplementedError("Byte-offset indexing of bzip2 matrices is not supported: %s" % ccle_matrix)
+
+    index_path = get_row_index_path(ccle_matrix, index_file)
+    temp_path = ".".join((index_path, "tmp",))
+
+    logger.info("Building CCLE row index %s" % index_path)
+
+    # Offsets are into the uncompressed matrix
+    rows = []
+    with compressed_io.open_input(ccle_matrix, "rb") as ccle_fh:
+
+        offset = len(ccle_fh.readline())
+        for line in ccle_fh:
+            rows.append((get_row_id(line), offset, len(line),))
+            offset += len(line)
+
+    with open(temp_path, "w") as index_fh:
+        json.dump({"signature": get_source_signature(ccle_matrix), "rows": rows}, index_fh)
+
+    # Only replace a prior index once the new one is complete
+    os.replace(temp_path, index_path)
+
+    logger.info("Indexed %i cell-line rows." % len(rows))
+    return index_path
+
+
+def load_row_index(ccle_matrix, index_file=None):
+    """Loads the row index for a CCLE matrix, building it first if it is missing or stale.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None index_file: optional explicit index path
+    :return dict: {depMap ID: (byte offset, byte length)}
+    """
+
+    if not is_row_index_current(ccle_matrix, index_file):
+        build_row_index(ccle_matrix, index_file)
+
+    with open(get_row_index_path(ccle_matrix, index_file), "r") as index_fh:
+        index = json.load(index_fh)
+
+    row_index = {row_id: (offset, length,) for row_id, offset, length in index["rows"]}
+    return row_index
+
+
+def get_gene_name(col_name):
+    """Gets the gene name of a matrix column, e.g. TSPAN6 from TSPAN6 (7105).
+
+    :param str col_name: column name
+    :return str: gene name
+    """
+
+    return col_name.split(GENE_NAME_DELIM)[0]
+
+
+def query_cache(cache, gene_set, cell_line_set):
+    """Slices the requested cell lines and genes from the cache, in matrix order.
+
+    :param dict cache: cache from load_cache
+    :param set gene_set: gene names
+    :param set cell_line_set: depMap IDs
+    :return tuple: (list of selected depMap IDs, list of selected column names, numpy.ndarray values)
+    """
+
+    row_idx = [i for i, name in enumerate(cache["rows"]) if name in cell_line_set]
+    col_idx = [i for i, name in enumerate(cache["cols"]) if get_gene_name(name) in gene_set]
+
+    # Only the pages holding the requested rows are read from the memory map
+    values = np.asarray(cache["matrix"][row_idx][:, col_idx])
+
+    res = ([cache["rows"][i] for i in row_idx], [cache["cols"][i] for i in col_idx], values,)
+    return res
+
+
+def format_values(values):
+    """Formats matrix values as the shortest strings that round-trip at float32 precision.
+
+    :param numpy.ndarray values: float32 values
+    :return list: strings, empty for NaN
+    """
+
+    res = ["" if np.isnan(e) else np.format_float_positional(e, trim="-") for e in values]
+    return res
+
+
+def workflow(ccle_matrix, cache_dir=None, force=False, row_index=False, index_file=None):
+    """Builds the CCLE cache or row index if it is missing, stale, or forced.
+
+    :param str ccle_matrix: CCLE matrix CSV
+    :param str | None cache_dir: optional explicit cache directory
+    :param bool force: rebuild even if the cache or index is current
+    :param bool row_index: build the row index instead of the binary cache
+    :param str | None index_file: optional explicit row index path
+    :return str: cache directory or row index path
+    """
+
+    if row_index:
+
+        if force or not is_row_index_current(ccle_matrix, index_file):
+            return build_row_index(ccle_matrix, index_file)
+
+        logger.info("Row index for %s is current." % ccle_matrix)
+        return get_row_index_path(ccle_matrix, index_file)
+
+    if force or not is_cache_current(ccle_matrix, cache_dir):
+        return build_cache(ccle_matrix, cache_dir)
+
+    logger.info("Cache for %s is current." % ccle_matrix)
+    return get_cache_path(ccle_matrix, cache_dir)
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    logger.setLevel(logging.INFO)
+    logger.info("Started %s" % sys.argv[0])
+
+    workflow(ccle_matrix=parsed_args["CCLE_matrix"], cache_dir=parsed_args["cache_dir"], force=parsed_args["force"],
+             row_index=parsed_args["row_index"], index_file=parsed_args["index_file"])
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
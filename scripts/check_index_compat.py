@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""Checks index sequences for compatibility in sequencing, as check_index_compat.r does, for thousands of libraries.
+
+As in the R script, each library's indices are compared as the string i5,i7 ignoring case, and pairs of libraries at
+or below the distance are flagged. Hamming distance is only defined for strings of equal length.
+
+Hamming mode 2-bit packs the bases of each index pair into 64-bit words, so the distance between two pairs is the
+popcount of the base positions set in their XOR. Distances are computed a block of rows against all later rows at a
+time with NumPy. Pairs whose comma falls at different positions, or with bases other than ACGT, are compared as
+strings.
+
+Levenshtein mode splits each string into dist + 1 pieces; by the pigeonhole principle two strings within the
+distance share one piece exactly, shifted by at most the distance. Only pairs sharing a piece are verified, their
+edit distances computed together in batches with NumPy.
+"""
+
+import argparse
+import compressed_io
+import get_transcript_structure
+import instrumentation
+import logging
+import numpy as np
+import os
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+CSV_DELIM = ","
+INDEX_DELIM = ","
+DEFAULT_OUTDIR = "."
+DEFAULT_EXT = "conflicts.txt"
+DEFAULT_DIST = 1
+DEFAULT_BLOCK_SIZE = 1024
+VERIFY_BATCH_SIZE = 100000
+LIBRARY_COL = "Library"
+I5_COL = "i5"
+I7_COL = "i7"
+BASES = "ACGT"
+BASES_PER_WORD = 32
+CONFLICTS_HEADER = ("Library_1", "Library_2", "Distance",)
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "check_index_compat_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+# Low bit of each 2-bit base
+BASE_MASK = np.uint64(0x5555555555555555)
+BYTE_POPCOUNTS = np.array([bin(e).count("1") for e in range(256)], dtype=np.uint8)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-i", "--indices", type=str, required=True,
+                        help='Text file with columns {Library, i5, i7}, tab, comma, or space-delimited, with header.')
+
+    parser.add_argument("-l", "--levenshtein", action="store_true",
+                        help='Use edit distance instead of Hamming distance.')
+
+    parser.add_argument("-d", "--dist", type=int, default=DEFAULT_DIST,
+                        help='Distance at/below which indices are flagged. Default %i.' % DEFAULT_DIST)
+
+    parser.add_argument("-b", "--block_size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='Rows per block of Hamming distances. Default %i.' % DEFAULT_BLOCK_SIZE)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. '
+                             'The indices may be plain, gzipped, or bgzipped regardless.')
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def read_indices(indices):
+    """Reads a library index table.
+
+    :param str indices: text file with columns {Library, i5, i7} and a header
+    :return list: (library, i5, i7) tuples with upper-case indices, in file order
+    """
+
+    with compressed_io.open_input(indices) as in_fh:
+        lines = [e.rstrip(FILE_NEWLINE) for e in in_fh if e.strip()]
+
+    header = lines[0]
+    delim = FILE_DELIM if FILE_DELIM in header else CSV_DELIM if CSV_DELIM in header else None
+    header_split = [e.strip().strip('"') for e in header.split(delim)]
+
+    try:
+        cols = [header_split.index(e) for e in (LIBRARY_COL, I5_COL, I7_COL,)]
+    except ValueError:
+        raise NotImplementedError("Index table must have columns %s." % ", ".join((LIBRARY_COL, I5_COL, I7_COL,)))
+
+    libraries = []
+    for line in lines[1:]:
+        line_split = [e.strip().strip('"') for e in line.split(delim)]
+        libraries.append((line_split[cols[0]], line_split[cols[1]].upper(), line_split[cols[2]].upper(),))
+
+    return libraries
+
+
+def is_packable(seq):
+    """Determines if an index is made only of ACGT.
+
+    :param str seq: index sequence
+    :return bool: whether the index may be 2-bit packed
+    """
+
+    return all(e in BASES for e in seq)
+
+
+def pack_indices(seqs):
+    """2-bit packs equal-length ACGT sequences into 64-bit words.
+
+    :param list seqs: sequences of equal length, only ACGT
+    :return numpy.ndarray: sequences x words uint64 array, unused trailing bits 0
+    """
+
+    n_bases = len(seqs[0]) if seqs else 0
+    n_words = max((n_bases + BASES_PER_WORD - 1) // BASES_PER_WORD, 1)
+    padded_len = n_words * BASES_PER_WORD
+
+    lookup = np.zeros(256, dtype=np.uint64)
+    for i, base in enumerate(BASES):
+        lookup[ord(base)] = i
+
+    # A base set to A in the padding of every sequence never differs
+    codes = np.frombuffer("".join(e.ljust(padded_len, BASES[0]) for e in seqs).encode(), dtype=np.uint8)
+    codes = lookup[codes].reshape(len(seqs), n_words, BASES_PER_WORD)
+
+    shifts = (2 * np.arange(BASES_PER_WORD - 1, -1, -1)).astype(np.uint64)
+    packed = np.bitwise_or.reduce(codes << shifts[None, None, :], axis=2)
+    return packed
+
+
+def popcount(words):
+    """Counts set bits per element.
+
+    :param numpy.ndarray words: uint64 array
+    :return numpy.ndarray: bit counts
+    """
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+
+    counts = BYTE_POPCOUNTS[np.ascontiguousarray(words).view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def get_packed_hamming_conflicts(packed, dist, block_size=DEFAULT_BLOCK_SIZE):
+    """Gets the pairs of packed sequences within a Hamming distance, a block of rows at a time.
+
+    :param numpy.ndarray packed: sequences x words from pack_indices
+    :param int dist: maximum distance
+    :param int block_size: rows per block
+    :return list: (i, j, distance) tuples with i < j, indices into packed
+    """
+
+    conflicts = []
+    n_seqs = packed.shape[0]
+
+    for start in range(0, n_seqs, block_size):
+
+        rows = packed[start:start + block_size]
+        diff = rows[:, None, :] ^ packed[None, start:, :]
+
+        # A base differs if either of its two bits differs
+        distances = popcount((diff | (diff >> np.uint64(1))) & BASE_MASK).sum(axis=2)
+
+        row_idx, col_idx = np.nonzero(distances <= dist)
+        i_idx, j_idx = row_idx + start, col_idx + start
+        keep = j_idx > i_idx
+
+        conflicts.extend(zip(i_idx[keep].tolist(), j_idx[keep].tolist(), distances[row_idx, col_idx][keep].tolist()))
+
+    return conflicts
+
+
+def hamming(seq_a, seq_b):
+    """Gets the Hamming distance of two equal-length strings.
+
+    :param str seq_a: first string
+    :param str seq_b: second string
+    :return int: number of differing positions
+    """
+
+    return sum(1 for a, b in zip(seq_a, seq_b) if a != b)
+
+
+def get_hamming_conflicts(libraries, dist, block_size=DEFAULT_BLOCK_SIZE):
+    """Gets the pairs of libraries whose indices are within a Hamming distance.
+
+    :param list libraries: (library, i5, i7) tuples from read_indices
+    :param int dist: maximum distance
+    :param int block_size: rows per block of packed distances
+    :return list: (i, j, distance) tuples with i < j, sorted
+    """
+
+    # Libraries with the same i5 and i7 lengths align their commas, so their distance is that of the packed bases
+    layouts = {}
+    irregular = []
+    for i, (_, i5, i7) in enumerate(libraries):
+        if is_packable(i5 + i7):
+            layouts.setdefault((len(i5), len(i7),), []).append(i)
+        else:
+            irregular.append(i)
+
+    conflicts = []
+    for ids in layouts.values():
+        packed = pack_indices([libraries[i][1] + libraries[i][2] for i in ids])
+        conflicts.extend((ids[i], ids[j], d,) for i, j, d in get_packed_hamming_conflicts(packed, dist, block_size))
+
+    # Remaining equal-length pairs straddle layouts or have other characters
+    seqs = [INDEX_DELIM.join(e[1:]) for e in libraries]
+    groups = list(layouts.values()) + [[i] for i in irregular]
+    for a in range(len(groups)):
+        for b in range(a + 1, len(groups)):
+
+            if len(seqs[groups[a][0]]) != len(seqs[groups[b][0]]):
+                continue
+
+            for i in groups[a]:
+                for j in groups[b]:
+                    d = hamming(seqs[i], seqs[j])
+                    if d <= dist:
+                        conflicts.append((min(i, j), max(i, j), d,))
+
+    conflicts.sort()
+    return conflicts
+
+
+def get_partitions(length, n_parts):
+    """Splits a length into contiguous pieces as evenly as possible.
+
+    :param int length: string length
+    :param int n_parts: number of pieces
+    :return list: (start, end) tuples
+    """
+
+    bounds = [length * k // n_parts for k in range(n_parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_edit_distances(seqs_a, seqs_b):
+    """Gets the edit distances of pairs of strings together, one DP row for all pairs at a time.
+
+    Within a row, a cell is the minimum over earlier cells of their substitution or deletion score plus one per
+    insertion between them, a running minimum once each cell is offset by its column. Padding past a string's end
+    never feeds its own cells.
+
+    :param list seqs_a: first strings
+    :param list seqs_b: second strings, paired with seqs_a
+    :return numpy.ndarray: edit distances
+    """
+
+    lens_a = np.array([len(e) for e in seqs_a], dtype=np.int64)
+    lens_b = np.array([len(e) for e in seqs_b], dtype=np.int64)
+    max_a, max_b = int(lens_a.max(initial=0)), int(lens_b.max(initial=0))
+
+    # Distinct pad characters never match each other
+    codes_a = np.frombuffer("".join(e.ljust(max_a, "\x00") for e in seqs_a).encode(), dtype=np.uint8)
+    codes_b = np.frombuffer("".join(e.ljust(max_b, "\x01") for e in seqs_b).encode(), dtype=np.uint8)
+    codes_a, codes_b = codes_a.reshape(len(seqs_a), max_a), codes_b.reshape(len(seqs_b), max_b)
+
+    cols = np.arange(max_b + 1, dtype=np.int16)
+    prev = np.broadcast_to(cols, (len(seqs_a), max_b + 1)).copy()
+    distances = prev[np.arange(len(seqs_a)), lens_b].copy()
+
+    for i in range(1, max_a + 1):
+
+        costs = (codes_a[:, i - 1:i] != codes_b).astype(np.int16)
+        scores = np.empty_like(prev)
+        scores[:, 0] = i
+        scores[:, 1:] = np.minimum(prev[:, 1:] + 1, prev[:, :-1] + costs)
+
+        prev = np.minimum.accumulate(scores - cols, axis=1) + cols
+
+        done = lens_a == i
+        distances[done] = prev[done, lens_b[done]]
+
+    return distances
+
+
+def get_levenshtein_conflicts(libraries, dist):
+    """Gets the pairs of libraries whose indices are within an edit distance, verifying only partition matches.
+
+    :param list libraries: (library, i5, i7) tuples from read_indices
+    :param int dist: maximum distance
+    :return list: (i, j, distance) tuples with i < j, sorted
+    """
+
+    seqs = [INDEX_DELIM.join(e[1:]) for e in libraries]
+    n_parts = dist + 1
+
+    # Index every piece of every string by its length, piece number, and sequence
+    pieces = {}
+    for i, seq in enumerate(seqs):
+        for p, (start, end) in enumerate(get_partitions(len(seq), n_parts)):
+            pieces.setdefault((len(seq), p, seq[start:end],), []).append(i)
+
+    lengths = {len(e) for e in seqs}
+    candidates = set()
+
+    for j, seq in enumerate(seqs):
+        for length in lengths:
+
+            if abs(length - len(seq)) > dist:
+                continue
+
+            for p, (start, end) in enumerate(get_partitions(length, n_parts)):
+                for shift in range(-dist, dist + 1):
+
+                    seq_start = start + shift
+                    if seq_start < 0 or seq_start + end - start > len(seq):
+                        continue
+
+                    for i in pieces.get((length, p, seq[seq_start:seq_start + end - start],), ()):
+                        if i != j:
+                            candidates.add((min(i, j), max(i, j),))
+
+    candidates = sorted(candidates)
+    conflicts = []
+
+    for start in range(0, len(candidates), VERIFY_BATCH_SIZE):
+        batch = candidates[start:start + VERIFY_BATCH_SIZE]
+        distances = get_edit_distances([seqs[i] for i, _ in batch], [seqs[j] for _, j in batch])
+        conflicts.extend((i, j, d,) for (i, j), d in zip(batch, distances.tolist()) if d <= dist)
+
+    return conflicts
+
+
+def format_conflicts(libraries, conflicts):
+    """Formats flagged library pairs as check_index_compat.r reports them.
+
+    :param list libraries: (library, i5, i7) tuples from read_indices
+    :param list conflicts: (i, j, distance) tuples
+    :return str: message
+    """
+
+    if not conflicts:
+        return "All index sequences are compatible."
+
+    pairs = [CSV_DELIM.join((libraries[i][0], libraries[j][0],)) for i, j, _ in conflicts]
+    return "Libraries with index incompatibility: %s" % " | ".join(pairs)
+
+
+def workflow(indices, levenshtein=False, dist=DEFAULT_DIST, block_size=DEFAULT_BLOCK_SIZE, output_dir=DEFAULT_OUTDIR,
+             compression=None):
+    """Checks all pairs of library indices for compatibility.
+
+    :param str indices: text file with columns {Library, i5, i7}
+    :param bool levenshtein: use edit distance instead of Hamming distance
+    :param int dist: distance at/below which indices are flagged
+    :param int block_size: rows per block of packed Hamming distances
+    :param str output_dir: output directory
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return list: (library, library, distance) flagged pairs
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("parse"):
+        libraries = read_indices(indices)
+    metrics.add(instrumentation.READ, len(libraries))
+
+    with metrics.stage("match"):
+        if levenshtein:
+            conflicts = get_levenshtein_conflicts(libraries, dist)
+        else:
+            conflicts = get_hamming_conflicts(libraries, dist, block_size)
+
+    logger.warning(format_conflicts(libraries, conflicts))
+
+    flagged = [(libraries[i][0], libraries[j][0], d,) for i, j, d in conflicts]
+
+    outfile = compressed_io.get_output_name(
+        os.path.join(output_dir, get_transcript_structure.replace_extension(os.path.basename(indices), DEFAULT_EXT)),
+        compression)
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh, metrics.stage("write"):
+        out_fh.write(FILE_DELIM.join(CONFLICTS_HEADER) + FILE_NEWLINE)
+        for lib_a, lib_b, d in flagged:
+            out_fh.write(FILE_DELIM.join((lib_a, lib_b, str(d),)) + FILE_NEWLINE)
+
+    metrics.add(instrumentation.WRITTEN, len(flagged))
+
+    return flagged
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(indices=parsed_args["indices"], levenshtein=parsed_args["levenshtein"], dist=parsed_args["dist"],
+             block_size=parsed_args["block_size"], output_dir=outdir, compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    main()
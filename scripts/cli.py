@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Runs the scripts as subcommands of one entry point.
+
+A subcommand's module, and with it pysam, pybedtools, or numpy, is imported only when the subcommand runs, and the
+module's log file handlers are added by its main at run time and removed when it returns. The batch subcommand runs
+a file of subcommands in one process, so drivers that call many operations pay the import cost once.
+"""
+
+import argparse
+import collections
+import importlib
+import logging
+import shlex
+import sys
+import time
+
+FILE_NEWLINE = "\n"
+FILE_COMMENT_CHAR = "#"
+BATCH_COMMAND = "batch"
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Subcommand: (module, description)
+COMMANDS = collections.OrderedDict((
+    ("filter-gtf", ("filter_gtf", "Filters a GTF by transcript IDs.")),
+    ("trx-to-gene", ("trx_id_to_gene", "Maps transcript IDs to gene names.")),
+    ("extract", ("extract_transcript_sequences", "Extracts transcript sequences from a genome and GTF.")),
+    ("extract-trx-ids", ("extract_sequences_from_trx_ids", "Extracts transcriptome sequences by transcript ID.")),
+    ("extract-genes", ("extract_sequences_from_genes", "Extracts transcriptome sequences by gene name.")),
+    ("region-bed", ("get_region_bed", "Gets UTR and CDS regions in transcript coordinates as a BED file.")),
+    ("trim-bam", ("trim_bam", "Trims flanking sequences from reads in a BAM.")),
+    ("filter-alignments", ("run_alignment_filter", "Filters alignments by edit distance or filter expressions.")),
+    ("filter-ccle", ("filter_CCLE_matrix", "Filters a CCLE matrix by genes and cell lines.")),
+))
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    # Subcommand arguments are left unparsed, so -h reaches the subcommand's own parser
+    for command, (module, description) in COMMANDS.items():
+        subparsers.add_parser(command, help=description, add_help=False)
+
+    batch_parser = subparsers.add_parser(BATCH_COMMAND, help="Runs subcommands listed in a file in one process.")
+
+    batch_parser.add_argument("commands", type=str,
+                              help="Text file of subcommands with their arguments, one per line. "
+                                   "Lines starting with # are skipped.")
+
+    batch_parser.add_argument("-k", "--keep_going", action="store_true",
+                              help="Flag to continue with the next subcommand when one fails.")
+
+    parsed_args, command_args = parser.parse_known_args(args)
+    if parsed_args.command == BATCH_COMMAND and command_args:
+        parser.error("unrecognized arguments: %s" % " ".join(command_args))
+
+    parsed_args = vars(parsed_args)
+    parsed_args["args"] = command_args
+    return parsed_args
+
+
+def run_command(command, args):
+    """Runs a subcommand in this process.
+
+    :param str command: subcommand name
+    :param list args: subcommand arguments
+    """
+
+    if command not in COMMANDS:
+        raise NotImplementedError("Unknown subcommand %s. Choose from %s." % (command, ", ".join(COMMANDS)))
+
+    module = importlib.import_module(COMMANDS[command][0])
+
+    # Handlers the module's main adds are removed so repeated runs do not duplicate log lines
+    module_logger = logging.getLogger(module.__name__)
+    prior_handlers = list(module_logger.handlers)
+
+    try:
+        module.main(args)
+    finally:
+        for handler in module_logger.handlers[:]:
+            if handler not in prior_handlers:
+                module_logger.removeHandler(handler)
+                handler.close()
+
+
+def read_batch(commands):
+    """Reads a batch file of subcommands.
+
+    :param str commands: text file of subcommands with their arguments, one per line
+    :return list: lists of subcommand name and arguments
+    """
+
+    with open(commands, "r") as commands_fh:
+        res = [shlex.split(line) for line in commands_fh
+               if line.strip() and not line.lstrip().startswith(FILE_COMMENT_CHAR)]
+
+    return res
+
+
+def run_batch(commands, keep_going=False):
+    """Runs subcommands listed in a file, in order.
+
+    :param str commands: text file of subcommands with their arguments, one per line
+    :param bool keep_going: continue with the next subcommand when one fails
+    :return int: number of failed subcommands
+    """
+
+    n_failed = 0
+    for command_args in read_batch(commands):
+
+        start_time = time.time()
+        try:
+            run_command(command_args[0], command_args[1:])
+        except (Exception, SystemExit) as e:
+            n_failed += 1
+            logger.error("Failed %s: %s" % (" ".join(command_args), e))
+            if not keep_going:
+                raise
+            continue
+
+        logger.warning("Ran %s in %.2f s." % (" ".join(command_args), time.time() - start_time))
+
+    return n_failed
+
+
+def main(args=None):
+    """Runs a subcommand when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
+
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(console_handler)
+
+    if parsed_args["command"] == BATCH_COMMAND:
+        n_failed = run_batch(parsed_args["commands"], parsed_args["keep_going"])
+        if n_failed > 0:
+            sys.exit(1)
+        return
+
+    run_command(parsed_args["command"], parsed_args["args"])
+
+
+if __name__ == "__main__":
+    main()
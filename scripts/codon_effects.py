@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+"""Annotates SNVs and MNVs in transcript CDS coordinates with codon and HGVS-style protein changes.
+
+Bases are encoded A, C, G, T as 0-3 and codons as 16 * b1 + 4 * b2 + b3, the order of the codon_permutations tables.
+The amino acid of any codon is then a gather from a 65-element array, and the effect of any codon change a gather
+from a 65 x 65 array indexed by reference and alternate codon code, where code 64 holds codons with ambiguous bases.
+Variants are annotated a chunk at a time with these gathers, grouped by width, instead of per-variant dict lookups.
+
+The codon_permutations tables summarize the same lookup per codon. A shipped table may be loaded in place of the
+standard genetic code, its reference amino acids giving the codon code to amino acid array and with it the effect
+lookup, and tables may be regenerated for any MNP width under either code.
+"""
+
+import argparse
+import compressed_io
+import get_transcript_structure
+import instrumentation
+import logging
+import numpy as np
+import os
+import pysam
+import sys
+import transcriptome_index
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+COMMENT_CHAR = "#"
+NA_STR = "NA"
+DEFAULT_OUTDIR = "."
+DEFAULT_EXT = "codon_effects.txt"
+DEFAULT_CHUNK_SIZE = 1000000
+CDS_NAME = "CDS"
+CODON_LEN = 3
+BASES = "ACGT"
+INVALID_BASE = 4
+INVALID_CODON = 64
+UNKNOWN_AA = "X"
+STOP_AA = "*"
+
+# Standard genetic code in TCAG order, re-ordered to ACGT codon codes below
+GENETIC_CODE_TCAG = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+
+# Effect classes, ordered so the most severe codon change of an MNV is the maximum
+SYNONYMOUS = 0
+MISSENSE = 1
+STOP_LOST = 2
+NONSENSE = 3
+UNKNOWN = 4
+EFFECT_NAMES = ("synonymous", "missense", "stop_lost", "nonsense", "unknown",)
+
+TABLE_HEADER = ("Codon", "AA_alternates", "AA_changes",)
+TABLE_CHANGE_DELIM = ","
+SNP_TABLE_NAME = "codon_lookup.var_type-snp.txt"
+MNP_TABLE_NAME = "codon_lookup.var_type-mnp.mnp_bases-%i.txt"
+
+OUTPUT_HEADER = ("Transcript_ID", "CDS_position", "Ref", "Alt", "Codon_number", "Ref_codons", "Alt_codons",
+                 "Ref_AA", "Alt_AA", "Effect", "HGVSp",)
+
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "codon_effects_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def _get_base_codes():
+    """Gets the byte to base code translation array.
+
+    :return numpy.ndarray: 256 base codes, INVALID_BASE for bytes other than ACGTU in either case
+    """
+
+    base_codes = np.full(256, INVALID_BASE, dtype=np.uint8)
+    for i, base in enumerate(BASES):
+        base_codes[ord(base)] = i
+        base_codes[ord(base.lower())] = i
+
+    base_codes[ord("U")] = base_codes[ord("T")]
+    base_codes[ord("u")] = base_codes[ord("T")]
+    return base_codes
+
+
+def _get_codon_aas():
+    """Gets the amino acid of each codon code.
+
+    :return numpy.ndarray: 65 amino acids as ASCII codes, UNKNOWN_AA for INVALID_CODON
+    """
+
+    tcag_index = {b: i for i, b in enumerate("TCAG")}
+    codon_aas = np.full(INVALID_CODON + 1, ord(UNKNOWN_AA), dtype=np.uint8)
+
+    for code in range(INVALID_CODON):
+        codon = CODONS[code]
+        codon_aas[code] = ord(GENETIC_CODE_TCAG[16 * tcag_index[codon[0]] + 4 * tcag_index[codon[1]] +
+                                               tcag_index[codon[2]]])
+
+    return codon_aas
+
+
+def get_effect_lookup(codon_aas):
+    """Gets the effect class of each reference and alternate codon pair.
+
+    :param numpy.ndarray codon_aas: 65 amino acids as ASCII codes indexed by codon code
+    :return numpy.ndarray: 65 x 65 effect classes indexed by reference and alternate codon code
+    """
+
+    ref_aas = codon_aas[:, None]
+    alt_aas = codon_aas[None, :]
+    stop, unknown = ord(STOP_AA), ord(UNKNOWN_AA)
+
+    effects = np.full((INVALID_CODON + 1, INVALID_CODON + 1), MISSENSE, dtype=np.uint8)
+    effects[np.broadcast_to(ref_aas == alt_aas, effects.shape)] = SYNONYMOUS
+    effects[np.broadcast_to((ref_aas == stop) & (alt_aas != stop), effects.shape)] = STOP_LOST
+    effects[np.broadcast_to((ref_aas != stop) & (alt_aas == stop), effects.shape)] = NONSENSE
+    effects[np.broadcast_to((ref_aas == unknown) | (alt_aas == unknown), effects.shape)] = UNKNOWN
+    return effects
+
+
+CODONS = tuple(a + b + c for a in BASES for b in BASES for c in BASES)
+BASE_CODES = _get_base_codes()
+BASE_CHARS = np.frombuffer((BASES + "N").encode(), dtype=np.uint8)
+CODON_AAS = _get_codon_aas()
+EFFECT_LOOKUP = get_effect_lookup(CODON_AAS)
+AA_ALPHABET = "".join(sorted(set(GENETIC_CODE_TCAG)))
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-v", "--variants", type=str, required=False,
+                        help='Tab-delimited variants with transcript ID, 1-based CDS position, ref, and alt. '
+                             'Ref and alt must be the same length. Lines starting with # are skipped.')
+
+    parser.add_argument("-f", "--fasta", type=str, required=False,
+                        help='Transcript FASTA, named by transcript ID or with pipe-delimited APPRIS headers.')
+
+    parser.add_argument("-r", "--region_bed", type=str, required=False,
+                        help='Region BED with UTR5, CDS, and UTR3 records in transcript coordinates.')
+
+    parser.add_argument("-c", "--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Number of variants annotated per array operation. Default %i.' % DEFAULT_CHUNK_SIZE)
+
+    parser.add_argument("-t", "--codon_table", type=str, required=False, default=None,
+                        help='Optional codon_permutations table, e.g. codon_lookup.var_type-snp.txt, whose reference '
+                             'amino acids replace the standard genetic code.')
+
+    parser.add_argument("-w", "--write_table", type=int, required=False, default=None,
+                        help='Write the codon_permutations amino acid change table for this MNP width, 1 for SNPs, '
+                             'instead of annotating variants.')
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. '
+                             'The variants, region BED, and codon table may be plain, gzipped, or bgzipped regardless.')
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def encode_seq(seq):
+    """Encodes a nucleotide sequence as base codes.
+
+    :param str seq: DNA or RNA sequence
+    :return numpy.ndarray: uint8 base codes, INVALID_BASE for ambiguous bases
+    """
+
+    return BASE_CODES[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def encode_codons(bases):
+    """Encodes base code triplets as codon codes.
+
+    :param numpy.ndarray bases: base codes with a last axis of length 3
+    :return numpy.ndarray: codon codes, INVALID_CODON for triplets with an ambiguous base
+    """
+
+    bases = bases.astype(np.int64)
+    codes = np.where((bases > 3).any(axis=-1), INVALID_CODON,
+                     16 * bases[..., 0] + 4 * bases[..., 1] + bases[..., 2])
+    return codes
+
+
+def get_table_name(mnp_bases):
+    """Gets the codon_permutations table filename for an MNP width.
+
+    :param int mnp_bases: MNP width, 1 for SNPs
+    :return str: table filename
+    """
+
+    if mnp_bases == 1:
+        return SNP_TABLE_NAME
+
+    return MNP_TABLE_NAME % mnp_bases
+
+
+def get_alternate_mask(mnp_bases):
+    """Gets the alternate codons reachable from each codon by a variant of a given width.
+
+    A variant narrower than a codon changes exactly that many of its bases, in any positions. A variant as wide as
+    a codon or wider may leave any of its bases unchanged, so it reaches every other codon.
+
+    :param int mnp_bases: MNP width, 1 for SNPs
+    :return numpy.ndarray: 64 x 64 boolean mask indexed by reference and alternate codon code
+    """
+
+    if mnp_bases < 1:
+        raise NotImplementedError("MNP width must be at least 1.")
+
+    codes = np.arange(INVALID_CODON)
+    digits = np.stack((codes // 16, (codes // 4) % 4, codes % 4), axis=1)
+    distances = (digits[:, None, :] != digits[None, :, :]).sum(axis=2)
+
+    if mnp_bases < CODON_LEN:
+        return distances == mnp_bases
+
+    return distances > 0
+
+
+def generate_codon_table(mnp_bases, codon_aas=None):
+    """Generates the amino acid changes reachable from each codon by a variant of a given width.
+
+    :param int mnp_bases: MNP width, 1 for SNPs
+    :param numpy.ndarray | None codon_aas: optional amino acids by codon code from load_codon_table; default the
+    standard genetic code
+    :return numpy.ndarray: 64 x len(AA_ALPHABET) boolean array indexed by codon code and alternate amino acid
+    """
+
+    codon_aas = CODON_AAS if codon_aas is None else codon_aas
+    alt_aas = np.frombuffer(AA_ALPHABET.encode(), dtype=np.uint8)
+    aa_masks = codon_aas[:INVALID_CODON, None] == alt_aas[None, :]
+
+    # A codon reaches an amino acid if any of its reachable alternate codons encodes it
+    table = get_alternate_mask(mnp_bases).astype(np.int64) @ aa_masks.astype(np.int64) > 0
+    return table
+
+
+def load_codon_table(table_file):
+    """Loads a codon_permutations amino acid change table.
+
+    The reference amino acid of each codon is read from its p. changes, so the table also gives the genetic code.
+
+    :param str table_file: table with codon, number of alternate amino acids, and comma-delimited p. changes
+    :return tuple: (65 amino acids as ASCII codes indexed by codon code, 64 x len(AA_ALPHABET) boolean array indexed
+    by codon code and alternate amino acid)
+    """
+
+    codon_aas = np.full(INVALID_CODON + 1, ord(UNKNOWN_AA), dtype=np.uint8)
+    table = np.zeros((INVALID_CODON, len(AA_ALPHABET)), dtype=bool)
+    seen = np.zeros(INVALID_CODON, dtype=bool)
+
+    with compressed_io.open_input(table_file) as table_fh:
+        for i, line in enumerate(table_fh):
+
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if i == 0 and tuple(line_split) == TABLE_HEADER:
+                continue
+
+            if len(line_split) < 3 or len(line_split[0]) != CODON_LEN or not line_split[2] or \
+                    int(encode_codons(encode_seq(line_split[0]))) == INVALID_CODON:
+                raise NotImplementedError("Invalid codon or no amino acid changes on line %i of %s." %
+                                          (i + 1, table_file))
+
+            code = int(encode_codons(encode_seq(line_split[0])))
+            for change in line_split[2].split(TABLE_CHANGE_DELIM):
+
+                # Changes are p.R>A, R the reference and A an alternate amino acid
+                if len(change) != 5 or change[2] not in AA_ALPHABET or change[4] not in AA_ALPHABET:
+                    raise NotImplementedError("Invalid amino acid change %s in %s." % (change, table_file))
+
+                codon_aas[code] = ord(change[2])
+                table[code, AA_ALPHABET.index(change[4])] = True
+
+            seen[code] = True
+
+    if not seen.all():
+        raise NotImplementedError("%s does not list all %i codons." % (table_file, INVALID_CODON))
+
+    return codon_aas, table
+
+
+def write_codon_table(table, outfile, codon_aas=None, compression=None):
+    """Writes an amino acid change table in the codon_permutations format.
+
+    :param numpy.ndarray table: 64 x len(AA_ALPHABET) boolean array from generate_codon_table
+    :param str outfile: output filepath
+    :param numpy.ndarray | None codon_aas: optional amino acids by codon code; default the standard genetic code
+    :param str | None compression: output compression, gzip, bgzip, or None
+    """
+
+    codon_aas = CODON_AAS if codon_aas is None else codon_aas
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+        out_fh.write(FILE_DELIM.join(TABLE_HEADER) + FILE_NEWLINE)
+
+        for code, codon in enumerate(CODONS):
+            ref_aa = chr(codon_aas[code])
+            changes = ["p.%s>%s" % (ref_aa, AA_ALPHABET[i]) for i in np.flatnonzero(table[code])]
+            out_fh.write(FILE_DELIM.join((codon, str(len(changes)), TABLE_CHANGE_DELIM.join(changes),)) +
+                         FILE_NEWLINE)
+
+
+def load_cds_bounds(region_bed):
+    """Loads CDS bounds from a region BED.
+
+    :param str region_bed: region BED with UTR5, CDS, and UTR3 records in transcript coordinates
+    :return dict: {transcript ID without version: (CDS start, CDS end)}, 0-based half-open
+    """
+
+    cds_bounds = {}
+    with compressed_io.open_input(region_bed) as bed_fh:
+        for line in bed_fh:
+
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if len(line_split) < 4 or line_split[3] != CDS_NAME:
+                continue
+
+            cds_bounds[line_split[0].split(transcriptome_index.TRX_EXT)[0]] = (int(line_split[1]), int(line_split[2]))
+
+    return cds_bounds
+
+
+def iter_cds_seqs(fasta, cds_bounds, trx_ids=None):
+    """Iterates the CDS sequences of transcripts with CDS bounds.
+
+    :param str fasta: transcript FASTA
+    :param dict cds_bounds: CDS bounds from load_cds_bounds
+    :param set | None trx_ids: optional transcript IDs without version to restrict to
+    :return generator: (transcript ID without version, CDS sequence) tuples in FASTA order
+    """
+
+    with pysam.FastxFile(fasta, "r") as in_fh:
+        for rec in in_fh:
+
+            trx_id = transcriptome_index.parse_header(rec.name)[2]
+            if trx_id not in cds_bounds or (trx_ids is not None and trx_id not in trx_ids):
+                continue
+
+            cds_start, cds_end = cds_bounds[trx_id]
+            yield trx_id, rec.sequence[cds_start:cds_end]
+
+
+def load_cds_codes(fasta, cds_bounds, trx_ids=None):
+    """Loads the encoded CDS sequences of transcripts into one array.
+
+    :param str fasta: transcript FASTA
+    :param dict cds_bounds: CDS bounds from load_cds_bounds
+    :param set | None trx_ids: optional transcript IDs without version to restrict to
+    :return tuple: (concatenated base codes, {transcript ID without version: (offset, CDS length)})
+    """
+
+    seqs = []
+    cds_offsets = {}
+    offset = 0
+
+    for trx_id, cds_seq in iter_cds_seqs(fasta, cds_bounds, trx_ids):
+        seqs.append(cds_seq)
+        cds_offsets[trx_id] = (offset, len(cds_seq))
+        offset += len(cds_seq)
+
+    cds_codes = encode_seq("".join(seqs))
+    return cds_codes, cds_offsets
+
+
+def annotate_variants(cds_codes, offsets, lengths, positions, ref_codes, alt_codes, effect_lookup=None):
+    """Annotates variants of one width with their codon changes and effect classes.
+
+    :param numpy.ndarray cds_codes: concatenated CDS base codes from load_cds_codes
+    :param numpy.ndarray offsets: per-variant offset of its transcript CDS in cds_codes
+    :param numpy.ndarray lengths: per-variant CDS length of its transcript
+    :param numpy.ndarray positions: per-variant 0-based CDS position
+    :param numpy.ndarray ref_codes: variants x width reference base codes
+    :param numpy.ndarray alt_codes: variants x width alternate base codes
+    :param numpy.ndarray | None effect_lookup: optional effect lookup from get_effect_lookup; default EFFECT_LOOKUP
+    :return dict: per-variant codon_index, n_codons, ref_window and alt_window (variants x spanned bases),
+    ref_codons and alt_codons (variants x max codons), ref_match, and effect arrays
+    """
+
+    effect_lookup = EFFECT_LOOKUP if effect_lookup is None else effect_lookup
+    width = ref_codes.shape[1]
+    max_codons = (width + 1) // CODON_LEN + 1
+
+    frames = positions % CODON_LEN
+    codon_index = positions // CODON_LEN
+    n_codons = (frames + width - 1) // CODON_LEN + 1
+
+    # Reference bases of every codon the variant may span; bases past the CDS end are ambiguous
+    window = codon_index[:, None] * CODON_LEN + np.arange(max_codons * CODON_LEN)[None, :]
+    in_cds = window < lengths[:, None]
+    ref_window = np.where(in_cds, cds_codes[np.where(in_cds, offsets[:, None] + window, 0)], INVALID_BASE)
+    ref_window = ref_window.astype(np.uint8)
+
+    var_cols = frames[:, None] + np.arange(width)[None, :]
+    alt_window = ref_window.copy()
+    np.put_along_axis(alt_window, var_cols, alt_codes, axis=1)
+
+    ref_match = (np.take_along_axis(ref_window, var_cols, axis=1) == ref_codes).all(axis=1) & \
+                (positions + width <= lengths) & (alt_codes < INVALID_BASE).all(axis=1)
+
+    ref_codons = encode_codons(ref_window.reshape(-1, max_codons, CODON_LEN))
+    alt_codons = encode_codons(alt_window.reshape(-1, max_codons, CODON_LEN))
+
+    spanned = np.arange(max_codons)[None, :] < n_codons[:, None]
+    effect = np.where(spanned, effect_lookup[ref_codons, alt_codons], SYNONYMOUS).max(axis=1)
+    effect[~ref_match] = UNKNOWN
+
+    res = {"codon_index": codon_index, "n_codons": n_codons, "ref_window": ref_window, "alt_window": alt_window,
+           "ref_codons": ref_codons, "alt_codons": alt_codons, "ref_match": ref_match, "effect": effect}
+    return res
+
+
+def format_hgvs(codon_number, ref_aas, alt_aas, effect):
+    """Formats an HGVS-style protein change with one-letter amino acids.
+
+    :param int codon_number: 1-based number of the first spanned codon
+    :param str ref_aas: reference amino acids of the spanned codons
+    :param str alt_aas: alternate amino acids of the spanned codons
+    :param int effect: effect class
+    :return str: p. change
+    """
+
+    if effect == UNKNOWN:
+        return "p.?"
+
+    changed = [i for i, (r, a) in enumerate(zip(ref_aas, alt_aas)) if r != a]
+
+    if not changed:
+        if len(ref_aas) == 1:
+            return "p.%s%i=" % (ref_aas, codon_number)
+        return "p.%s%i_%s%i=" % (ref_aas[0], codon_number, ref_aas[-1], codon_number + len(ref_aas) - 1)
+
+    first, last = changed[0], changed[-1]
+
+    if first == last:
+        if ref_aas[first] == STOP_AA:
+            return "p.%s%i%sext%s?" % (STOP_AA, codon_number + first, alt_aas[first], STOP_AA)
+        return "p.%s%i%s" % (ref_aas[first], codon_number + first, alt_aas[first])
+
+    return "p.%s%i_%s%idelins%s" % (ref_aas[first], codon_number + first, ref_aas[last], codon_number + last,
+                                    alt_aas[first:last + 1])
+
+
+def to_strings(codes, lookup):
+    """Converts rows of codes to strings with a byte lookup.
+
+    :param numpy.ndarray codes: rows x columns codes
+    :param numpy.ndarray lookup: uint8 ASCII character per code
+    :return list: one str per row
+    """
+
+    chars = np.ascontiguousarray(lookup[codes], dtype=np.uint8)
+    return [e.decode() for e in chars.view("S%i" % chars.shape[1]).ravel().tolist()]
+
+
+def format_annotations(records, annotations, codon_aas=None):
+    """Formats annotated variants as output lines.
+
+    :param list records: (transcript ID, CDS position, ref, alt) string tuples
+    :param dict annotations: annotations from annotate_variants for the same variants
+    :param numpy.ndarray | None codon_aas: optional amino acids by codon code; default the standard genetic code
+    :return list: output lines
+    """
+
+    codon_aas = CODON_AAS if codon_aas is None else codon_aas
+    ref_aa_rows = to_strings(annotations["ref_codons"], codon_aas)
+    alt_aa_rows = to_strings(annotations["alt_codons"], codon_aas)
+
+    ref_codon_rows = to_strings(annotations["ref_window"], BASE_CHARS)
+    alt_codon_rows = to_strings(annotations["alt_window"], BASE_CHARS)
+
+    lines = []
+    for i, (record, codon_index, n_codons, ref_match, effect) in enumerate(zip(
+            records, annotations["codon_index"].tolist(), annotations["n_codons"].tolist(),
+            annotations["ref_match"].tolist(), annotations["effect"].tolist())):
+
+        if not ref_match:
+            lines.append(FILE_DELIM.join(record + (NA_STR,) * 5 + (EFFECT_NAMES[UNKNOWN], "p.?",)))
+            continue
+
+        ref_aas, alt_aas = ref_aa_rows[i][:n_codons], alt_aa_rows[i][:n_codons]
+        lines.append(FILE_DELIM.join(record + (
+            str(codon_index + 1), ref_codon_rows[i][:n_codons * CODON_LEN], alt_codon_rows[i][:n_codons * CODON_LEN],
+            ref_aas, alt_aas, EFFECT_NAMES[effect], format_hgvs(codon_index + 1, ref_aas, alt_aas, effect),)))
+
+    return lines
+
+
+def annotate_chunk(records, cds_codes, cds_offsets, codon_aas=None):
+    """Annotates a chunk of variant records, grouping them by width for the array operations.
+
+    :param list records: (transcript ID, 1-based CDS position, ref, alt) string tuples
+    :param numpy.ndarray cds_codes: concatenated CDS base codes from load_cds_codes
+    :param dict cds_offsets: CDS offsets and lengths from load_cds_codes
+    :param numpy.ndarray | None codon_aas: optional amino acids by codon code from load_codon_table; default the
+    standard genetic code
+    :return list: output lines in record order
+    """
+
+    effect_lookup = EFFECT_LOOKUP if codon_aas is None else get_effect_lookup(codon_aas)
+
+    lines = [None] * len(records)
+    groups = {}
+
+    for i, (trx_id, position, ref, alt) in enumerate(records):
+
+        if trx_id.split(transcriptome_index.TRX_EXT)[0] not in cds_offsets or len(ref) != len(alt) or \
+                not ref or not position.isdigit() or int(position) < 1:
+            lines[i] = FILE_DELIM.join(records[i] + (NA_STR,) * 5 + (EFFECT_NAMES[UNKNOWN], "p.?",))
+            continue
+
+        groups.setdefault(len(ref), []).append(i)
+
+    for width, indices in groups.items():
+
+        group_records = [records[i] for i in indices]
+        bounds = np.array([cds_offsets[e[0].split(transcriptome_index.TRX_EXT)[0]] for e in group_records],
+                          dtype=np.int64).reshape(-1, 2)
+        positions = np.array([int(e[1]) - 1 for e in group_records], dtype=np.int64)
+        ref_codes = encode_seq("".join(e[2] for e in group_records)).reshape(-1, width)
+        alt_codes = encode_seq("".join(e[3] for e in group_records)).reshape(-1, width)
+
+        annotations = annotate_variants(cds_codes, bounds[:, 0], bounds[:, 1], positions, ref_codes, alt_codes,
+                                        effect_lookup)
+
+        for i, line in zip(indices, format_annotations(group_records, annotations, codon_aas)):
+            lines[i] = line
+
+    return lines
+
+
+def iter_variant_chunks(variants, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterates chunks of variant records.
+
+    :param str variants: tab-delimited variants with transcript ID, 1-based CDS position, ref, and alt
+    :param int chunk_size: records per chunk
+    :return generator: lists of (transcript ID, CDS position, ref, alt) string tuples
+    """
+
+    chunk = []
+    with compressed_io.open_input(variants) as in_fh:
+        for line in in_fh:
+
+            if line.startswith(COMMENT_CHAR) or not line.strip():
+                continue
+
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if len(line_split) < 4:
+                raise NotImplementedError("Variant lines must have transcript ID, CDS position, ref, and alt.")
+
+            chunk.append((line_split[0], line_split[1], line_split[2].upper(), line_split[3].upper(),))
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def get_variant_trx_ids(variants):
+    """Gets the transcript IDs of a variants file.
+
+    :param str variants: tab-delimited variants with transcript ID in the first column
+    :return set: transcript IDs without version
+    """
+
+    with compressed_io.open_input(variants) as in_fh:
+        trx_ids = {line.split(FILE_DELIM, 1)[0].split(transcriptome_index.TRX_EXT)[0] for line in in_fh
+                   if not line.startswith(COMMENT_CHAR)}
+
+    return trx_ids
+
+
+def workflow(variants, fasta, region_bed, output_dir=DEFAULT_OUTDIR, chunk_size=DEFAULT_CHUNK_SIZE, codon_table=None,
+             compression=None):
+    """Annotates variants in transcript CDS coordinates with codon and protein changes.
+
+    :param str variants: tab-delimited variants with transcript ID, 1-based CDS position, ref, and alt
+    :param str fasta: transcript FASTA
+    :param str region_bed: region BED with CDS records in transcript coordinates
+    :param str output_dir: output directory
+    :param int chunk_size: variants annotated per array operation
+    :param str | None codon_table: optional codon_permutations table giving the genetic code
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str: output filepath
+    """
+
+    codon_aas = None
+    if codon_table is not None:
+        codon_aas, table = load_codon_table(codon_table)
+
+        # A table edited by hand may list changes its own genetic code cannot reach
+        if not any(np.array_equal(table, generate_codon_table(e, codon_aas)) for e in range(1, CODON_LEN + 1)):
+            logger.warning("Amino acid changes in %s do not match SNP or MNP changes under its genetic code; only its "
+                           "reference amino acids are used." % codon_table)
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("parse"):
+        cds_bounds = load_cds_bounds(region_bed)
+        cds_codes, cds_offsets = load_cds_codes(fasta, cds_bounds, get_variant_trx_ids(variants))
+
+    outfile = compressed_io.get_output_name(
+        os.path.join(output_dir, get_transcript_structure.replace_extension(os.path.basename(variants), DEFAULT_EXT)),
+        compression)
+
+    n_variants = 0
+    n_unknown = 0
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+        out_fh.write(FILE_DELIM.join(OUTPUT_HEADER) + FILE_NEWLINE)
+
+        for chunk in metrics.timed_iter("parse", iter_variant_chunks(variants, chunk_size)):
+
+            with metrics.stage("match"):
+                lines = annotate_chunk(chunk, cds_codes, cds_offsets, codon_aas)
+
+            with metrics.stage("write"):
+                out_fh.write(FILE_NEWLINE.join(lines) + FILE_NEWLINE)
+
+            chunk_unknown = sum(1 for e in lines if e.endswith("p.?"))
+            n_variants += len(lines)
+            n_unknown += chunk_unknown
+
+            metrics.add(instrumentation.READ, len(lines))
+            metrics.add(instrumentation.WRITTEN, len(lines) - chunk_unknown)
+            metrics.add(instrumentation.FILTERED, chunk_unknown)
+
+    if n_unknown > 0:
+        logger.warning("%i of %i variants could not be annotated: unknown transcript, position outside the CDS, "
+                       "ambiguous bases, unequal ref and alt lengths, or ref mismatch." % (n_unknown, n_variants))
+
+    return outfile
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    if parsed_args["write_table"] is not None:
+        mnp_bases = parsed_args["write_table"]
+        codon_aas = None if parsed_args["codon_table"] is None else load_codon_table(parsed_args["codon_table"])[0]
+        outfile = compressed_io.get_output_name(os.path.join(outdir, get_table_name(mnp_bases)),
+                                                parsed_args["compression"])
+        write_codon_table(generate_codon_table(mnp_bases, codon_aas), outfile, codon_aas, parsed_args["compression"])
+        return
+
+    if parsed_args["variants"] is None or parsed_args["fasta"] is None or parsed_args["region_bed"] is None:
+        raise NotImplementedError("Annotation requires variants, a transcript FASTA, and a region BED.")
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(variants=parsed_args["variants"], fasta=parsed_args["fasta"], region_bed=parsed_args["region_bed"],
+             output_dir=outdir, chunk_size=parsed_args["chunk_size"], codon_table=parsed_args["codon_table"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    main()
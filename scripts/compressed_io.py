@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Transparent reading and writing of gzip and BGZF files, with compression and decompression in background threads.
+
+Inputs are opened as compressed when they start with the gzip magic bytes, whatever their extension, so plain,
+gzipped, and bgzipped files are read alike. Compressed inputs are decompressed by a read-ahead thread while the caller
+parses the previous chunk.
+
+Outputs are compressed in independent blocks by a pool of threads; zlib releases the GIL, so blocks compress in
+parallel while the caller keeps producing records, and completed blocks are written in order. gzip output is a
+multi-member gzip file. bgzip output is BGZF, with blocks of at most 64 KiB and the BGZF end-of-file marker, so it may
+be indexed with samtools faidx or tabix (the latter requiring coordinate-sorted input).
+"""
+
+import collections
+import concurrent.futures
+import gzip
+import io
+import logging
+import os
+import queue
+import struct
+import threading
+import zlib
+
+GZIP = "gzip"
+BGZIP = "bgzip"
+COMPRESSION_TYPES = {GZIP, BGZIP}
+COMPRESSED_EXT = ".gz"
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_LEVEL = 6
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+GZIP_BLOCK_SIZE = 1048576
+READ_SIZE = 1048576
+READ_AHEAD = 4
+
+# BGZF blocks hold at most 0xff00 bytes of input so that a block stays under 64 KiB even when incompressible
+BGZF_BLOCK_SIZE = 65280
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+BGZF_BLOCK_OVERHEAD = 26
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+def compress_gzip_block(data, level=DEFAULT_LEVEL):
+    """Compresses data as a standalone gzip member.
+
+    :param bytes data: uncompressed data
+    :param int level: zlib compression level
+    :return bytes: gzip member
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    res = compressor.compress(data) + compressor.flush()
+    return res
+
+
+def compress_bgzf_block(data, level=DEFAULT_LEVEL):
+    """Compresses data as a BGZF block.
+
+    :param bytes data: uncompressed data, at most BGZF_BLOCK_SIZE bytes
+    :param int level: zlib compression level
+    :return bytes: BGZF block
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    # BSIZE in the header is the total block size minus one
+    res = b"".join((BGZF_HEADER, struct.pack("<H", len(deflated) + BGZF_BLOCK_OVERHEAD - 1), deflated,
+                    struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))))
+    return res
+
+
+class BlockWriter(io.RawIOBase):
+    """Binary writer that compresses fixed-size blocks in a thread pool and writes them in order."""
+
+    def __init__(self, filename, compression=BGZIP, threads=DEFAULT_THREADS, level=DEFAULT_LEVEL, executor=None):
+        """Constructor for BlockWriter.
+
+        :param str filename: output filepath
+        :param str compression: gzip or bgzip
+        :param int threads: compression threads; 0 to compress in the calling thread
+        :param int level: zlib compression level
+        :param concurrent.futures.Executor | None executor: optional pool shared by many writers, used in place of
+        starting threads; it is left running on close
+        """
+
+        if compression not in COMPRESSION_TYPES:
+            raise NotImplementedError("Compression must be one of %s." % ", ".join(sorted(COMPRESSION_TYPES)))
+
+        super(BlockWriter, self).__init__()
+        self.compression = compression
+        self.level = level
+        self.block_size = BGZF_BLOCK_SIZE if compression == BGZIP else GZIP_BLOCK_SIZE
+        self.compress_block = compress_bgzf_block if compression == BGZIP else compress_gzip_block
+        self.threads = threads
+        self.own_executor = executor is None and threads > 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads) if self.own_executor else executor
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.out_fh = open(filename, "wb")
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        """Buffers data, submitting each full block for compression.
+
+        :param bytes b: data to write
+        :return int: number of bytes written
+        """
+
+        self.buffer += b
+
+        if len(self.buffer) >= self.block_size:
+            view = memoryview(self.buffer)
+            n_full = len(self.buffer) - len(self.buffer) % self.block_size
+
+            for i in range(0, n_full, self.block_size):
+                self._submit(bytes(view[i:i + self.block_size]))
+
+            view.release()
+            del self.buffer[:n_full]
+
+        return len(b)
+
+    def _submit(self, block):
+        """Compresses a block, writing completed blocks in order.
+
+        :param bytes block: uncompressed block
+        """
+
+        if self.executor is None:
+            self.out_fh.write(self.compress_block(block, self.level))
+            return
+
+        self.pending.append(self.executor.submit(self.compress_block, block, self.level))
+
+        # Bound the blocks in flight, and write any that are already done
+        while len(self.pending) > 2 * max(self.threads, 1) or (self.pending and self.pending[0].done()):
+            self.out_fh.write(self.pending.popleft().result())
+
+    def close(self):
+        """Compresses the remaining data and closes the file, ending BGZF with the EOF marker."""
+
+        if self.closed:
+            return
+
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+
+            while self.pending:
+                self.out_fh.write(self.pending.popleft().result())
+
+            if self.compression == BGZIP:
+                self.out_fh.write(BGZF_EOF)
+        finally:
+            if self.own_executor:
+                self.executor.shutdown()
+            self.out_fh.close()
+            super(BlockWriter, self).close()
+
+
+class ReadAheadReader(io.RawIOBase):
+    """Binary reader that decompresses a gzip or BGZF file in a background thread."""
+
+    def __init__(self, filename, read_size=READ_SIZE, read_ahead=READ_AHEAD):
+        """Constructor for ReadAheadReader.
+
+        :param str filename: gzip or BGZF filepath
+        :param int read_size: uncompressed bytes per chunk
+        :param int read_ahead: chunks to decompress ahead of the reader
+        """
+
+        super(ReadAheadReader, self).__init__()
+        self.in_fh = gzip.open(filename, "rb")
+        self.read_size = read_size
+        self.chunks = queue.Queue(read_ahead)
+        self.stop = threading.Event()
+        self.chunk = b""
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        """Decompresses chunks into the queue until end of file, an error, or close."""
+
+        try:
+            while not self.stop.is_set():
+                data = self.in_fh.read(self.read_size)
+                self._put(data)
+                if not data:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        """Queues an item, giving up if the reader is closed.
+
+        :param bytes | Exception item: chunk, empty at end of file, or the error raised decompressing
+        """
+
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        """Reads decompressed data into a buffer.
+
+        :param bytearray b: buffer to fill
+        :return int: number of bytes read, 0 at end of file
+        """
+
+        if self.pos >= len(self.chunk):
+
+            if self.eof:
+                return 0
+
+            item = self.chunks.get()
+            if isinstance(item, Exception):
+                raise item
+
+            if not item:
+                self.eof = True
+                return 0
+
+            self.chunk, self.pos = item, 0
+
+        n = min(len(b), len(self.chunk) - self.pos)
+        b[:n] = self.chunk[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        """Stops the decompression thread and closes the file."""
+
+        if self.closed:
+            return
+
+        self.stop.set()
+        self.thread.join()
+        self.in_fh.close()
+        super(ReadAheadReader, self).close()
+
+
+def is_compressed(filename):
+    """Checks whether a file is gzip or BGZF compressed.
+
+    :param str filename: filepath
+    :return bool: whether the file starts with the gzip magic bytes
+    """
+
+    with open(filename, "rb") as in_fh:
+        res = in_fh.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    return res
+
+
+def get_output_name(outfile, compression=None):
+    """Adds the compressed extension to an output filepath if compressing.
+
+    :param str outfile: output filepath
+    :param str | None compression: gzip, bgzip, or None
+    :return str: output filepath
+    """
+
+    if compression is None or outfile.endswith(COMPRESSED_EXT):
+        return outfile
+
+    return outfile + COMPRESSED_EXT
+
+
+def open_input(filename, mode="r", threaded=True):
+    """Opens a plain, gzip, or BGZF file for reading.
+
+    :param str filename: filepath
+    :param str mode: r or rt for text, rb for binary
+    :param bool threaded: decompress in a background thread; False for a seekable handle
+    :return file: readable file handle
+    """
+
+    if not is_compressed(filename):
+        return open(filename, mode)
+
+    if not threaded:
+        return gzip.open(filename, "rt" if mode == "r" else mode)
+
+    in_fh = io.BufferedReader(ReadAheadReader(filename), buffer_size=READ_SIZE)
+
+    if mode == "rb":
+        return in_fh
+
+    return io.TextIOWrapper(in_fh)
+
+
+def open_output(filename, mode="w", compression=None, threads=DEFAULT_THREADS, level=DEFAULT_LEVEL, executor=None):
+    """Opens a plain, gzip, or BGZF file for writing.
+
+    :param str filename: filepath
+    :param str mode: w or wt for text, wb for binary
+    :param str | None compression: gzip, bgzip, or None for plain output
+    :param int threads: compression threads; 0 to compress in the calling thread
+    :param int level: zlib compression level
+    :param concurrent.futures.Executor | None executor: optional compression pool shared with other outputs
+    :return file: writable file handle
+    """
+
+    if compression is None:
+        return open(filename, mode)
+
+    block_writer = BlockWriter(filename, compression, threads, level, executor)
+    out_fh = io.BufferedWriter(block_writer, buffer_size=BGZF_BLOCK_SIZE)
+
+    if mode == "wb":
+        return out_fh
+
+    return io.TextIOWrapper(out_fh)
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+"""Demultiplexes reads by i5/i7 index into per-library outputs, tolerating index mismatches.
+
+Libraries come from the same {Library, i5, i7} table as check_index_compat. For each index position, every sequence
+within the allowed Hamming distance of a library index, over ACGTN, is hashed to that index ahead of time, so a read
+is assigned with two dict lookups. A sequence within the distance of two indices, and closer to neither, is
+ambiguous and its reads are left undetermined, as are reads whose corrected i7 and i5 are not a library's pair.
+
+Reads come from FASTQ, with the index in the last field of the Illumina header comment (1:N:0:i7+i5), or from an
+unaligned BAM with the index in the BC tag (i7-i5). Only the observed indices of a chunk of reads are sent to worker
+processes, which return the chunk positions of each library's reads; the main process keeps the records themselves,
+FASTQ text or BAM records, and streams each library's group to its output without converting them.
+"""
+
+import argparse
+import collections
+import check_index_compat
+import compressed_io
+import concurrent.futures
+import instrumentation
+import itertools
+import logging
+import multiprocessing
+import os
+import pysam
+import sys
+import time
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+FASTQ_LINES = 4
+FASTQ_COMMENT_DELIM = " "
+FASTQ_INDEX_DELIM = ":"
+INDEX_PAIR_DELIMS = ("+", "-",)
+BARCODE_TAG = "BC"
+NEIGHBOR_BASES = "ACGTN"
+DEFAULT_OUTDIR = "."
+DEFAULT_MISMATCHES = 1
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_THREADS = 1
+UNDETERMINED = "Undetermined"
+FASTQ_EXT = ".fastq"
+COMPRESSED_EXT = ".gz"
+BAM_EXT = ".bam"
+READ_NAMES = ("R1", "R2",)
+MATE_SUFFIXES = ("/1", "/2",)
+COUNTS_EXT = "demux.counts.txt"
+COUNTS_HEADER = ("Library", "Reads", "Perfect_index_reads", "Corrected_index_reads",)
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Neighbor table value of sequences equally close to two indices
+AMBIGUOUS = None
+
+# Outcome codes of reads that are not assigned
+NO_INDEX = -1
+AMBIGUOUS_INDEX = -2
+UNMATCHED_INDEX = -3
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "demultiplex_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+# Per-process lookup tables, set by _init_worker
+_lookup = None
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-i", "--indices", type=str, required=True,
+                        help='Text file with columns {Library, i5, i7}, as for check_index_compat.')
+
+    parser.add_argument("-1", "--read1", type=str, required=False, default=None,
+                        help='Read 1 FASTQ, optionally gzipped, with i7+i5 at the end of each header.')
+
+    parser.add_argument("-2", "--read2", type=str, required=False, default=None,
+                        help='Optional read 2 FASTQ, in the same order as read 1.')
+
+    parser.add_argument("-b", "--bam", type=str, required=False, default=None,
+                        help='Unaligned BAM with the i7-i5 index in the %s tag. Replaces -1 and -2.' % BARCODE_TAG)
+
+    parser.add_argument("-m", "--mismatches", type=int, default=DEFAULT_MISMATCHES,
+                        help='Mismatches allowed per index. Default %i.' % DEFAULT_MISMATCHES)
+
+    parser.add_argument("-c", "--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Reads per chunk. Default %i.' % DEFAULT_CHUNK_SIZE)
+
+    parser.add_argument("-t", "--threads", type=int, default=DEFAULT_THREADS,
+                        help='Number of worker processes. Default %i.' % DEFAULT_THREADS)
+
+    parser.add_argument("-z", "--gzip", action="store_true",
+                        help='Flag to gzip FASTQ outputs, in background threads.')
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def get_neighbors(seq, max_mismatches):
+    """Gets every sequence within a Hamming distance of a sequence, over ACGTN.
+
+    :param str seq: index sequence
+    :param int max_mismatches: maximum number of mismatches
+    :return generator: (neighbor, number of mismatches) tuples
+    """
+
+    yield seq, 0
+
+    for n_mismatches in range(1, min(max_mismatches, len(seq)) + 1):
+        for positions in itertools.combinations(range(len(seq)), n_mismatches):
+
+            alternates = [[b for b in NEIGHBOR_BASES if b != seq[p]] for p in positions]
+            for bases in itertools.product(*alternates):
+
+                neighbor = list(seq)
+                for p, b in zip(positions, bases):
+                    neighbor[p] = b
+                yield "".join(neighbor), n_mismatches
+
+
+def build_neighbor_table(index_seqs, max_mismatches):
+    """Hashes every sequence within a Hamming distance of any index to its closest index.
+
+    :param iterable index_seqs: index sequences of one index position
+    :param int max_mismatches: maximum number of mismatches
+    :return dict: {observed sequence: (index sequence, number of mismatches) or AMBIGUOUS}
+    """
+
+    table = {}
+    distances = {}
+
+    for index_seq in sorted(set(index_seqs)):
+        for neighbor, n_mismatches in get_neighbors(index_seq, max_mismatches):
+
+            prior = distances.get(neighbor)
+            if prior is None or n_mismatches < prior:
+                table[neighbor] = (index_seq, n_mismatches,)
+                distances[neighbor] = n_mismatches
+            elif n_mismatches == prior:
+                table[neighbor] = AMBIGUOUS
+
+    return table
+
+
+def build_lookup(libraries, max_mismatches=DEFAULT_MISMATCHES):
+    """Builds the read index lookup tables of a library table.
+
+    :param list libraries: (library, i5, i7) tuples from check_index_compat.read_indices
+    :param int max_mismatches: mismatches allowed per index
+    :return dict: i7 and i5 neighbor tables, index lengths, and the {(i7, i5): library number} pair map
+    """
+
+    i7_lens = {len(e[2]) for e in libraries}
+    i5_lens = {len(e[1]) for e in libraries}
+    if len(i7_lens) != 1 or len(i5_lens) != 1:
+        raise NotImplementedError("All i7 indices must have one length, and all i5 indices another.")
+
+    pairs = {}
+    for i, (library, i5, i7) in enumerate(libraries):
+        if (i7, i5,) in pairs:
+            raise NotImplementedError("Libraries %s and %s have the same indices." % (
+                libraries[pairs[(i7, i5,)]][0], library))
+        pairs[(i7, i5,)] = i
+
+    lookup = {"i7": build_neighbor_table([e[2] for e in libraries], max_mismatches), "i7_len": i7_lens.pop(),
+              "i5": build_neighbor_table([e[1] for e in libraries], max_mismatches), "i5_len": i5_lens.pop(),
+              "pairs": pairs}
+
+    for key in ("i7", "i5",):
+        n_ambiguous = sum(1 for e in lookup[key].values() if e is AMBIGUOUS)
+        if n_ambiguous > 0:
+            logger.warning("%i %s sequences are within %i mismatches of more than one index and will not be "
+                           "assigned." % (n_ambiguous, key, max_mismatches))
+
+    return lookup
+
+
+def split_read_index(read_index):
+    """Splits an observed dual index into i7 and i5.
+
+    :param str read_index: i7+i5 or i7-i5, or a single i7
+    :return tuple: (i7, i5), i5 empty for a single index
+    """
+
+    for delim in INDEX_PAIR_DELIMS:
+        if delim in read_index:
+            i7, i5 = read_index.split(delim, 1)
+            return i7, i5
+
+    return read_index, ""
+
+
+def assign_read(read_index, lookup):
+    """Assigns an observed index to a library.
+
+    :param str | None read_index: observed i7+i5 or i7-i5
+    :param dict lookup: tables from build_lookup
+    :return tuple: (library number or unassigned outcome code, total index mismatches)
+    """
+
+    if not read_index:
+        return NO_INDEX, 0
+
+    i7, i5 = split_read_index(read_index.upper())
+    i7_hit = lookup["i7"].get(i7[:lookup["i7_len"]], False)
+    i5_hit = lookup["i5"].get(i5[:lookup["i5_len"]], False)
+
+    if i7_hit is AMBIGUOUS or i5_hit is AMBIGUOUS:
+        return AMBIGUOUS_INDEX, 0
+
+    if i7_hit is False or i5_hit is False:
+        return UNMATCHED_INDEX, 0
+
+    library = lookup["pairs"].get((i7_hit[0], i5_hit[0],))
+    if library is None:
+        return UNMATCHED_INDEX, 0
+
+    return library, i7_hit[1] + i5_hit[1]
+
+
+def new_counts(n_libraries):
+    """Creates empty assignment counts.
+
+    :param int n_libraries: number of libraries
+    :return dict: per-library perfect and corrected read counts, and counts of reads left undetermined by outcome
+    """
+
+    counts = {"perfect": [0] * n_libraries, "corrected": [0] * n_libraries, NO_INDEX: 0, AMBIGUOUS_INDEX: 0,
+              UNMATCHED_INDEX: 0}
+    return counts
+
+
+def merge_counts(totals, counts):
+    """Adds a chunk's counts to running totals.
+
+    :param dict totals: totals from new_counts, updated in place
+    :param dict counts: counts of one chunk
+    """
+
+    for key in ("perfect", "corrected",):
+        totals[key] = [a + b for a, b in zip(totals[key], counts[key])]
+
+    for key in (NO_INDEX, AMBIGUOUS_INDEX, UNMATCHED_INDEX,):
+        totals[key] += counts[key]
+
+
+def demultiplex_chunk(read_indices, lookup, n_libraries):
+    """Assigns a chunk of reads and groups their chunk positions by library.
+
+    :param list read_indices: observed indices of the chunk's reads
+    :param dict lookup: tables from build_lookup
+    :param int n_libraries: number of libraries
+    :return tuple: ({library number or -1 for undetermined: list of chunk positions}, counts)
+    """
+
+    groups = collections.defaultdict(list)
+    counts = new_counts(n_libraries)
+
+    for position, read_index in enumerate(read_indices):
+
+        library, n_mismatches = assign_read(read_index, lookup)
+
+        if library < 0:
+            counts[library] += 1
+            groups[-1].append(position)
+            continue
+
+        counts["perfect" if n_mismatches == 0 else "corrected"][library] += 1
+        groups[library].append(position)
+
+    return dict(groups), counts
+
+
+def _init_worker(lookup, n_libraries):
+    """Stores the lookup tables in a worker process.
+
+    :param dict lookup: tables from build_lookup
+    :param int n_libraries: number of libraries
+    """
+
+    global _lookup
+    _lookup = (lookup, n_libraries,)
+
+
+def _demultiplex_worker(read_indices):
+    """Demultiplexes a chunk in a worker process.
+
+    :param list read_indices: observed indices of the chunk's reads
+    :return tuple: result of demultiplex_chunk
+    """
+
+    return demultiplex_chunk(read_indices, *_lookup)
+
+
+def iter_demultiplexed(chunks, lookup, n_libraries, threads=DEFAULT_THREADS):
+    """Demultiplexes chunks, optionally across a process pool, yielding results in input order.
+
+    Only the observed indices are sent to the workers; the records stay in this process.
+
+    :param iterable chunks: (observed indices, records) tuples
+    :param dict lookup: tables from build_lookup
+    :param int n_libraries: number of libraries
+    :param int threads: number of worker processes
+    :return generator: (records, {library number or -1: chunk positions}, counts) tuples
+    """
+
+    if threads <= 1:
+        _init_worker(lookup, n_libraries)
+        for read_indices, records in chunks:
+            yield (records,) + _demultiplex_worker(read_indices)
+        return
+
+    with multiprocessing.Pool(threads, initializer=_init_worker, initargs=(lookup, n_libraries,)) as pool:
+
+        pending = collections.deque()
+        for read_indices, records in chunks:
+
+            pending.append((records, pool.apply_async(_demultiplex_worker, (read_indices,)),))
+
+            if len(pending) >= 2 * threads:
+                records, result = pending.popleft()
+                yield (records,) + result.get()
+
+        while pending:
+            records, result = pending.popleft()
+            yield (records,) + result.get()
+
+
+def open_fastq(fastq):
+    """Opens a FASTQ for text reading.
+
+    :param str fastq: FASTQ, optionally gzipped or bgzipped
+    :return file: open file handle
+    """
+
+    return compressed_io.open_input(fastq)
+
+
+def get_fastq_index(header):
+    """Gets the index from an Illumina FASTQ header line.
+
+    :param str header: header line
+    :return str | None: index, or None if the header has no comment
+    """
+
+    header_split = header.rstrip(FILE_NEWLINE).split(FASTQ_COMMENT_DELIM, 1)
+    if len(header_split) == 1:
+        return None
+
+    return header_split[1].rsplit(FASTQ_INDEX_DELIM, 1)[-1]
+
+
+def get_fastq_name(header):
+    """Gets the read name from a FASTQ header line, without a /1 or /2 mate suffix.
+
+    :param str header: header line
+    :return str: read name
+    """
+
+    name = header.rstrip(FILE_NEWLINE).split(None, 1)[0]
+
+    if name[-2:] in MATE_SUFFIXES:
+        return name[:-2]
+
+    return name
+
+
+def iter_fastq_chunks(read1, read2=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Groups FASTQ records into chunks.
+
+    :param str read1: read 1 FASTQ
+    :param str | None read2: optional read 2 FASTQ, whose reads must have the names of read 1's in the same order
+    :param int chunk_size: reads per chunk
+    :return generator: (observed indices, records) tuples; records are record text, or (R1 text, R2 text) tuples
+    """
+
+    fhs = [open_fastq(e) for e in (read1, read2,) if e is not None]
+
+    try:
+        read_indices, records = [], []
+        n_reads = 0
+        while True:
+
+            texts = ["".join(itertools.islice(fh, FASTQ_LINES)) for fh in fhs]
+            if not any(texts):
+                break
+
+            n_reads += 1
+            headers = [e[:e.find(FILE_NEWLINE)] for e in texts]
+
+            if len(texts) > 1 and (not all(texts) or get_fastq_name(headers[0]) != get_fastq_name(headers[1])):
+                raise NotImplementedError("Read 1 and read 2 FASTQs are out of step at read %i: %s and %s." % (
+                    n_reads, headers[0] or "end of file", headers[1] or "end of file"))
+
+            read_indices.append(get_fastq_index(headers[0]))
+            records.append(texts[0] if len(texts) == 1 else tuple(texts))
+
+            if len(records) == chunk_size:
+                yield read_indices, records
+                read_indices, records = [], []
+
+        if records:
+            yield read_indices, records
+
+    finally:
+        for fh in fhs:
+            fh.close()
+
+
+def iter_bam_chunks(input_af, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Groups unaligned BAM records into chunks.
+
+    :param pysam.AlignmentFile input_af: open input BAM
+    :param int chunk_size: reads per chunk
+    :return generator: (observed indices, pysam.AlignedSegment records) tuples
+    """
+
+    read_indices, records = [], []
+    for align_seg in input_af.fetch(until_eof=True):
+
+        read_indices.append(align_seg.get_tag(BARCODE_TAG) if align_seg.has_tag(BARCODE_TAG) else None)
+        records.append(align_seg)
+
+        if len(records) == chunk_size:
+            yield read_indices, records
+            read_indices, records = [], []
+
+    if records:
+        yield read_indices, records
+
+
+def get_output_names(library, output_dir, is_bam=False, paired=False, compress=False):
+    """Gets the output filepaths of a library.
+
+    :param str library: library name
+    :param str output_dir: output directory
+    :param bool is_bam: BAM output
+    :param bool paired: paired FASTQ output
+    :param bool compress: gzip FASTQ output
+    :return list: output filepaths, one per read for FASTQ
+    """
+
+    if is_bam:
+        return [os.path.join(output_dir, library + BAM_EXT)]
+
+    ext = FASTQ_EXT + (COMPRESSED_EXT if compress else "")
+    return [os.path.join(output_dir, ".".join((library, e,)) + ext) for e in READ_NAMES[:2 if paired else 1]]
+
+
+class OutputWriters(object):
+    """Per-library output files, opened on a library's first read."""
+
+    def __init__(self, names, output_dir, header=None, paired=False, compress=False):
+        """Constructor for OutputWriters.
+
+        :param list names: library names, followed by the undetermined name
+        :param str output_dir: output directory
+        :param pysam.AlignmentHeader | None header: header of BAM output, or None for FASTQ output
+        :param bool paired: paired FASTQ output
+        :param bool compress: gzip FASTQ output
+        """
+
+        self.names = names
+        self.output_dir = output_dir
+        self.header = header
+        self.paired = paired
+        self.compress = compress
+        self.handles = {}
+
+        # One compression pool serves every library's outputs
+        self.executor = concurrent.futures.ThreadPoolExecutor(compressed_io.DEFAULT_THREADS) if compress else None
+
+    def _open(self, library):
+        """Opens the outputs of a library.
+
+        :param int library: library number, -1 for undetermined
+        :return list: open output handles
+        """
+
+        outfiles = get_output_names(self.names[library], self.output_dir, self.header is not None, self.paired,
+                                    self.compress)
+
+        if self.header is not None:
+            return [pysam.AlignmentFile(outfiles[0], "wb", header=self.header)]
+
+        return [compressed_io.open_output(e, compression=compressed_io.GZIP if self.compress else None, level=1,
+                                          executor=self.executor) for e in outfiles]
+
+    def write(self, library, records):
+        """Writes a group of records to a library's outputs.
+
+        :param int library: library number, -1 for undetermined
+        :param list records: FASTQ text, (R1 text, R2 text) tuples, or pysam.AlignedSegment records
+        """
+
+        if library not in self.handles:
+            self.handles[library] = self._open(library)
+        handles = self.handles[library]
+
+        if self.header is not None:
+            for record in records:
+                handles[0].write(record)
+        elif self.paired:
+            handles[0].write("".join(e[0] for e in records))
+            handles[1].write("".join(e[1] for e in records))
+        else:
+            handles[0].write("".join(records))
+
+    def close(self):
+        """Closes all outputs."""
+
+        for handles in self.handles.values():
+            for handle in handles:
+                handle.close()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def write_counts(outfile, names, totals):
+    """Writes per-library assignment counts.
+
+    :param str outfile: output filepath
+    :param list names: library names
+    :param dict totals: totals from merge_counts
+    """
+
+    with open(outfile, "w") as out_fh:
+        out_fh.write(FILE_DELIM.join(COUNTS_HEADER) + FILE_NEWLINE)
+
+        for name, perfect, corrected in zip(names, totals["perfect"], totals["corrected"]):
+            out_fh.write(FILE_DELIM.join((name, str(perfect + corrected), str(perfect), str(corrected),)) +
+                         FILE_NEWLINE)
+
+        n_undetermined = totals[NO_INDEX] + totals[AMBIGUOUS_INDEX] + totals[UNMATCHED_INDEX]
+        out_fh.write(FILE_DELIM.join((UNDETERMINED, str(n_undetermined), "0", "0",)) + FILE_NEWLINE)
+
+
+def workflow(indices, read1=None, read2=None, bam=None, mismatches=DEFAULT_MISMATCHES, chunk_size=DEFAULT_CHUNK_SIZE,
+             threads=DEFAULT_THREADS, compress=False, output_dir=DEFAULT_OUTDIR):
+    """Demultiplexes reads into per-library outputs.
+
+    :param str indices: text file with columns {Library, i5, i7}
+    :param str | None read1: read 1 FASTQ
+    :param str | None read2: optional read 2 FASTQ
+    :param str | None bam: unaligned BAM, instead of FASTQ
+    :param int mismatches: mismatches allowed per index
+    :param int chunk_size: reads per chunk
+    :param int threads: number of worker processes
+    :param bool compress: gzip FASTQ outputs
+    :param str output_dir: output directory
+    :return dict: assignment totals
+    """
+
+    if (bam is None) == (read1 is None):
+        raise NotImplementedError("Provide either read FASTQs or an unaligned BAM.")
+
+    libraries = check_index_compat.read_indices(indices)
+    lookup = build_lookup(libraries, mismatches)
+    names = [e[0] for e in libraries] + [UNDETERMINED]
+    totals = new_counts(len(libraries))
+    start_time = time.time()
+
+    input_af = None
+    if bam is not None:
+        input_af = pysam.AlignmentFile(bam, "rb", check_sq=False)
+        chunks = iter_bam_chunks(input_af, chunk_size)
+        writers = OutputWriters(names, output_dir, header=input_af.header)
+    else:
+        chunks = iter_fastq_chunks(read1, read2, chunk_size)
+        writers = OutputWriters(names, output_dir, paired=read2 is not None, compress=compress)
+
+    metrics = instrumentation.get_metrics()
+    chunks = metrics.timed_iter("parse", chunks)
+
+    try:
+        demultiplexed = iter_demultiplexed(chunks, lookup, len(libraries), threads)
+        for records, groups, counts in metrics.timed_iter("match", demultiplexed):
+
+            with metrics.stage("write"):
+                for library, positions in groups.items():
+                    writers.write(library, [records[i] for i in positions])
+                    metrics.add(instrumentation.READ, len(positions))
+                    metrics.add(instrumentation.WRITTEN, len(positions))
+
+            metrics.add(instrumentation.FILTERED, len(groups.get(-1, ())))
+            merge_counts(totals, counts)
+    finally:
+        writers.close()
+        if input_af is not None:
+            input_af.close()
+
+    write_counts(os.path.join(output_dir, COUNTS_EXT), names[:-1], totals)
+
+    n_assigned = sum(totals["perfect"]) + sum(totals["corrected"])
+    n_reads = n_assigned + totals[NO_INDEX] + totals[AMBIGUOUS_INDEX] + totals[UNMATCHED_INDEX]
+    elapsed = max(time.time() - start_time, 1e-9)
+
+    logger.warning("Assigned %i of %i reads (%i with corrected indices) at %.0f reads/s. Undetermined: %i ambiguous, "
+                   "%i unmatched, %i without an index." % (
+                    n_assigned, n_reads, sum(totals["corrected"]), n_reads / elapsed, totals[AMBIGUOUS_INDEX],
+                    totals[UNMATCHED_INDEX], totals[NO_INDEX]))
+
+    return totals
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(indices=parsed_args["indices"], read1=parsed_args["read1"], read2=parsed_args["read2"],
+             bam=parsed_args["bam"], mismatches=parsed_args["mismatches"], chunk_size=parsed_args["chunk_size"],
+             threads=parsed_args["threads"], compress=parsed_args["gzip"], output_dir=outdir)
+
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    main()
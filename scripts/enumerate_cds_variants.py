@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""Enumerates all SNPs and MNPs across transcript CDS regions with their codon and amino acid effects.
+
+Variants are enumerated in blocks of CDS positions, each holding about BLOCK_VARIANTS variants, and streamed to the
+output, so memory is bounded by the block size rather than the CDS length or variant count. An MNP of width w has
+its first and last bases changed and any inner bases free, the minimal representation of each change, so no variant
+is enumerated twice across widths. Effects come from the dense codon lookups of codon_effects.
+
+The binary output is a flat array of BINARY_DTYPE records, readable with load_binary, alongside a list of the
+transcript IDs the records index.
+"""
+
+import argparse
+import collections
+import codon_effects
+import compressed_io
+import instrumentation
+import itertools
+import logging
+import multiprocessing
+import numpy as np
+import os
+import sys
+import transcriptome_index
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+DEFAULT_OUTDIR = "."
+DEFAULT_PREFIX = "cds_variants"
+DEFAULT_WIDTHS = (1, 2, 3,)
+DEFAULT_THREADS = 1
+BLOCK_VARIANTS = 262144
+MAX_WIDTH = 8
+TSV_FORMAT = "tsv"
+BINARY_FORMAT = "binary"
+OUTPUT_FORMATS = {TSV_FORMAT, BINARY_FORMAT}
+TSV_EXT = ".variants.txt"
+BINARY_EXT = ".variants.bin"
+BINARY_IDS_EXT = ".variants.trx_ids.txt"
+MAX_CODONS = (MAX_WIDTH + 1) // codon_effects.CODON_LEN + 1
+
+# Bases are packed 2 bits each with the first base highest; amino acids of spanned codons are NUL-padded
+BINARY_DTYPE = np.dtype([("trx_index", "<u4"), ("position", "<u4"), ("width", "u1"), ("ref", "<u2"), ("alt", "<u2"),
+                         ("ref_aa", "S%i" % MAX_CODONS), ("alt_aa", "S%i" % MAX_CODONS), ("effect", "u1")])
+
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "enumerate_cds_variants_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+# Per-process enumeration options, set by _init_worker
+_widths = None
+_output_format = None
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-f", "--fasta", type=str, required=True,
+                        help='Transcript FASTA, named by transcript ID or with pipe-delimited APPRIS headers.')
+
+    parser.add_argument("-r", "--region_bed", type=str, required=True,
+                        help='Region BED with UTR5, CDS, and UTR3 records in transcript coordinates.')
+
+    parser.add_argument("-i", "--ids", type=str, required=False, default=None,
+                        help='Optional transcript IDs to restrict to, one per line. Default all with a CDS.')
+
+    parser.add_argument("-w", "--widths", type=int, nargs="+", default=list(DEFAULT_WIDTHS),
+                        help='Variant widths to enumerate, 1 for SNPs. Default %s.' %
+                             " ".join(str(e) for e in DEFAULT_WIDTHS))
+
+    parser.add_argument("-b", "--output_format", type=str, default=TSV_FORMAT, choices=sorted(OUTPUT_FORMATS),
+                        help='Output format. Default %s.' % TSV_FORMAT)
+
+    parser.add_argument("-t", "--threads", type=int, default=DEFAULT_THREADS,
+                        help='Number of worker processes. Default %i.' % DEFAULT_THREADS)
+
+    parser.add_argument("-p", "--prefix", type=str, default=DEFAULT_PREFIX,
+                        help='Output file prefix. Default %s.' % DEFAULT_PREFIX)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. '
+                             'The IDs file may be plain, gzipped, or bgzipped regardless.')
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def get_alt_patterns(width):
+    """Gets every alternate of a given width as base codes.
+
+    :param int width: variant width
+    :return numpy.ndarray: 4^width x width base codes in lexicographic order
+    """
+
+    return np.array(list(itertools.product(range(len(codon_effects.BASES)), repeat=width)),
+                    dtype=np.uint8).reshape(-1, width)
+
+
+def pack_bases(codes):
+    """Packs rows of base codes 2 bits per base, first base highest.
+
+    :param numpy.ndarray codes: variants x width base codes
+    :return numpy.ndarray: packed codes
+    """
+
+    weights = 4 ** np.arange(codes.shape[1] - 1, -1, -1, dtype=np.int64)
+    return (codes.astype(np.int64) * weights[None, :]).sum(axis=1)
+
+
+def unpack_bases(packed, widths):
+    """Unpacks 2 bit per base codes to sequences.
+
+    :param numpy.ndarray packed: packed codes
+    :param numpy.ndarray widths: variant widths
+    :return list: sequences
+    """
+
+    return ["".join(codon_effects.BASES[(code >> (2 * i)) & 3] for i in range(width - 1, -1, -1))
+            for code, width in zip(packed.tolist(), widths.tolist())]
+
+
+def enumerate_width(cds_codes, width, start=0, end=None):
+    """Enumerates the variants of one width starting in a range of CDS positions.
+
+    :param numpy.ndarray cds_codes: CDS base codes
+    :param int width: variant width
+    :param int start: first 0-based start position
+    :param int | None end: end of the start positions, exclusive; None for the end of the CDS
+    :return tuple: (positions, ref codes, alt codes) arrays with one row per variant
+    """
+
+    n_positions = len(cds_codes) - width + 1
+    end = n_positions if end is None else min(end, n_positions)
+
+    if end <= start:
+        empty = np.empty((0, width), dtype=np.uint8)
+        return np.empty(0, dtype=np.int64), empty, empty
+
+    refs = np.lib.stride_tricks.sliding_window_view(cds_codes, width)[start:end]
+    alts = get_alt_patterns(width)
+
+    # The first and last bases must change; ambiguous reference positions are skipped
+    valid = (alts[None, :, 0] != refs[:, None, 0]) & (alts[None, :, -1] != refs[:, None, -1]) & \
+            (refs < codon_effects.INVALID_BASE).all(axis=1)[:, None]
+    pos_idx, alt_idx = np.nonzero(valid)
+
+    return pos_idx.astype(np.int64) + start, refs[pos_idx], alts[alt_idx]
+
+
+def get_block_positions(widths, block_variants=BLOCK_VARIANTS):
+    """Gets the number of CDS positions per enumeration block.
+
+    :param iterable widths: variant widths
+    :param int block_variants: approximate variants per block
+    :return int: start positions per block, at least 1
+    """
+
+    return max(1, block_variants // sum(len(codon_effects.BASES) ** e for e in widths))
+
+
+def iter_cds_blocks(trx_index, trx_id, cds_seq, widths=DEFAULT_WIDTHS, block_variants=BLOCK_VARIANTS):
+    """Splits a CDS into enumeration blocks of start positions.
+
+    Each block carries only the codon-aligned slice of the CDS its variants and their spanned codons touch.
+
+    :param int trx_index: index of the transcript ID in the ID list
+    :param str trx_id: transcript ID
+    :param str cds_seq: CDS sequence
+    :param iterable widths: variant widths
+    :param int block_variants: approximate variants per block
+    :return generator: (transcript index, transcript ID, CDS slice, slice offset, CDS length, start, end) tuples
+    """
+
+    block_positions = get_block_positions(widths, block_variants)
+    margin = ((max(widths) + 1) // codon_effects.CODON_LEN + 1) * codon_effects.CODON_LEN
+
+    for start in range(0, len(cds_seq), block_positions):
+        end = min(start + block_positions, len(cds_seq))
+        offset = start - start % codon_effects.CODON_LEN
+        yield trx_index, trx_id, cds_seq[offset:end + margin], offset, len(cds_seq), start, end
+
+
+def enumerate_block(cds_codes, offset, cds_len, widths, start, end):
+    """Enumerates and annotates all variants of the given widths starting in a block of CDS positions.
+
+    :param numpy.ndarray cds_codes: base codes of the CDS slice from iter_cds_blocks
+    :param int offset: CDS position of the first base of the slice, a multiple of the codon length
+    :param int cds_len: full CDS length
+    :param iterable widths: variant widths
+    :param int start: first 0-based start position in the CDS
+    :param int end: end of the start positions in the CDS, exclusive
+    :return list: (positions, ref codes, alt codes, annotations from codon_effects.annotate_variants) per width
+    """
+
+    groups = []
+    for width in widths:
+
+        # A slice ending before the CDS end has no start positions past end, so none are clipped
+        positions, ref_codes, alt_codes = enumerate_width(cds_codes, width, start - offset, end - offset)
+        positions += offset
+        n_variants = len(positions)
+
+        # Negative offsets map CDS positions into the slice
+        annotations = codon_effects.annotate_variants(
+            cds_codes, np.full(n_variants, -offset, dtype=np.int64), np.full(n_variants, cds_len, dtype=np.int64),
+            positions, ref_codes, alt_codes)
+        groups.append((positions, ref_codes, alt_codes, annotations,))
+
+    return groups
+
+
+def get_order(groups):
+    """Gets the order of variants concatenated across width groups by position, then width, then alternate.
+
+    :param list groups: groups from enumerate_block
+    :return numpy.ndarray: indices into the concatenated variants
+    """
+
+    positions = np.concatenate([e[0] for e in groups])
+    widths = np.concatenate([np.full(len(e[0]), i, dtype=np.int64) for i, e in enumerate(groups)])
+    return np.lexsort((np.arange(len(positions)), widths, positions))
+
+
+def format_tsv(trx_id, groups):
+    """Formats enumerated variants as annotation lines.
+
+    :param str trx_id: transcript ID
+    :param list groups: groups from enumerate_block
+    :return str: lines in codon_effects output format
+    """
+
+    lines = []
+    for positions, ref_codes, alt_codes, annotations in groups:
+        refs = codon_effects.to_strings(ref_codes, codon_effects.BASE_CHARS)
+        alts = codon_effects.to_strings(alt_codes, codon_effects.BASE_CHARS)
+        records = [(trx_id, str(p + 1), r, a,) for p, r, a in zip(positions.tolist(), refs, alts)]
+        lines.extend(codon_effects.format_annotations(records, annotations) if records else [])
+
+    ordered = [lines[i] for i in get_order(groups)]
+    return "".join(e + FILE_NEWLINE for e in ordered)
+
+
+def format_binary(trx_index, groups):
+    """Formats enumerated variants as binary records.
+
+    :param int trx_index: index of the transcript ID in the ID list
+    :param list groups: groups from enumerate_block
+    :return bytes: BINARY_DTYPE records
+    """
+
+    blocks = []
+    for positions, ref_codes, alt_codes, annotations in groups:
+
+        block = np.zeros(len(positions), dtype=BINARY_DTYPE)
+        block["trx_index"] = trx_index
+        block["position"] = positions
+        block["width"] = ref_codes.shape[1]
+        block["ref"] = pack_bases(ref_codes)
+        block["alt"] = pack_bases(alt_codes)
+        block["effect"] = annotations["effect"]
+
+        # Amino acids of codons beyond those spanned are left as NUL padding
+        spanned = np.arange(annotations["ref_codons"].shape[1])[None, :] < annotations["n_codons"][:, None]
+        for field, codons in (("ref_aa", annotations["ref_codons"],), ("alt_aa", annotations["alt_codons"],)):
+            aas = np.zeros((len(positions), MAX_CODONS), dtype=np.uint8)
+            aas[:, :codons.shape[1]] = np.where(spanned, codon_effects.CODON_AAS[codons], 0)
+            block[field] = aas.view("S%i" % MAX_CODONS).ravel()
+
+        blocks.append(block)
+
+    return np.concatenate(blocks)[get_order(groups)].tobytes()
+
+
+def load_binary(binary_file, ids_file):
+    """Loads binary enumeration output.
+
+    :param str binary_file: binary variants file
+    :param str ids_file: transcript ID list indexed by the records
+    :return tuple: (numpy structured array of BINARY_DTYPE records, list of transcript IDs)
+    """
+
+    if compressed_io.is_compressed(binary_file):
+        with compressed_io.open_input(binary_file, "rb") as in_fh:
+            records = np.frombuffer(in_fh.read(), dtype=BINARY_DTYPE)
+    else:
+        records = np.fromfile(binary_file, dtype=BINARY_DTYPE)
+
+    with compressed_io.open_input(ids_file) as ids_fh:
+        trx_ids = [e.rstrip(FILE_NEWLINE) for e in ids_fh]
+
+    return records, trx_ids
+
+
+def _init_worker(widths, output_format):
+    """Stores the enumeration options in a worker process.
+
+    :param tuple widths: variant widths
+    :param str output_format: tsv or binary
+    """
+
+    global _widths, _output_format
+    _widths = widths
+    _output_format = output_format
+
+
+def _enumerate_worker(task):
+    """Enumerates and formats the variants of one block in a worker process.
+
+    :param tuple task: block from iter_cds_blocks
+    :return tuple: (number of variants, formatted output as bytes)
+    """
+
+    trx_index, trx_id, cds_slice, offset, cds_len, start, end = task
+    groups = enumerate_block(codon_effects.encode_seq(cds_slice), offset, cds_len, _widths, start, end)
+    n_variants = sum(len(e[0]) for e in groups)
+
+    if _output_format == BINARY_FORMAT:
+        return n_variants, format_binary(trx_index, groups)
+
+    return n_variants, format_tsv(trx_id, groups).encode()
+
+
+def iter_enumerated(tasks, widths=DEFAULT_WIDTHS, output_format=TSV_FORMAT, threads=DEFAULT_THREADS):
+    """Enumerates blocks, optionally across a process pool, yielding results in input order.
+
+    At most two blocks per worker are in flight, so memory stays bounded by the block size.
+
+    :param iterable tasks: blocks from iter_cds_blocks
+    :param tuple widths: variant widths
+    :param str output_format: tsv or binary
+    :param int threads: number of worker processes
+    :return generator: results of _enumerate_worker
+    """
+
+    if threads <= 1:
+        _init_worker(widths, output_format)
+        for task in tasks:
+            yield _enumerate_worker(task)
+        return
+
+    with multiprocessing.Pool(threads, initializer=_init_worker, initargs=(widths, output_format,)) as pool:
+
+        pending = collections.deque()
+        for task in tasks:
+
+            pending.append(pool.apply_async(_enumerate_worker, (task,)))
+
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def workflow(fasta, region_bed, ids=None, widths=DEFAULT_WIDTHS, output_format=TSV_FORMAT, threads=DEFAULT_THREADS,
+             output_dir=DEFAULT_OUTDIR, prefix=DEFAULT_PREFIX, block_variants=BLOCK_VARIANTS, compression=None):
+    """Enumerates all variants of the given widths across transcript CDS regions.
+
+    :param str fasta: transcript FASTA
+    :param str region_bed: region BED with CDS records in transcript coordinates
+    :param str | None ids: optional transcript IDs to restrict to, one per line
+    :param iterable widths: variant widths
+    :param str output_format: tsv or binary
+    :param int threads: number of worker processes
+    :param str output_dir: output directory
+    :param str prefix: output file prefix
+    :param int block_variants: approximate variants enumerated per block
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str: output filepath
+    """
+
+    widths = tuple(sorted(set(widths)))
+    if not widths or widths[0] < 1 or widths[-1] > MAX_WIDTH:
+        raise NotImplementedError("Variant widths must be between 1 and %i." % MAX_WIDTH)
+
+    trx_ids = None
+    if ids is not None:
+        with compressed_io.open_input(ids) as ids_fh:
+            trx_ids = {e.strip().split(transcriptome_index.TRX_EXT)[0] for e in ids_fh} - {""}
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("parse"):
+        cds_bounds = codon_effects.load_cds_bounds(region_bed)
+
+    cds_seqs = metrics.timed_iter("parse", codon_effects.iter_cds_seqs(fasta, cds_bounds, trx_ids))
+    ordered_ids = []
+
+    def iter_tasks():
+        for trx_index, (trx_id, cds_seq) in enumerate(cds_seqs):
+            ordered_ids.append(trx_id)
+            metrics.add(instrumentation.READ)
+            for block in iter_cds_blocks(trx_index, trx_id, cds_seq, widths, block_variants):
+                yield block
+
+    is_binary = output_format == BINARY_FORMAT
+    outfile = compressed_io.get_output_name(
+        os.path.join(output_dir, prefix + (BINARY_EXT if is_binary else TSV_EXT)), compression)
+    n_variants = 0
+
+    with compressed_io.open_output(outfile, "wb", compression) as out_fh:
+
+        if not is_binary:
+            out_fh.write((FILE_DELIM.join(codon_effects.OUTPUT_HEADER) + FILE_NEWLINE).encode())
+
+        enumerated = iter_enumerated(iter_tasks(), widths, output_format, threads)
+        for n_block_variants, output in metrics.timed_iter("match", enumerated):
+
+            with metrics.stage("write"):
+                out_fh.write(output)
+
+            n_variants += n_block_variants
+            metrics.add(instrumentation.WRITTEN, n_block_variants)
+
+    if is_binary:
+        ids_file = compressed_io.get_output_name(os.path.join(output_dir, prefix + BINARY_IDS_EXT), compression)
+        with compressed_io.open_output(ids_file, compression=compression) as ids_fh:
+            ids_fh.write("".join(e + FILE_NEWLINE for e in ordered_ids))
+
+    logger.warning("Enumerated %i variants across %i transcripts." % (n_variants, len(ordered_ids)))
+    return outfile
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(fasta=parsed_args["fasta"], region_bed=parsed_args["region_bed"], ids=parsed_args["ids"],
+             widths=parsed_args["widths"], output_format=parsed_args["output_format"],
+             threads=parsed_args["threads"], output_dir=outdir, prefix=parsed_args["prefix"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    main()
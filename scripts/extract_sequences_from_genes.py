@@ -2,15 +2,13 @@
 """Extracts sequences from a FASTA file based on gene names."""
 
 import argparse
+import instrumentation
 import os
-import pysam
 import sys
+import transcriptome_extract
+import transcriptome_index
 
-HEADER_DELIM = "|"
-GENE_IDX = 5
-FOREGROUND_EXT = ".extracted.fa"
 DEFAULT_OUTDIR = "."
-FILE_NEWLINE = "\n"
 
 
 def parse_commandline_params(args):
@@ -22,7 +20,7 @@ def parse_commandline_params(args):
 
     parser = argparse.ArgumentParser(description="%s arguments" % __name__)
 
-    parser.add_argument("-i", "--gene_ids_file", type=str, required=True,
+    parser.add_argument("-i", "--gene_ids_file", type=str, required=False,
                         help='Gene IDs to select for enumeration. One gene per line.')
 
     parser.add_argument("-f", "--fasta", type=str, required=True,
@@ -31,44 +29,78 @@ def parse_commandline_params(args):
     parser.add_argument("-r", "--make_rna", action="store_true", required=False,
                         help='Flag to convert DNA sequences to RNA sequences.')
 
+    parser.add_argument("-x", "--use_index", action="store_true", required=False,
+                        help='Flag to fetch only the selected records via a persistent header index and faidx.')
+
+    parser.add_argument("-n", "--index_file", type=str, required=False, default=None,
+                        help='Optional header index path. Default the FASTA path with extension .%s.'
+                             % transcriptome_index.INDEX_EXT)
+
+    parser.add_argument("-b", "--batch", type=str, required=False, default=None,
+                        help='File of gene list paths, one per line, each optionally followed by a tab and '
+                             'comma-separated options rna and/or minimal_name. All lists are extracted in one pass. '
+                             'Replaces -i and -r.')
+
+    parser.add_argument("-z", "--compression", type=str, required=False, default=None,
+                        choices=sorted(transcriptome_extract.COMPRESSION_TYPES),
+                        help='Optional output compression. bgzip output may be indexed with samtools faidx.')
+
     parser.add_argument("-o", "--output_dir", type=str, required=False, default=DEFAULT_OUTDIR,
                         help='Optional output directory. Default current working directory.')
 
+    instrumentation.add_arguments(parser)
+
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
 
 
-def main():
-    """Runs the workflow when called from command line."""
+def workflow(gene_ids_file, fasta, make_rna=False, output_dir=DEFAULT_OUTDIR, use_index=False, index_file=None,
+             batch=None, compression=None):
+    """Extracts the records of the selected genes.
 
-    parsed_args = parse_commandline_params(sys.argv[1:])
+    :param str | None gene_ids_file: gene names, one per line
+    :param str fasta: APPRIS transcriptome FASTA
+    :param bool make_rna: convert DNA to RNA
+    :param str output_dir: output directory
+    :param bool use_index: fetch the selected records via a header index and faidx
+    :param str | None index_file: optional header index path
+    :param str | None batch: optional file of gene lists with per-list options, extracted in one pass
+    :param str | None compression: optional output compression, gzip or bgzip
+    :return list: output FASTA filepaths
+    """
 
-    outdir = parsed_args["output_dir"]
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
+    if batch is not None:
+        outputs = transcriptome_extract.parse_batch(batch, output_dir, compression)
+    elif gene_ids_file is not None:
+        outputs = [transcriptome_extract.new_output(gene_ids_file, output_dir, make_rna, False, compression)]
+    else:
+        raise NotImplementedError("Provide either a gene IDs file or a batch file.")
 
-    gene_file = parsed_args["gene_ids_file"]
+    transcriptome_extract.extract_records(fasta, outputs, transcriptome_index.GENE_KEY, use_index, index_file,
+                                          compression)
 
-    foreground_outfile = os.path.join(outdir, os.path.basename(os.path.splitext(gene_file)[0]) + FOREGROUND_EXT)
+    return [output["outfile"] for output in outputs]
 
-    with open(gene_file, "r") as gene_fh:
-        genes = {e.strip() for e in gene_fh}
 
-    fasta_file = parsed_args["fasta"]
+def main(args=None):
+    """Runs the workflow when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
 
-    with pysam.FastxFile(fasta_file, "r") as in_fh, open(foreground_outfile, "w") as foreground_fh:
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
-        for rec in in_fh:
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
 
-            rec_split = rec.name.split(HEADER_DELIM)
-            rec_gene = rec_split[GENE_IDX]
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"])
 
-            if parsed_args["make_rna"]:
-                rna_seq = "".join(e if e != "T" else "U" for e in rec.sequence)
-                rec.sequence = rna_seq
+    workflow(gene_ids_file=parsed_args["gene_ids_file"], fasta=parsed_args["fasta"],
+             make_rna=parsed_args["make_rna"], output_dir=outdir, use_index=parsed_args["use_index"],
+             index_file=parsed_args["index_file"], batch=parsed_args["batch"], compression=parsed_args["compression"])
 
-            if rec_gene in genes:
-                foreground_fh.write(str(rec) + FILE_NEWLINE)
+    instrumentation.finish()
 
 
 if __name__ == "__main__":
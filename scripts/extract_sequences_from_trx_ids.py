@@ -2,16 +2,13 @@
 """Extracts sequences from a FASTA file based on Ensembl transcript IDs."""
 
 import argparse
+import instrumentation
 import os
-import pysam
 import sys
+import transcriptome_extract
+import transcriptome_index
 
-HEADER_DELIM = "|"
-TRX_IDX = 0
-TRX_EXT = "."
-FOREGROUND_EXT = ".extracted.fa"
 DEFAULT_OUTDIR = "."
-FILE_NEWLINE = "\n"
 
 
 def parse_commandline_params(args):
@@ -23,7 +20,7 @@ def parse_commandline_params(args):
 
     parser = argparse.ArgumentParser(description="%s arguments" % __name__)
 
-    parser.add_argument("-i", "--trx_ids_file", type=str, required=True,
+    parser.add_argument("-i", "--trx_ids_file", type=str, required=False,
                         help='Ensembl transcript IDs to select, with no minor version extension. One gene per line.')
 
     parser.add_argument("-f", "--fasta", type=str, required=True,
@@ -35,48 +32,79 @@ def parse_commandline_params(args):
     parser.add_argument("-m", "--minimal_name", action="store_true", required=False,
                         help='Flag to output FASTA headers/names using a minimal Ensembl transcript ID.')
 
+    parser.add_argument("-x", "--use_index", action="store_true", required=False,
+                        help='Flag to fetch only the selected records via a persistent header index and faidx.')
+
+    parser.add_argument("-n", "--index_file", type=str, required=False, default=None,
+                        help='Optional header index path. Default the FASTA path with extension .%s.'
+                             % transcriptome_index.INDEX_EXT)
+
+    parser.add_argument("-b", "--batch", type=str, required=False, default=None,
+                        help='File of transcript ID list paths, one per line, each optionally followed by a tab and '
+                             'comma-separated options rna and/or minimal_name. All lists are extracted in one pass. '
+                             'Replaces -i, -r, and -m.')
+
+    parser.add_argument("-z", "--compression", type=str, required=False, default=None,
+                        choices=sorted(transcriptome_extract.COMPRESSION_TYPES),
+                        help='Optional output compression. bgzip output may be indexed with samtools faidx.')
+
     parser.add_argument("-o", "--output_dir", type=str, required=False, default=DEFAULT_OUTDIR,
                         help='Optional output directory. Default current working directory.')
 
+    instrumentation.add_arguments(parser)
+
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
 
 
-def main():
-    """Runs the workflow when called from command line."""
-
-    parsed_args = parse_commandline_params(sys.argv[1:])
-
-    outdir = parsed_args["output_dir"]
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
+def workflow(trx_ids_file, fasta, make_rna=False, minimal_name=False, output_dir=DEFAULT_OUTDIR, use_index=False,
+             index_file=None, batch=None, compression=None):
+    """Extracts the records of the selected transcripts.
+
+    :param str | None trx_ids_file: Ensembl transcript IDs without version, one per line
+    :param str fasta: APPRIS transcriptome FASTA
+    :param bool make_rna: convert DNA to RNA
+    :param bool minimal_name: name records by transcript ID without version
+    :param str output_dir: output directory
+    :param bool use_index: fetch the selected records via a header index and faidx
+    :param str | None index_file: optional header index path
+    :param str | None batch: optional file of ID lists with per-list options, extracted in one pass
+    :param str | None compression: optional output compression, gzip or bgzip
+    :return list: output FASTA filepaths
+    """
 
-    trx_file = parsed_args["trx_ids_file"]
+    if batch is not None:
+        outputs = transcriptome_extract.parse_batch(batch, output_dir, compression)
+    elif trx_ids_file is not None:
+        outputs = [transcriptome_extract.new_output(trx_ids_file, output_dir, make_rna, minimal_name, compression)]
+    else:
+        raise NotImplementedError("Provide either a transcript IDs file or a batch file.")
 
-    foreground_outfile = os.path.join(outdir, os.path.basename(os.path.splitext(trx_file)[0]) + FOREGROUND_EXT)
+    transcriptome_extract.extract_records(fasta, outputs, transcriptome_index.TRX_KEY, use_index, index_file,
+                                          compression)
 
-    with open(trx_file, "r") as trx_fh:
-        transcripts = {e.strip() for e in trx_fh}
+    return [output["outfile"] for output in outputs]
 
-    fasta_file = parsed_args["fasta"]
 
-    with pysam.FastxFile(fasta_file, "r") as in_fh, open(foreground_outfile, "w") as foreground_fh:
+def main(args=None):
+    """Runs the workflow when called from command line.
 
-        for rec in in_fh:
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
 
-            rec_split = rec.name.split(HEADER_DELIM)
-            rec_trx = rec_split[TRX_IDX].split(TRX_EXT)[0]
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
-            if parsed_args["make_rna"]:
-                rna_seq = "".join(e if e != "T" else "U" for e in rec.sequence)
-                rec.sequence = rna_seq
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
 
-            if rec_trx in transcripts:
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"])
 
-                if parsed_args["minimal_name"]:
-                    rec.name = rec_trx
+    workflow(trx_ids_file=parsed_args["trx_ids_file"], fasta=parsed_args["fasta"], make_rna=parsed_args["make_rna"],
+             minimal_name=parsed_args["minimal_name"], output_dir=outdir, use_index=parsed_args["use_index"],
+             index_file=parsed_args["index_file"], batch=parsed_args["batch"], compression=parsed_args["compression"])
 
-                foreground_fh.write(str(rec) + FILE_NEWLINE)
+    instrumentation.finish()
 
 
 if __name__ == "__main__":
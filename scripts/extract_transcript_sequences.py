@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Extracts spliced transcript sequences from a genome given Ensembl transcript IDs and a GTF."""
+
+import argparse
+import collections
+import compressed_io
+import gtf_index
+import instrumentation
+import logging
+import multiprocessing
+import os
+import pysam
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+FASTA_HEADER_CHAR = ">"
+GFF_COMMENT_CHAR = "#"
+GFF_CONTIG_FIELD = 0
+GFF_FEATURE_FIELD = 2
+GFF_START_FIELD = 3
+GFF_END_FIELD = 4
+GFF_STRAND_FIELD = 6
+GFF_ATTR_FIELD = 8
+GFF_NEG_STRAND = "-"
+EXON_FEATURE = "exon"
+
+# Gencode and Ensembl respectively
+PROTEIN_CODING_ATTRS = ('transcript_type "protein_coding"', 'transcript_biotype "protein_coding"',)
+
+DEFAULT_EXT = "fa"
+DEFAULT_OUTDIR = "."
+DEFAULT_LINE_LEN = 60
+DEFAULT_THREADS = 1
+CHUNK_SIZE = 100
+# Complements IUPAC ambiguity codes too, as bedtools getfasta -s does
+REVCOMP_TABLE = str.maketrans("ACGTNRYKMSWBDHVacgtnrykmswbdhv", "TGCANYRMKSWVHDBtgcanyrmkswvhdb")
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "extract_transcript_sequences_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+# Opened once per worker process, as FastaFile handles cannot be pickled
+_genome_fa = None
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-i", "--ids", type=str, required=True,
+                        help="Text file of Ensembl transcript IDs without version suffix, one per line.")
+
+    parser.add_argument("-t", "--gff", type=str, required=True,
+                        help="Ensembl or Gencode GTF, optionally pre-filtered with filter_gtf.py.")
+
+    parser.add_argument("-g", "--genome", type=str, required=True,
+                        help="Genome FASTA. A faidx index is created if one does not exist.")
+
+    parser.add_argument("-l", "--line_len", type=int, default=DEFAULT_LINE_LEN,
+                        help="FASTA line length; 0 for unwrapped sequences. Default %i." % DEFAULT_LINE_LEN)
+
+    parser.add_argument("-p", "--threads", type=int, default=DEFAULT_THREADS,
+                        help="Number of worker processes. Default %i." % DEFAULT_THREADS)
+
+    parser.add_argument("-s", "--split", action="store_true",
+                        help="Flag to write one TRX_ID.fa file per transcript, as the shell scripts do.")
+
+    parser.add_argument("-x", "--use_index", action="store_true",
+                        help="Flag to read only the requested transcripts via a persistent GTF index.")
+
+    parser.add_argument("-n", "--index_file", type=str, default=None,
+                        help="Optional index path. Default the GTF path with extension .%s." % gtf_index.INDEX_EXT)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. The GTF may be plain, gzipped, or '
+                             'bgzipped regardless.')
+
+    parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_OUTDIR,
+                        help='Output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def load_exon_models(gff_lines, trx_ids=None):
+    """Loads exon models by transcript, with exons ordered 5' to 3'.
+
+    :param iterable gff_lines: GTF lines
+    :param set | None trx_ids: transcript IDs without version; None to load all transcripts
+    :return dict: {trx_id: {"contig": str, "strand": str, "coding": bool, "exons": [(start, end)]}}, with 0-based
+    half-open exon coordinates
+    """
+
+    exon_models = collections.defaultdict(lambda: {"contig": None, "strand": None, "coding": False, "exons": []})
+
+    for line in gff_lines:
+
+        if line.startswith(GFF_COMMENT_CHAR):
+            continue
+
+        fields = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+        if len(fields) <= GFF_ATTR_FIELD or fields[GFF_FEATURE_FIELD] != EXON_FEATURE:
+            continue
+
+        trx_id = gtf_index.get_attr(fields[GFF_ATTR_FIELD], gtf_index.GFF_ATTR_TRANSCRIPT_ID)
+        if trx_id is None:
+            continue
+
+        trx_id = gtf_index.strip_version(trx_id)
+        if trx_ids is not None and trx_id not in trx_ids:
+            continue
+
+        model = exon_models[trx_id]
+        model["contig"] = fields[GFF_CONTIG_FIELD]
+        model["strand"] = fields[GFF_STRAND_FIELD]
+        model["coding"] |= any(attr in fields[GFF_ATTR_FIELD] for attr in PROTEIN_CODING_ATTRS)
+        model["exons"].append((int(fields[GFF_START_FIELD]) - 1, int(fields[GFF_END_FIELD]),))
+
+    for model in exon_models.values():
+        model["exons"].sort(reverse=model["strand"] == GFF_NEG_STRAND)
+
+    return dict(exon_models)
+
+
+def reverse_complement(seq):
+    """Reverse complements a DNA sequence, preserving case.
+
+    :param str seq: DNA sequence
+    :return str: reverse complement
+    """
+
+    return seq.translate(REVCOMP_TABLE)[::-1]
+
+
+def splice_transcript(genome_fa, model):
+    """Splices the exons of a transcript from the genome.
+
+    :param pysam.FastaFile genome_fa: open genome FASTA
+    :param dict model: exon model from load_exon_models
+    :return str: transcript sequence, 5' to 3'
+    """
+
+    exon_seqs = [genome_fa.fetch(model["contig"], start, end) for start, end in model["exons"]]
+
+    if model["strand"] == GFF_NEG_STRAND:
+        exon_seqs = [reverse_complement(seq) for seq in exon_seqs]
+
+    trx_seq = "".join(exon_seqs)
+    return trx_seq
+
+
+def format_fasta(name, seq, line_len=DEFAULT_LINE_LEN):
+    """Formats a FASTA record.
+
+    :param str name: record name
+    :param str seq: sequence
+    :param int line_len: line length; 0 for an unwrapped sequence
+    :return str: FASTA record, including the final newline
+    """
+
+    if line_len > 0:
+        seq = FILE_NEWLINE.join(seq[i:i + line_len] for i in range(0, len(seq), line_len))
+
+    return FASTA_HEADER_CHAR + name + FILE_NEWLINE + seq + FILE_NEWLINE
+
+
+def _init_worker(genome):
+    """Opens the genome once in a worker process.
+
+    :param str genome: genome FASTA
+    """
+
+    global _genome_fa
+    _genome_fa = pysam.FastaFile(genome)
+
+
+def _splice_chunk(chunk):
+    """Splices a chunk of transcripts in a worker process.
+
+    :param list chunk: (trx_id, model) tuples
+    :return list: (trx_id, sequence) tuples
+    """
+
+    res = [(trx_id, splice_transcript(_genome_fa, model),) for trx_id, model in chunk]
+    return res
+
+
+def iter_transcript_sequences(genome, models, threads=DEFAULT_THREADS):
+    """Splices transcripts, optionally across a process pool, preserving input order.
+
+    :param str genome: genome FASTA
+    :param list models: (trx_id, model) tuples
+    :param int threads: number of worker processes
+    :return generator: (trx_id, sequence) tuples
+    """
+
+    chunks = [models[i:i + CHUNK_SIZE] for i in range(0, len(models), CHUNK_SIZE)]
+
+    if threads <= 1:
+        _init_worker(genome)
+        for chunk in chunks:
+            for res in _splice_chunk(chunk):
+                yield res
+        return
+
+    with multiprocessing.Pool(threads, initializer=_init_worker, initargs=(genome,)) as pool:
+        for chunk_res in pool.imap(_splice_chunk, chunks):
+            for res in chunk_res:
+                yield res
+
+
+def workflow(ids, gff, genome, outdir=DEFAULT_OUTDIR, line_len=DEFAULT_LINE_LEN, threads=DEFAULT_THREADS,
+             split=False, use_index=False, index_file=None, compression=None):
+    """Extracts protein-coding transcript sequences.
+
+    :param str ids: Ensembl transcript IDs without version suffix, one per line
+    :param str gff: Ensembl or Gencode GTF
+    :param str genome: genome FASTA
+    :param str outdir: optional output directory
+    :param int line_len: FASTA line length; 0 for unwrapped sequences
+    :param int threads: number of worker processes
+    :param bool split: write one FASTA per transcript instead of a multi-FASTA
+    :param bool use_index: read only the requested transcripts via a persistent GTF index
+    :param str | None index_file: optional index path
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str | None: multi-FASTA filepath, or None if split
+    """
+
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    with open(ids, "r") as ids_fh:
+        trx_order = list(dict.fromkeys(e.strip() for e in ids_fh if e.strip()))
+
+    trx_ids = set(trx_order)
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("parse"):
+        if use_index:
+            conn = gtf_index.load_index(gff, index_file)
+            exon_models = load_exon_models(gtf_index.get_records(conn, gff, trx_ids), trx_ids)
+            conn.close()
+        else:
+            with compressed_io.open_input(gff) as gff_fh:
+                exon_models = load_exon_models(gff_fh, trx_ids)
+
+    models = []
+    for trx_id in trx_order:
+        if trx_id not in exon_models or not exon_models[trx_id]["coding"]:
+            logger.warning("%s was not found in the GTF or is not protein coding and was filtered out" % trx_id)
+            metrics.add(instrumentation.FILTERED)
+            continue
+        models.append((trx_id, exon_models[trx_id],))
+
+    metrics.add(instrumentation.READ, len(trx_order))
+
+    outfile = None if split else compressed_io.get_output_name(os.path.join(
+        outdir, os.path.basename(os.path.splitext(ids)[0]) + "." + DEFAULT_EXT), compression)
+    out_fh = None if split else compressed_io.open_output(outfile, compression=compression)
+
+    for trx_id, trx_seq in metrics.timed_iter("splice", iter_transcript_sequences(genome, models, threads)):
+
+        with metrics.stage("write"):
+            if split:
+                trx_fn = compressed_io.get_output_name(
+                    os.path.join(outdir, ".".join((trx_id, DEFAULT_EXT,))), compression)
+                with compressed_io.open_output(trx_fn, compression=compression, threads=0) as trx_fh:
+                    trx_fh.write(format_fasta(trx_id, trx_seq, line_len))
+            else:
+                out_fh.write(format_fasta(trx_id, trx_seq, line_len))
+
+        metrics.add(instrumentation.WRITTEN)
+
+    if out_fh is not None:
+        out_fh.close()
+
+    return outfile
+
+
+def main(args=None):
+    """Runs the workflow when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
+
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
+
+    outdir = parsed_args["outdir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    logger.info("Started %s" % sys.argv[0])
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(ids=parsed_args["ids"], gff=parsed_args["gff"], genome=parsed_args["genome"], outdir=outdir,
+             line_len=parsed_args["line_len"], threads=parsed_args["threads"], split=parsed_args["split"],
+             use_index=parsed_args["use_index"], index_file=parsed_args["index_file"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
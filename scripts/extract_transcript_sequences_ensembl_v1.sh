@@ -10,7 +10,7 @@ Bedtools must be installed.
 
 -h	Help
 -i	Full path to Ensembl transcript ID file; specify IDs without version suffix, one per line
--t	Full path to Ensembl or Gencode GTF file
+-t	Full path to Ensembl or Gencode GTF file, plain or gzipped
 -g	Full path to genome FASTA
 
 EOF
@@ -52,7 +52,7 @@ cd "$TEMP_DIR"
 
 # Extract records that match the Ensembl IDs
 echo "Filtering GTF. This could take some time..."
-fgrep -f "$TRX_ID_FILE" "$GTF" | awk '{if($3=="exon") {print}}' - > filt.gtf
+gzip -cdf "$GTF" | fgrep -f "$TRX_ID_FILE" | awk '{if($3=="exon") {print}}' - > filt.gtf
 
 # Ensure the exons are sorted from 5' to 3' 
 more filt.gtf | awk '{if($7=="+") {print}}' | sort -k4n > filt_pos.gtf
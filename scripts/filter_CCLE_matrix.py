@@ -4,12 +4,26 @@
 # See https://depmap.org/portal/download/all/
 
 import argparse
+import ccle_cache
+import compressed_io
+import instrumentation
 import logging
+import numpy as np
 import os
+import re
+import streaming_stats
 import sys
 
 FILE_DELIM = "\t"
 FILE_NEWLINE = "\n"
+CSV_DELIM = ","
+FILT_EXT = "filt.txt"
+STATS_EXT = "stats.txt"
+GROUP_MAP_DELIM_RE = re.compile(r"[\t,]")
+BLOCK_ROWS = 256
+DEFAULT_QUANTILES = "0.25,0.5,0.75"
+EXPRESSED_THRESHOLD = 1.0
+NA_STR = "NA"
 LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 DEPMAP_ID = "depMap_ID"
 
@@ -70,64 +84,444 @@ def parse_commandline_params(args):
     parser.add_argument("-m", "--CCLE_matrix", type=str, required=True,
                         help='CCLE transcript expression matrix with depMap IDs in first column and gene names in first row.')
 
-    parser.add_argument("-g", "--genes", type=str, required=True, help='Genes, one per line.')
+    parser.add_argument("-g", "--genes", type=str, help='Genes, one per line.')
 
-    parser.add_argument("-d", "--depMap_IDs", type=str, required=True,
+    parser.add_argument("-d", "--depMap_IDs", type=str,
                         help='depMap IDs for cell lines of interest (e.g. ACH-001188)')
 
+    parser.add_argument("-b", "--batch", type=str, default=None,
+                        help='Tab-delimited file of NAME, genes file, and depMap IDs file per line, to answer many '
+                             'queries in one pass, writing <matrix>.NAME.%s. Replaces -g and -d.' % FILT_EXT)
+
+    parser.add_argument("-a", "--aggregate", type=str, default=None,
+                        help='Tab- or comma-delimited file of depMap ID and group (e.g. lineage) per line. Computes '
+                             'per-gene count, mean, variance, quantiles, and fraction expressed per group in one '
+                             'streaming pass, writing <matrix>.%s instead of a filtered matrix. -g and -d optionally '
+                             'restrict the genes and cell lines.' % STATS_EXT)
+
+    parser.add_argument("-q", "--quantiles", type=str, default=DEFAULT_QUANTILES,
+                        help='Comma-separated approximate quantiles to report with --aggregate. Default %s.'
+                             % DEFAULT_QUANTILES)
+
+    parser.add_argument("-e", "--expressed_threshold", type=float, default=EXPRESSED_THRESHOLD,
+                        help='Values above this count as expressed with --aggregate. Default %s.'
+                             % EXPRESSED_THRESHOLD)
+
+    parser.add_argument("-x", "--use_index", action="store_true",
+                        help='Flag to seek to selected rows via a depMap ID to byte offset index, building it on first '
+                             'use.')
+
+    parser.add_argument("-i", "--index_file", type=str, default=None,
+                        help='Optional row index path. Default the matrix path with extension .%s.'
+                             % ccle_cache.ROW_INDEX_EXT)
+
+    parser.add_argument("-c", "--use_cache", action="store_true",
+                        help='Flag to query a memory-mapped binary cache of the matrix, building it on first use. '
+                             'Values are stored at float32 precision.')
+
+    parser.add_argument("-n", "--cache_dir", type=str, default=None,
+                        help='Optional cache directory. Default the matrix path with extension .%s.'
+                             % ccle_cache.CACHE_EXT)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. The matrix may be plain, gzipped, '
+                             'or bgzipped regardless.')
+
     parser.add_argument("-o", "--output_dir", type=str, default=".",
                         help='Optional output directory. Default current working directory.')
 
+    instrumentation.add_arguments(parser)
+
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
 
 
-def workflow(ccle_matrix, genes, cell_line_ids, output_dir="."):
-    """Runs the CCLE matrix filtering workflow.
+def read_set(filename):
+    """Reads the non-empty lines of a file into a set.
+
+    :param str filename: file with one entry per line
+    :return set: entries
+    """
+
+    with open(filename, "r") as in_fh:
+        entries = set(in_fh.read().split(FILE_NEWLINE))
+
+    # Remove any empty entries due to empty lines
+    entries -= {""}
+    return entries
+
+
+def get_output_name(ccle_matrix, output_dir, name=None, compression=None):
+    """Gets the output filepath for a query.
 
     :param str ccle_matrix: CCLE matrix
-    :param str genes: genes to select
-    :param str cell_line_ids: cell lines to select (depMap IDs)
-    :param str output_dir: optional output directory
+    :param str output_dir: output directory
+    :param str | None name: query name; None for a single query
+    :param str | None compression: gzip, bgzip, or None
+    :return str: output filepath
     """
 
-    output_file = os.path.join(output_dir, replace_extension(os.path.basename(ccle_matrix), "filt.txt"))
+    ext = FILT_EXT if name is None else ".".join((name, FILT_EXT,))
+    output_file = os.path.join(output_dir, replace_extension(os.path.basename(ccle_matrix), ext))
+    return compressed_io.get_output_name(output_file, compression)
+
+
+def parse_batch(batch, ccle_matrix, output_dir, compression=None):
+    """Parses a batch file of named queries.
+
+    :param str batch: tab-delimited file of NAME, genes file, and depMap IDs file per line
+    :param str ccle_matrix: CCLE matrix
+    :param str output_dir: output directory
+    :param str | None compression: gzip, bgzip, or None
+    :return list: (gene set, cell line set, output filepath) tuples
+    """
+
+    queries = []
+    names = set()
+    with open(batch, "r") as batch_fh:
+        for line in batch_fh:
+
+            if not line.strip():
+                continue
 
-    with open(genes, "r") as gene_fh, open(cell_line_ids, "r") as cell_line_fh, \
-            open(ccle_matrix, "r") as ccle_fh, open(output_file, "w") as output_fh:
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if len(line_split) != 3:
+                raise NotImplementedError("Batch line is not NAME, genes file, and depMap IDs file: %s" % line)
 
-        gene_set = set(gene_fh.read().split(FILE_NEWLINE))
-        cell_line_set = set(cell_line_fh.read().split(FILE_NEWLINE))
+            name, genes, cell_line_ids = line_split
+            if name in names:
+                raise NotImplementedError("Batch query names must be unique: %s" % name)
+            names.add(name)
 
-        # Remove any empty genes do to empty lines
-        gene_set -= {""}
-        cell_line_set -= {""}
+            queries.append((read_set(genes), read_set(cell_line_ids),
+                            get_output_name(ccle_matrix, output_dir, name, compression),))
 
-        counter = 0
-        for i, line in enumerate(ccle_fh):
+    return queries
 
-            line_split = line.split(",")
+
+def get_col_positions(header_split, gene_set):
+    """Gets the ordered positions of the columns for genes of interest.
+
+    :param list header_split: header fields
+    :param set gene_set: genes to select
+    :return list: column positions
+    """
+
+    col_positions = [i for i, name in enumerate(header_split) if ccle_cache.get_gene_name(name) in gene_set]
+    return col_positions
+
+
+def iter_rows(ccle_fh, cell_line_set, row_index=None):
+    """Iterates the matrix rows of selected cell lines, in file order.
+
+    :param file ccle_fh: CCLE matrix opened in binary mode, positioned after the header; seekable if using the index
+    :param set cell_line_set: cell lines to select (depMap IDs)
+    :param dict | None row_index: optional row index from ccle_cache.load_row_index to seek to rows
+    :return generator: rows without the newline
+    """
+
+    if row_index is not None:
+        for offset, length in sorted(row_index[e] for e in cell_line_set if e in row_index):
+            ccle_fh.seek(offset)
+            yield ccle_fh.read(length).decode().rstrip(FILE_NEWLINE)
+        return
+
+    for line in ccle_fh:
+
+        # Check the depMap ID before decoding and splitting the row
+        if ccle_cache.get_row_id(line) in cell_line_set:
+            yield line.decode().rstrip(FILE_NEWLINE)
+
+
+def filter_streaming(ccle_matrix, queries, use_index=False, index_file=None, compression=None):
+    """Filters the matrix CSV for one or more queries in a single pass.
+
+    :param str ccle_matrix: CCLE matrix
+    :param list queries: (gene set, cell line set, output filepath) tuples
+    :param bool use_index: seek to selected rows via the row index
+    :param str | None index_file: optional row index path
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return list: number of cell-line rows written per query
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("index"):
+        row_index = ccle_cache.load_row_index(ccle_matrix, index_file) if use_index else None
+
+    all_cell_lines = set().union(*[cell_line_set for _, cell_line_set, _ in queries])
+
+    output_fhs = [compressed_io.open_output(output_file, compression=compression) for _, _, output_file in queries]
+    counters = [0] * len(queries)
+
+    try:
+        with compressed_io.open_input(ccle_matrix, "rb", threaded=row_index is None) as ccle_fh:
+
+            header_split = ccle_fh.readline().decode().rstrip(FILE_NEWLINE).split(CSV_DELIM)
 
             # Determine which columns to extract
-            if i == 0:
-                col_indices = set([i for i, name in enumerate(line_split) if name.split(" ")[0] in gene_set])
-                line_selected = [field for i, field in enumerate(line_split) if i in col_indices]
-                output_fh.write(FILE_DELIM.join([DEPMAP_ID] + line_selected) + FILE_NEWLINE)
+            col_positions = [get_col_positions(header_split, gene_set) for gene_set, _, _ in queries]
+            for output_fh, positions in zip(output_fhs, col_positions):
+                output_fh.write(FILE_DELIM.join([DEPMAP_ID] + [header_split[i] for i in positions]) + FILE_NEWLINE)
+
+            # Fields after the last selected column are never split
+            max_split = max([max(positions, default=0) for positions in col_positions]) + 1
+            routes = list(enumerate(zip(queries, col_positions, output_fhs)))
+
+            rows = metrics.counted(instrumentation.READ, iter_rows(ccle_fh, all_cell_lines, row_index))
+
+            for line in metrics.timed_iter("parse", rows):
+
+                with metrics.stage("match"):
+                    line_split = line.split(CSV_DELIM, max_split)
+
+                    # Extract the fields for genes of interest
+                    for j, ((_, cell_line_set, _), positions, output_fh) in routes:
+                        if line_split[0] in cell_line_set:
+                            line_selected = [line_split[i] for i in positions]
+                            output_fh.write(FILE_DELIM.join([line_split[0]] + line_selected) + FILE_NEWLINE)
+                            counters[j] += 1
+                            metrics.add(instrumentation.WRITTEN)
+    finally:
+        for output_fh in output_fhs:
+            output_fh.close()
+
+    return counters
+
+
+def filter_cached(ccle_matrix, queries, cache_dir=None, compression=None):
+    """Filters the matrix for one or more queries by slicing a memory-mapped binary cache.
+
+    :param str ccle_matrix: CCLE matrix
+    :param list queries: (gene set, cell line set, output filepath) tuples
+    :param str | None cache_dir: optional cache directory
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return list: number of cell-line rows written per query
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("index"):
+        cache = ccle_cache.load_cache(ccle_matrix, cache_dir)
+
+    counters = []
+    for gene_set, cell_line_set, output_file in queries:
+
+        with metrics.stage("match"):
+            row_names, col_names, values = ccle_cache.query_cache(cache, gene_set, cell_line_set)
+
+        metrics.add(instrumentation.READ, len(row_names))
+
+        with compressed_io.open_output(output_file, compression=compression) as output_fh, metrics.stage("write"):
+
+            output_fh.write(FILE_DELIM.join([DEPMAP_ID] + col_names) + FILE_NEWLINE)
+
+            for row_name, row_values in zip(row_names, values):
+                output_fh.write(FILE_DELIM.join([row_name] + ccle_cache.format_values(row_values)) + FILE_NEWLINE)
+
+        counters.append(len(row_names))
+        metrics.add(instrumentation.WRITTEN, len(row_names))
+
+    return counters
+
+
+def read_group_map(group_map):
+    """Reads the group of each cell line.
+
+    :param str group_map: tab- or comma-delimited file of depMap ID and group per line
+    :return dict: {depMap ID: group}
+    """
+
+    groups = {}
+    with open(group_map, "r") as group_fh:
+        for line in group_fh:
+
+            line_split = GROUP_MAP_DELIM_RE.split(line.rstrip(FILE_NEWLINE))
+            if len(line_split) < 2 or not line_split[0]:
                 continue
 
-            # Extract the fields for genes of interest
-            if line_split[0] in cell_line_set:
-                line_selected = [field for i, field in enumerate(line_split) if i in col_indices]
-                output_fh.write(FILE_DELIM.join([line_split[0]] + line_selected) + FILE_NEWLINE)
+            groups[line_split[0]] = line_split[1]
+
+    return groups
+
+
+def _flush_block(accumulator, threshold):
+    """Merges the buffered rows of a group into its accumulators.
+
+    :param dict accumulator: group accumulator, updated in place
+    :param float threshold: values above this count as expressed
+    """
+
+    if not accumulator["block"]:
+        return
+
+    block = np.vstack(accumulator["block"])
+    streaming_stats.update_moments(accumulator["moments"], block, threshold)
+    streaming_stats.update_sketch(accumulator["sketch"], block)
+    accumulator["block"] = []
+
+
+def format_stat(value):
+    """Formats a statistic for output.
+
+    :param float value: statistic
+    :return str: formatted value, NA for NaN
+    """
+
+    return NA_STR if np.isnan(value) else "%.6g" % value
+
+
+def aggregate_streaming(ccle_matrix, groups, output_file, gene_set=None, quantiles=(0.25, 0.5, 0.75,),
+                        threshold=EXPRESSED_THRESHOLD, use_index=False, index_file=None, compression=None):
+    """Computes per-gene statistics per group in one pass, without writing a filtered matrix.
+
+    Rows are buffered per group and merged into the group accumulators in blocks, so memory is bounded by the block
+    size and quantile sketch size rather than the number of cell lines.
+
+    :param str ccle_matrix: CCLE matrix
+    :param dict groups: {depMap ID: group} for the cell lines to summarize
+    :param str output_file: output filepath
+    :param set | None gene_set: genes to summarize; None for all genes
+    :param tuple quantiles: quantiles to report
+    :param float threshold: values above this count as expressed
+    :param bool use_index: seek to selected rows via the row index
+    :param str | None index_file: optional row index path
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return int: number of cell-line rows summarized
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("index"):
+        row_index = ccle_cache.load_row_index(ccle_matrix, index_file) if use_index else None
+
+    accumulators = {}
+    counter = 0
+
+    with compressed_io.open_input(ccle_matrix, "rb", threaded=row_index is None) as ccle_fh:
+
+        header_split = ccle_fh.readline().decode().rstrip(FILE_NEWLINE).split(CSV_DELIM)
+
+        if gene_set is None:
+            col_positions = list(range(1, len(header_split)))
+        else:
+            col_positions = get_col_positions(header_split, gene_set)
+
+        max_split = max(col_positions, default=0) + 1
+
+        rows = metrics.counted(instrumentation.READ, iter_rows(ccle_fh, set(groups), row_index))
+
+        for line in metrics.timed_iter("parse", rows):
+
+            with metrics.stage("aggregate"):
+                line_split = line.split(CSV_DELIM, max_split)
+                group = groups[line_split[0]]
+
+                if group not in accumulators:
+                    accumulators[group] = {"moments": streaming_stats.new_moments(len(col_positions)),
+                                           "sketch": streaming_stats.new_sketch(len(col_positions)), "block": []}
+
+                accumulator = accumulators[group]
+                accumulator["block"].append(ccle_cache.parse_values([line_split[i] for i in col_positions]))
                 counter += 1
 
-        logger.info("Filtered %i cell-line rows." % counter)
+                if len(accumulator["block"]) == BLOCK_ROWS:
+                    _flush_block(accumulator, threshold)
+
+    header = ["Gene", "Group", "N", "Mean", "Variance"] + ["Q%s" % q for q in quantiles] + ["Fraction_expressed"]
+    col_names = [header_split[i] for i in col_positions]
+
+    with compressed_io.open_output(output_file, compression=compression) as output_fh, metrics.stage("write"):
+
+        output_fh.write(FILE_DELIM.join(header) + FILE_NEWLINE)
+
+        for group in sorted(accumulators):
+
+            accumulator = accumulators[group]
+            _flush_block(accumulator, threshold)
 
+            moments = accumulator["moments"]
+            variance = streaming_stats.get_variance(moments)
+            group_quantiles = streaming_stats.get_quantiles(accumulator["sketch"], quantiles)
 
-def main():
-    """Runs the workflow when called from command line."""
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(moments["n"] > 0, moments["mean"], np.nan)
+                frac_expressed = np.where(moments["n"] > 0, moments["n_above"] / moments["n"], np.nan)
 
-    parsed_args = parse_commandline_params(sys.argv[1:])
+            for j, col_name in enumerate(col_names):
+                stats = [mean[j], variance[j]] + list(group_quantiles[:, j]) + [frac_expressed[j]]
+                res = [col_name, group, str(moments["n"][j])] + [format_stat(e) for e in stats]
+                output_fh.write(FILE_DELIM.join(res) + FILE_NEWLINE)
+                metrics.add(instrumentation.WRITTEN)
+
+    return counter
+
+
+def workflow(ccle_matrix, genes=None, cell_line_ids=None, output_dir=".", use_cache=False, cache_dir=None,
+             use_index=False, index_file=None, batch=None, aggregate=None, quantiles=DEFAULT_QUANTILES,
+             expressed_threshold=EXPRESSED_THRESHOLD, compression=None):
+    """Runs the CCLE matrix filtering workflow.
+
+    :param str ccle_matrix: CCLE matrix
+    :param str | None genes: genes to select
+    :param str | None cell_line_ids: cell lines to select (depMap IDs)
+    :param str output_dir: optional output directory
+    :param bool use_cache: query a memory-mapped binary cache of the matrix instead of parsing the CSV
+    :param str | None cache_dir: optional cache directory
+    :param bool use_index: seek to selected rows via a row index instead of scanning the CSV
+    :param str | None index_file: optional row index path
+    :param str | None batch: optional file of named queries, answered together in place of genes and cell_line_ids
+    :param str | None aggregate: optional depMap ID to group file; compute per-gene statistics per group instead
+    :param str quantiles: comma-separated quantiles to report when aggregating
+    :param float expressed_threshold: values above this count as expressed when aggregating
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return list: output filepaths
+    """
+
+    if aggregate is not None:
+
+        groups = read_group_map(aggregate)
+        if cell_line_ids is not None:
+            cell_line_set = read_set(cell_line_ids)
+            groups = {k: v for k, v in groups.items() if k in cell_line_set}
+
+        gene_set = read_set(genes) if genes is not None else None
+        output_file = compressed_io.get_output_name(
+            os.path.join(output_dir, replace_extension(os.path.basename(ccle_matrix), STATS_EXT)), compression)
+        quantile_values = tuple(float(e) for e in quantiles.split(","))
+
+        counter = aggregate_streaming(ccle_matrix, groups, output_file, gene_set, quantile_values,
+                                      expressed_threshold, use_index, index_file, compression)
+
+        logger.info("Summarized %i cell-line rows to %s." % (counter, output_file))
+        return [output_file]
+
+    if batch is not None:
+        queries = parse_batch(batch, ccle_matrix, output_dir, compression)
+    elif genes is not None and cell_line_ids is not None:
+        queries = [(read_set(genes), read_set(cell_line_ids),
+                    get_output_name(ccle_matrix, output_dir, None, compression),)]
+    else:
+        raise NotImplementedError("Provide either genes and depMap IDs, or a batch file of queries.")
+
+    if use_cache:
+        counters = filter_cached(ccle_matrix, queries, cache_dir, compression)
+    else:
+        counters = filter_streaming(ccle_matrix, queries, use_index, index_file, compression)
+
+    for (_, _, output_file), counter in zip(queries, counters):
+        logger.info("Filtered %i cell-line rows to %s." % (counter, output_file))
+
+    return [output_file for _, _, output_file in queries]
+
+
+def main(args=None):
+    """Runs the workflow when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
+
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
     outdir = parsed_args["output_dir"]
     if not os.path.exists(outdir):
@@ -139,8 +533,16 @@ def main():
 
     logger.info("Started %s" % sys.argv[0])
 
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
     workflow(ccle_matrix=parsed_args["CCLE_matrix"], genes=parsed_args["genes"],
-             cell_line_ids=parsed_args["depMap_IDs"], output_dir=parsed_args["output_dir"])
+             cell_line_ids=parsed_args["depMap_IDs"], output_dir=parsed_args["output_dir"],
+             use_cache=parsed_args["use_cache"], cache_dir=parsed_args["cache_dir"],
+             use_index=parsed_args["use_index"], index_file=parsed_args["index_file"], batch=parsed_args["batch"],
+             aggregate=parsed_args["aggregate"], quantiles=parsed_args["quantiles"],
+             expressed_threshold=parsed_args["expressed_threshold"], compression=parsed_args["compression"])
+
+    instrumentation.finish()
 
     logger.info("Completed %s" % sys.argv[0])
 
@@ -2,9 +2,11 @@
 """Filters a GFF/GTF by transcript IDs."""
 
 import argparse
+import compressed_io
+import gtf_index
+import instrumentation
 import logging
 import os
-import pybedtools
 import sys
 
 __author__ = "Ian Hoskins"
@@ -16,14 +18,7 @@ __email__ = "ianjameshoskins@utexas.edu"
 __status__ = "Development"
 
 __logger = logging.getLogger(__name__)
-
-# Consider putting the following in a logging config file
-__logger.setLevel(logging.DEBUG)
-__fhandler = logging.FileHandler("stderr.log")
-__fhandler.setLevel(logging.DEBUG)
-__formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-__fhandler.setFormatter(__formatter)
-__logger.addHandler(__fhandler)
+LOGFILE = "stderr.log"
 
 DEFAULT_EXT = "filt.gtf"
 DEFAULT_OUTDIR = "."
@@ -50,6 +45,19 @@ def parse_commandline_params(args):
     parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_OUTDIR,
                         help='Output directory. Default current working directory.')
 
+    parser.add_argument("-x", "--use_index", action="store_true",
+                        help="Flag to query a persistent transcript index of the GTF instead of scanning it. "
+                             "The index is built on first use and rebuilt when the GTF changes.")
+
+    parser.add_argument("-n", "--index_file", type=str, default=None,
+                        help="Optional index path. Default the GTF path with extension .%s." % gtf_index.INDEX_EXT)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help="Optional output compression, in background threads. The GTF may be plain, gzipped, or "
+                             "bgzipped regardless.")
+
+    instrumentation.add_arguments(parser)
+
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
 
@@ -83,28 +91,62 @@ def replace_extension(filename, ext, ignore_exts=(".gz", ".bz", ".bz2",)):
     return ext_res
 
 
-def extract_gff_records(gff, ids, outdir=".", ext=DEFAULT_EXT):
+def extract_indexed_gff_records(gff, trx_ids, outfile, index_file=None, compression=None):
+    """Extracts GFF records for specific transcripts via random access into a GTF index.
+
+    :param str gff: Ensembl GFF/GTF filename
+    :param set trx_ids: Ensembl transcript IDs, without minor version number
+    :param str outfile: output filtered GFF filepath
+    :param str | None index_file: optional index path
+    :param str | None compression: output compression, gzip, bgzip, or None
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("index"):
+        conn = gtf_index.load_index(gff, index_file)
+
+    with compressed_io.open_output(outfile, compression=compression) as out_gff, metrics.stage("match"):
+        for line in metrics.counted(instrumentation.WRITTEN, gtf_index.get_records(conn, gff, trx_ids)):
+            out_gff.write(line if line.endswith(FILE_NEWLINE) else line + FILE_NEWLINE)
+
+    conn.close()
+
+
+def extract_gff_records(gff, ids, outdir=".", ext=DEFAULT_EXT, use_index=False, index_file=None, compression=None):
     """Extracts GFF records for specific transcripts.
 
     :param str gff: Ensembl GFF/GTF filename
     :param str ids: Ensembl transcript IDs, without minor version number, one per line
     :param str ext: optional output extension for the filtered GFF
     :param str outdir: optional output directory.
+    :param bool use_index: query a persistent transcript index instead of scanning the GFF
+    :param str | None index_file: optional index path
+    :param str | None compression: output compression, gzip, bgzip, or None
     :return str: filtered GFF filepath
     """
 
     if not os.path.exists(outdir):
         os.mkdir(outdir)
 
-    outfile = os.path.join(outdir, replace_extension(os.path.basename(gff), ext))
+    outfile = compressed_io.get_output_name(os.path.join(outdir, replace_extension(os.path.basename(gff), ext)),
+                                            compression)
 
     with open(ids, "r") as ids_fh:
         trx_ids = {e.strip(FILE_NEWLINE) for e in ids_fh}
 
+    if use_index:
+        extract_indexed_gff_records(gff=gff, trx_ids=trx_ids, outfile=outfile, index_file=index_file,
+                                   compression=compression)
+        return outfile
+
+    # Imported here so that indexed lookups do not require pybedtools
+    import pybedtools
     gff_bedtool = pybedtools.BedTool(gff)
+    metrics = instrumentation.get_metrics()
 
-    with open(outfile, "w") as out_gff:
-        for interval in gff_bedtool:
+    with compressed_io.open_output(outfile, compression=compression) as out_gff, metrics.stage("match"):
+        for interval in metrics.counted(instrumentation.READ, gff_bedtool):
 
             if GFF_ATTR_TRANSCRIPT_ID not in interval.attrs:
                 continue
@@ -113,34 +155,57 @@ def extract_gff_records(gff, ids, outdir=".", ext=DEFAULT_EXT):
             
             if trx_id in trx_ids:
                 out_gff.write(FILE_DELIM.join(interval.fields) + FILE_NEWLINE)
+                metrics.add(instrumentation.WRITTEN)
 
     return outfile
 
 
-def workflow(gff, ids, ext=DEFAULT_EXT, outdir="."):
+def workflow(gff, ids, ext=DEFAULT_EXT, outdir=".", use_index=False, index_file=None, compression=None):
     """Filter a GFF by transcript IDs.
 
     :param str gff: Ensembl GFF/GTF filename
     :param str ids: Ensembl transcript IDs, without minor version number, one per line
     :param str ext: optional output extension for the GFF (e.g. set_A.gff)
     :param str outdir: optional output dir for the results
+    :param bool use_index: query a persistent transcript index instead of scanning the GFF
+    :param str | None index_file: optional index path
+    :param str | None compression: output compression, gzip, bgzip, or None
     :return str: filtered GFF filepath
     """
 
     # Uses default file extension from the GFF, written to the outdir by side-effect
-    filt_gff = extract_gff_records(gff=gff, ids=ids, ext=ext, outdir=outdir)
+    filt_gff = extract_gff_records(gff=gff, ids=ids, ext=ext, outdir=outdir, use_index=use_index, index_file=index_file,
+                                   compression=compression)
     return filt_gff
 
 
-def main():
-    """Runs the workflow when called from command line."""
+def main(args=None):
+    """Runs the workflow when called from command line.
 
-    parsed_args = parse_commandline_params(sys.argv[1:])
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
 
-    workflow(gff=parsed_args["gff"], ids=parsed_args["ids"], ext=parsed_args["ext"], outdir=parsed_args["outdir"])
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
+    # Consider putting the following in a logging config file
+    __logger.setLevel(logging.DEBUG)
+    fhandler = logging.FileHandler(LOGFILE)
+    fhandler.setLevel(logging.DEBUG)
+    fhandler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    __logger.addHandler(fhandler)
 
-if __name__ == "__main__":
     __logger.info("Started %s" % sys.argv[0])
-    main()
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], __logger)
+
+    workflow(gff=parsed_args["gff"], ids=parsed_args["ids"], ext=parsed_args["ext"], outdir=parsed_args["outdir"],
+             use_index=parsed_args["use_index"], index_file=parsed_args["index_file"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
     __logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""Bit-parallel approximate matching of short DNA flanks across batches of reads.
+
+Flanks up to 64 nt are encoded as bit-vectors and matched against every read of a batch at once, with one NumPy
+operation per text position rather than one Python call per read. Two modes are supported:
+
+    substitution    Hamming distance (shift-and with one state vector per allowed mismatch), equivalent to a
+                    regex fuzzy search of the form (FLANK){s<=k}
+    edit            Levenshtein distance (Myers' bit-vector algorithm), with the start of each hit recovered by an
+                    anchored pass over the reversed flank
+
+For each read the hit is reported as 0-based half-open (start, end) coordinates and a distance, or -1 for all three
+when the flank is not found. By default the leftmost hit within the allowance is reported, as regex does; with
+best=True the leftmost hit of minimal distance is reported instead.
+
+An exact seed prefilter is available via find_seed_bounds and match_seeded. A flank split into max_dist + 1
+non-overlapping seeds must contain at least one seed exactly in any hit (pigeonhole), so reads without a seed are
+rejected by a plain substring scan, and the remaining reads are matched only from the leftmost position a hit could
+start at. Results are identical to match_batch.
+"""
+
+import numpy as np
+
+SUBSTITUTION_MODE = "substitution"
+EDIT_MODE = "edit"
+MATCH_MODES = {SUBSTITUTION_MODE, EDIT_MODE}
+MAX_FLANK_LEN = 64
+NO_HIT = -1
+
+# Read bases are encoded as ACGTN, with any other character and padding sharing a code that matches nothing
+BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3, "N": 4}
+OTHER_CODE = 5
+N_CODES = 6
+ENCODE_TABLE = np.full(256, OTHER_CODE, dtype=np.uint8)
+for _base, _code in BASE_CODES.items():
+    ENCODE_TABLE[ord(_base)] = _code
+    ENCODE_TABLE[ord(_base.lower())] = _code
+
+ONE = np.uint64(1)
+
+
+def compile_flank(flank, max_dist, mode=SUBSTITUTION_MODE):
+    """Precomputes the match bit-vectors of a flank.
+
+    :param str flank: flank sequence, at most 64 nt
+    :param int max_dist: maximum number of mismatches (substitution) or edits (edit)
+    :param str mode: substitution or edit
+    :return dict: compiled flank for match_batch
+    """
+
+    flank = flank.upper()
+
+    if mode not in MATCH_MODES:
+        raise NotImplementedError("Match mode must be one of %s." % ", ".join(sorted(MATCH_MODES)))
+
+    if not 0 < len(flank) <= MAX_FLANK_LEN:
+        raise NotImplementedError("Flanks must be 1-%i nt; got %i nt." % (MAX_FLANK_LEN, len(flank)))
+
+    compiled = {"flank": flank, "max_dist": max_dist, "mode": mode,
+                "peq": _get_peq(flank), "peq_rev": _get_peq(flank[::-1]), "seeds": get_seeds(flank, max_dist)}
+    return compiled
+
+
+def get_seeds(flank, max_dist):
+    """Splits a flank into max_dist + 1 non-overlapping seeds of near-equal length.
+
+    :param str flank: flank sequence
+    :param int max_dist: maximum number of mismatches or edits
+    :return list: (seed, offset in flank) tuples; empty if the flank is too short to seed
+    """
+
+    n_seeds = max_dist + 1
+    if n_seeds > len(flank):
+        return []
+
+    bounds = [i * len(flank) // n_seeds for i in range(n_seeds + 1)]
+    seeds = [(flank[bounds[i]:bounds[i + 1]], bounds[i],) for i in range(n_seeds)]
+    return seeds
+
+
+def _get_peq(flank):
+    """Gets the per-base match bit-vectors of a sequence.
+
+    :param str flank: flank sequence
+    :return numpy.ndarray: uint64 bit-vector per base code, bit i set where flank[i] is that base
+    """
+
+    peq = np.zeros(N_CODES, dtype=np.uint64)
+    for i, base in enumerate(flank):
+        code = ENCODE_TABLE[ord(base)]
+        if code != OTHER_CODE:
+            peq[code] |= ONE << np.uint64(i)
+    return peq
+
+
+def encode_seqs(seqs):
+    """Encodes a batch of reads as a padded code matrix.
+
+    :param list seqs: read sequences
+    :return tuple: (numpy.ndarray N x L uint8 codes, numpy.ndarray read lengths)
+    """
+
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+    max_len = int(lengths.max()) if len(seqs) else 0
+
+    # Scatter all reads into the padded matrix at once rather than row by row
+    flat = np.frombuffer("".join(seqs).encode(), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(seqs)), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    codes = np.full((len(seqs), max_len), OTHER_CODE, dtype=np.uint8)
+    codes[rows, cols] = ENCODE_TABLE[flat]
+    return codes, lengths
+
+
+def _record_hits(hit, dist, t, res_end, res_dist, best):
+    """Updates the per-read hit records with hits ending at text position t.
+
+    :param numpy.ndarray hit: reads with a hit ending at t
+    :param numpy.ndarray dist: hit distance per read
+    :param int t: text position
+    :param numpy.ndarray res_end: hit end per read, updated in place
+    :param numpy.ndarray res_dist: hit distance per read, updated in place
+    :param bool best: keep the leftmost minimal-distance hit rather than the leftmost hit
+    """
+
+    if best:
+        update = hit & ((res_dist == NO_HIT) | (dist < res_dist))
+    else:
+        update = hit & (res_dist == NO_HIT)
+
+    res_end[update] = t + 1
+    res_dist[update] = dist[update]
+
+
+def _match_substitution(compiled, codes, lengths, best):
+    """Finds Hamming-distance hits with shift-and state vectors.
+
+    State vector j has bit i set when flank[0..i] matches the text ending at the current position with at most j
+    mismatches.
+
+    :param dict compiled: compiled flank
+    :param numpy.ndarray codes: N x L read codes
+    :param numpy.ndarray lengths: read lengths
+    :param bool best: keep the leftmost minimal-distance hit
+    :return tuple: (start, end, dist) arrays
+    """
+
+    n_reads, max_len = codes.shape
+    flank_len = len(compiled["flank"])
+    max_dist = compiled["max_dist"]
+    peq = compiled["peq"]
+    high_bit = ONE << np.uint64(flank_len - 1)
+
+    states = [np.zeros(n_reads, dtype=np.uint64) for _ in range(max_dist + 1)]
+    res_end = np.full(n_reads, NO_HIT, dtype=np.int64)
+    res_dist = np.full(n_reads, NO_HIT, dtype=np.int64)
+
+    # Text positions are visited in order, so store each position's codes contiguously
+    columns = np.ascontiguousarray(codes.T)
+
+    for t in range(max_len):
+
+        eq = peq[columns[t]]
+        shifted = [(state << ONE) | ONE for state in states]
+
+        states[0] = shifted[0] & eq
+        for j in range(1, max_dist + 1):
+            # Either extend a j-mismatch prefix with a match, or a (j-1)-mismatch prefix with a mismatch
+            states[j] = (shifted[j] & eq) | shifted[j - 1]
+
+        if t < flank_len - 1:
+            continue
+
+        dist = np.full(n_reads, NO_HIT, dtype=np.int64)
+        for j in range(max_dist, -1, -1):
+            dist[(states[j] & high_bit) != 0] = j
+
+        hit = (dist != NO_HIT) & (t < lengths)
+        _record_hits(hit, dist, t, res_end, res_dist, best)
+
+        if not best and (res_dist != NO_HIT).all():
+            break
+
+    res_start = np.where(res_end == NO_HIT, NO_HIT, res_end - flank_len)
+    return res_start, res_end, res_dist
+
+
+def _myers(peq, codes, flank_len, anchored=False):
+    """Runs Myers' bit-vector edit distance over the columns of a code matrix.
+
+    :param numpy.ndarray peq: flank match bit-vectors
+    :param numpy.ndarray codes: N x L text codes
+    :param int flank_len: flank length
+    :param bool anchored: anchor alignments at the first text position rather than allowing any start
+    :return generator: per text position, the edit distance of the best alignment of the flank ending there
+    """
+
+    n_reads, max_len = codes.shape
+    high_bit = ONE << np.uint64(flank_len - 1)
+
+    pv = np.full(n_reads, np.iinfo(np.uint64).max, dtype=np.uint64)
+    mv = np.zeros(n_reads, dtype=np.uint64)
+    score = np.full(n_reads, flank_len, dtype=np.int64)
+    columns = np.ascontiguousarray(codes.T)
+
+    for t in range(max_len):
+
+        eq = peq[columns[t]]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+
+        score += (ph & high_bit) != 0
+        score -= (mh & high_bit) != 0
+
+        # Anchoring makes the first row of the DP matrix increase by one per text position
+        ph = (ph << ONE) | ONE if anchored else ph << ONE
+        mh = mh << ONE
+
+        pv = mh | ~(xv | ph)
+        mv = ph & xv
+
+        yield score
+
+
+def _match_edit(compiled, codes, lengths, best):
+    """Finds edit-distance hits with Myers' algorithm, then recovers the hit starts.
+
+    :param dict compiled: compiled flank
+    :param numpy.ndarray codes: N x L read codes
+    :param numpy.ndarray lengths: read lengths
+    :param bool best: keep the leftmost minimal-distance hit
+    :return tuple: (start, end, dist) arrays
+    """
+
+    n_reads = codes.shape[0]
+    flank_len = len(compiled["flank"])
+    max_dist = compiled["max_dist"]
+
+    res_end = np.full(n_reads, NO_HIT, dtype=np.int64)
+    res_dist = np.full(n_reads, NO_HIT, dtype=np.int64)
+
+    for t, score in enumerate(_myers(compiled["peq"], codes, flank_len)):
+        hit = (score <= max_dist) & (t < lengths)
+        _record_hits(hit, score, t, res_end, res_dist, best)
+
+    res_start = np.full(n_reads, NO_HIT, dtype=np.int64)
+    found = np.flatnonzero(res_end != NO_HIT)
+    if len(found) == 0:
+        return res_start, res_end, res_dist
+
+    # Align the reversed flank to the reversed text ending at each hit; the longest window that reaches the hit
+    # distance gives the leftmost start
+    window_len = flank_len + max_dist
+    offsets = res_end[found, None] - 1 - np.arange(window_len)
+    in_read = offsets >= 0
+    windows = np.where(in_read, codes[found[:, None], np.maximum(offsets, 0)], OTHER_CODE).astype(np.uint8)
+
+    span = np.zeros(len(found), dtype=np.int64)
+    for p, score in enumerate(_myers(compiled["peq_rev"], windows, flank_len, anchored=True)):
+        at_dist = (score == res_dist[found]) & in_read[:, p]
+        span[at_dist] = p + 1
+
+    res_start[found] = res_end[found] - span
+    return res_start, res_end, res_dist
+
+
+def match_batch(compiled, codes, lengths, best=False):
+    """Matches a flank against a batch of encoded reads.
+
+    :param dict compiled: compiled flank from compile_flank
+    :param numpy.ndarray codes: N x L read codes from encode_seqs
+    :param numpy.ndarray lengths: read lengths from encode_seqs
+    :param bool best: report the leftmost minimal-distance hit rather than the leftmost hit within the allowance
+    :return tuple: (start, end, dist) int64 arrays, -1 where the flank is not found
+    """
+
+    if compiled["mode"] == SUBSTITUTION_MODE:
+        return _match_substitution(compiled, codes, lengths, best)
+
+    return _match_edit(compiled, codes, lengths, best)
+
+
+def find_seed_bounds(compiled, seqs):
+    """Finds the leftmost position a hit could start at in each read from exact seed occurrences.
+
+    :param dict compiled: compiled flank from compile_flank
+    :param list seqs: read sequences
+    :return numpy.ndarray: int64 lower bound on the hit start per read, -1 where no seed occurs
+    """
+
+    seeds = compiled["seeds"]
+    if not seeds:
+        return np.zeros(len(seqs), dtype=np.int64)
+
+    # Hamming hits are ungapped, so a seed fixes the hit start; indels can shift it by up to max_dist
+    slack = compiled["max_dist"] if compiled["mode"] == EDIT_MODE else 0
+
+    bounds = np.full(len(seqs), NO_HIT, dtype=np.int64)
+    for i, seq in enumerate(seqs):
+
+        lower = None
+        for seed, offset in seeds:
+            pos = seq.find(seed)
+            if pos != -1 and (lower is None or pos - offset < lower):
+                lower = pos - offset
+
+        if lower is not None:
+            bounds[i] = max(lower - slack, 0)
+
+    return bounds
+
+
+def match_seeded(compiled, seqs, bounds, best=False):
+    """Matches a flank against the reads with seed hits, starting each read at its seed bound.
+
+    :param dict compiled: compiled flank from compile_flank
+    :param list seqs: read sequences
+    :param numpy.ndarray bounds: per-read hit start bounds from find_seed_bounds; -1 skips the read
+    :param bool best: report the leftmost minimal-distance hit rather than the leftmost hit within the allowance
+    :return tuple: (start, end, dist) int64 arrays, -1 where the flank is not found or the read was skipped
+    """
+
+    res_start = np.full(len(seqs), NO_HIT, dtype=np.int64)
+    res_end = np.full(len(seqs), NO_HIT, dtype=np.int64)
+    res_dist = np.full(len(seqs), NO_HIT, dtype=np.int64)
+
+    seeded = np.flatnonzero(bounds != NO_HIT)
+    if len(seeded) == 0:
+        return res_start, res_end, res_dist
+
+    seeded_bounds = bounds[seeded]
+    codes, lengths = encode_seqs([seqs[i][b:] for i, b in zip(seeded.tolist(), seeded_bounds.tolist())])
+    start, end, dist = match_batch(compiled, codes, lengths, best)
+
+    found = end != NO_HIT
+    res_start[seeded[found]] = start[found] + seeded_bounds[found]
+    res_end[seeded[found]] = end[found] + seeded_bounds[found]
+    res_dist[seeded[found]] = dist[found]
+    return res_start, res_end, res_dist
+
+
+def match_seqs(compiled, seqs, best=False):
+    """Matches a flank against a list of read sequences.
+
+    :param dict compiled: compiled flank from compile_flank
+    :param list seqs: read sequences
+    :param bool best: report the leftmost minimal-distance hit rather than the leftmost hit within the allowance
+    :return tuple: (start, end, dist) int64 arrays, -1 where the flank is not found
+    """
+
+    codes, lengths = encode_seqs(seqs)
+    return match_batch(compiled, codes, lengths, best)
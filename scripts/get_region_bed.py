@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Gets UTR and CDS regions in transcript coordinates as a BED file, for all transcripts in one pass."""
+
+import argparse
+import collections
+import compressed_io
+import gtf_index
+import instrumentation
+import logging
+import os
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+GFF_COMMENT_CHAR = "#"
+GFF_FEATURE_FIELD = 2
+GFF_START_FIELD = 3
+GFF_END_FIELD = 4
+GFF_STRAND_FIELD = 6
+GFF_ATTR_FIELD = 8
+GFF_NEG_STRAND = "-"
+DEFAULT_EXT = "region.bed"
+SPLIT_EXT = "_region.bed"
+DEFAULT_OUTDIR = "."
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Gencode marks both UTRs as UTR, Ensembl distinguishes them
+CDS_FEATURE = "CDS"
+UTR_FEATURE = "UTR"
+UTR5_FEATURE = "five_prime_utr"
+UTR3_FEATURE = "three_prime_utr"
+REGION_FEATURES = {CDS_FEATURE, UTR_FEATURE, UTR5_FEATURE, UTR3_FEATURE}
+
+# Gencode and Ensembl respectively
+PROTEIN_CODING_ATTRS = ('transcript_type "protein_coding"', 'transcript_biotype "protein_coding"',)
+
+UTR5_NAME = "UTR5"
+CDS_NAME = "CDS"
+UTR3_NAME = "UTR3"
+BED_SCORE = 0
+BED_STRAND = "+"
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "region_bed_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-g", "--gff", type=str, required=True,
+                        help="Gencode or Ensembl GTF, optionally pre-filtered with filter_gtf.py.")
+
+    parser.add_argument("-i", "--ids", type=str, required=True,
+                        help="Text file of transcript IDs without version suffix, one per line.")
+
+    parser.add_argument("-s", "--split", action="store_true",
+                        help="Flag to write one TRX_ID%s file per transcript, as the shell scripts do." % SPLIT_EXT)
+
+    parser.add_argument("-x", "--use_index", action="store_true",
+                        help="Flag to read only the requested transcripts via a persistent GTF index.")
+
+    parser.add_argument("-n", "--index_file", type=str, default=None,
+                        help="Optional index path. Default the GTF path with extension .%s." % gtf_index.INDEX_EXT)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. The GTF may be plain, gzipped, or '
+                             'bgzipped regardless.')
+
+    parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_OUTDIR,
+                        help='Output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def load_region_features(gff_lines, trx_ids):
+    """Groups UTR and CDS features by transcript.
+
+    :param iterable gff_lines: GTF lines
+    :param set trx_ids: transcript IDs without version
+    :return collections.defaultdict: {trx_id: {"strand": str, "coding": bool, "features": [(start, end, feature)]}}
+    """
+
+    trx_features = collections.defaultdict(lambda: {"strand": None, "coding": False, "features": []})
+
+    for line in gff_lines:
+
+        if line.startswith(GFF_COMMENT_CHAR):
+            continue
+
+        fields = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+        if len(fields) <= GFF_ATTR_FIELD or fields[GFF_FEATURE_FIELD] not in REGION_FEATURES:
+            continue
+
+        trx_id = gtf_index.get_attr(fields[GFF_ATTR_FIELD], gtf_index.GFF_ATTR_TRANSCRIPT_ID)
+
+        # Exact match on the version-stripped ID, so ENST0000012 cannot match ENST00000123
+        if trx_id is None or gtf_index.strip_version(trx_id) not in trx_ids:
+            continue
+
+        trx = trx_features[gtf_index.strip_version(trx_id)]
+        trx["strand"] = fields[GFF_STRAND_FIELD]
+        trx["coding"] |= any(attr in fields[GFF_ATTR_FIELD] for attr in PROTEIN_CODING_ATTRS)
+        trx["features"].append((int(fields[GFF_START_FIELD]), int(fields[GFF_END_FIELD]), fields[GFF_FEATURE_FIELD],))
+
+    return trx_features
+
+
+def get_region_lengths(features, strand):
+    """Sums UTR5, CDS, and UTR3 lengths of a transcript.
+
+    Features are ordered 5' to 3', and a Gencode UTR is a 5' UTR until the first CDS is seen.
+
+    :param list features: (start, end, feature) tuples for one transcript
+    :param str strand: transcript strand
+    :return tuple: UTR5, CDS, and UTR3 lengths
+    """
+
+    utr5_len, cds_len, utr3_len = 0, 0, 0
+    cds_seen = False
+
+    for start, end, feature in sorted(features, key=lambda e: e[0], reverse=strand == GFF_NEG_STRAND):
+
+        feature_len = end - start + 1
+
+        if feature == CDS_FEATURE:
+            cds_len += feature_len
+            cds_seen = True
+        elif feature == UTR5_FEATURE or (feature == UTR_FEATURE and not cds_seen):
+            utr5_len += feature_len
+        else:
+            utr3_len += feature_len
+
+    return utr5_len, cds_len, utr3_len
+
+
+def get_region_records(trx_id, utr5_len, cds_len, utr3_len):
+    """Gets transcript-coordinate region BED records.
+
+    :param str trx_id: transcript ID
+    :param int utr5_len: 5' UTR length
+    :param int cds_len: CDS length
+    :param int utr3_len: 3' UTR length
+    :return list: BED records as tuples
+    """
+
+    records = []
+
+    if utr5_len > 0:
+        records.append((trx_id, 0, utr5_len, UTR5_NAME, BED_SCORE, BED_STRAND,))
+
+    records.append((trx_id, utr5_len, utr5_len + cds_len, CDS_NAME, BED_SCORE, BED_STRAND,))
+
+    if utr3_len > 0:
+        records.append((trx_id, utr5_len + cds_len, utr5_len + cds_len + utr3_len, UTR3_NAME, BED_SCORE, BED_STRAND,))
+
+    return records
+
+
+def write_records(out_fh, records):
+    """Writes BED records.
+
+    :param file out_fh: open output file
+    :param list records: BED records as tuples
+    """
+
+    for record in records:
+        out_fh.write(FILE_DELIM.join(map(str, record)) + FILE_NEWLINE)
+
+
+def workflow(gff, ids, outdir=DEFAULT_OUTDIR, split=False, use_index=False, index_file=None, compression=None):
+    """Gets the UTR and CDS regions of transcripts.
+
+    :param str gff: Gencode or Ensembl GTF
+    :param str ids: transcript IDs without version suffix, one per line
+    :param str outdir: optional output directory
+    :param bool split: write one region BED per transcript instead of a single BED
+    :param bool use_index: read only the requested transcripts via a persistent GTF index
+    :param str | None index_file: optional index path
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str | None: region BED filepath, or None if split
+    """
+
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    with open(ids, "r") as ids_fh:
+        # Dict preserves the ID file order while removing duplicates
+        trx_order = list(dict.fromkeys(e.strip() for e in ids_fh if e.strip()))
+
+    trx_ids = set(trx_order)
+    metrics = instrumentation.get_metrics()
+    metrics.add(instrumentation.READ, len(trx_order))
+
+    with metrics.stage("parse"):
+        if use_index:
+            conn = gtf_index.load_index(gff, index_file)
+            trx_features = load_region_features(gtf_index.get_records(conn, gff, trx_ids), trx_ids)
+            conn.close()
+        else:
+            with compressed_io.open_input(gff) as gff_fh:
+                trx_features = load_region_features(gff_fh, trx_ids)
+
+    outfile = None if split else compressed_io.get_output_name(
+        os.path.join(outdir, os.path.basename(os.path.splitext(ids)[0]) + "." + DEFAULT_EXT), compression)
+    out_fh = None if split else compressed_io.open_output(outfile, compression=compression)
+
+    for trx_id in trx_order:
+
+        if trx_id not in trx_features or not trx_features[trx_id]["coding"]:
+            logger.warning("%s was not found in the GTF or is not protein coding and was filtered out" % trx_id)
+            metrics.add(instrumentation.FILTERED)
+            continue
+
+        trx = trx_features[trx_id]
+        with metrics.stage("match"):
+            records = get_region_records(trx_id, *get_region_lengths(trx["features"], trx["strand"]))
+
+        with metrics.stage("write"):
+            if split:
+                trx_fn = compressed_io.get_output_name(os.path.join(outdir, trx_id + SPLIT_EXT), compression)
+                with compressed_io.open_output(trx_fn, compression=compression, threads=0) as trx_fh:
+                    write_records(trx_fh, records)
+            else:
+                write_records(out_fh, records)
+
+        metrics.add(instrumentation.WRITTEN)
+
+    if out_fh is not None:
+        out_fh.close()
+
+    return outfile
+
+
+def main(args=None):
+    """Runs the workflow when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
+
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
+
+    outdir = parsed_args["outdir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    logger.info("Started %s" % sys.argv[0])
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(gff=parsed_args["gff"], ids=parsed_args["ids"], outdir=outdir, split=parsed_args["split"],
+             use_index=parsed_args["use_index"], index_file=parsed_args["index_file"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
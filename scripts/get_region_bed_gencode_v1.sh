@@ -7,7 +7,7 @@ Gets UTR and CDS regions as a BED file. Bedtools must be installed.
 
 -h	Help
 -i	Full path to Ensembl transcript ID file; specify IDs without version suffix, one per line
--t	Full path to Gencode GTF file
+-t	Full path to Gencode GTF file, plain or gzipped
 
 EOF
 }
@@ -40,7 +40,7 @@ cd "$TEMP_DIR"
 
 # Extract records that match the Ensembl IDs
 echo "Filtering GTF. This could take some time..."
-fgrep -f "$TRX_ID_FILE" "$GTF" | awk '{if($3=="UTR" || $3=="CDS") {print}}' - > filt.gtf
+gzip -cdf "$GTF" | fgrep -f "$TRX_ID_FILE" | awk '{if($3=="UTR" || $3=="CDS") {print}}' - > filt.gtf
 
 # Ensure the exons are sorted from 5' to 3' 
 more filt.gtf | awk '{if($7=="+") {print}}' | sort -k4n > filt_pos.gtf
@@ -10,7 +10,7 @@ Bedtools and pybedtools must be installed.
 
 -h	Help
 -i	Full path to Ensembl transcript ID file; specify IDs without version suffix, one per line
--t	Full path to Ensembl GTF file
+-t	Full path to Ensembl GTF file, plain or gzipped
 -p Python script filter_gtf.py
 
 EOF
@@ -49,6 +49,7 @@ cd "$TEMP_DIR"
 python3 "$PYTHON_SCRIPT" -g "$GTF" -i "$TRX_ID_FILE" -o "$TEMP_DIR" -e "filt.gtf"
 
 GTF_BASENAME="${GTF##*/}"
+GTF_BASENAME="${GTF_BASENAME%.gz}"
 FILT_GTF="${GTF_BASENAME%.*}.filt.gtf"
 awk '{if($3=="exon") {print}}' "$FILT_GTF" > filt_exon.gtf
 
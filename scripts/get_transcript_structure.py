@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Gets splice sites, exon counts, and transcript, UTR, and CDS lengths for all transcripts in a GTF."""
+
+import argparse
+import compressed_io
+import gtf_index
+import instrumentation
+import logging
+import numpy as np
+import os
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+GFF_COMMENT_CHAR = "#"
+GFF_FEATURE_FIELD = 2
+GFF_START_FIELD = 3
+GFF_END_FIELD = 4
+GFF_STRAND_FIELD = 6
+GFF_ATTR_FIELD = 8
+GFF_NEG_STRAND = "-"
+SPLICE_SITE_DELIM = ";"
+NA_STR = "NA"
+DEFAULT_EXT = "trx_structure.txt"
+DEFAULT_OUTDIR = "."
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Feature codes; Gencode marks both UTRs as UTR, Ensembl distinguishes them
+EXON_CODE, CDS_CODE, UTR_CODE, UTR5_CODE, UTR3_CODE = range(5)
+FEATURE_CODES = {"exon": EXON_CODE, "CDS": CDS_CODE, "UTR": UTR_CODE,
+                 "five_prime_utr": UTR5_CODE, "three_prime_utr": UTR3_CODE}
+
+# Gencode and Ensembl respectively
+PROTEIN_CODING_ATTRS = ('transcript_type "protein_coding"', 'transcript_biotype "protein_coding"',)
+
+DEFAULT_HEADER = ("Transcript_ID", "Exons", "Transcript_length", "UTR5_length", "CDS_length", "UTR3_length",
+                  "Splice_sites")
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+
+def add_extension(filename, ext):
+    """Adds an extension.
+
+    :param str filename: file path
+    :param str ext: extension to add
+    """
+
+    ext_res = ".".join((filename, ext,))
+    return ext_res
+
+
+def replace_extension(filename, ext, ignore_exts=(".gz", ".bz", ".bz2",)):
+    """Replaces extension of a filename.
+
+    :param str filename: file path
+    :param str ext: extension to add
+    :param tuple ignore_exts: extensions to strip before replacing the extension
+    :return str: filepath with new extension
+    """
+
+    split = os.path.splitext(filename)
+
+    if split[1] in set(ignore_exts):
+        split = os.path.splitext(split[0])
+
+    ext_res = add_extension(split[0], ext)
+    return ext_res
+
+
+LOGFILE = replace_extension(os.path.basename(__file__), "log")
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-g", "--gff", type=str, required=True, help="Gencode or Ensembl GTF.")
+
+    parser.add_argument("-i", "--ids", type=str, default=None,
+                        help="Optional text file of transcript IDs without version suffix, one per line. "
+                             "Default all transcripts.")
+
+    parser.add_argument("-c", "--protein_coding", action="store_true",
+                        help="Flag to report only protein-coding transcripts.")
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. The GTF may be plain, gzipped, or '
+                             'bgzipped regardless.')
+
+    parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_OUTDIR,
+                        help='Output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def load_feature_arrays(gff_lines, trx_ids=None, protein_coding=False):
+    """Loads exon, UTR, and CDS intervals into arrays grouped by transcript.
+
+    :param iterable gff_lines: GTF lines
+    :param set | None trx_ids: transcript IDs without version; None to load all transcripts
+    :param bool protein_coding: only load protein-coding transcripts
+    :return tuple: (list of transcript IDs, dict of arrays trx_idx, start, end, feature, neg_strand)
+    """
+
+    trx_names = {}
+    trx_idx, starts, ends, features, neg_strand = [], [], [], [], []
+
+    for line in gff_lines:
+
+        if line.startswith(GFF_COMMENT_CHAR):
+            continue
+
+        fields = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+        if len(fields) <= GFF_ATTR_FIELD or fields[GFF_FEATURE_FIELD] not in FEATURE_CODES:
+            continue
+
+        if protein_coding and not any(attr in fields[GFF_ATTR_FIELD] for attr in PROTEIN_CODING_ATTRS):
+            continue
+
+        trx_id = gtf_index.get_attr(fields[GFF_ATTR_FIELD], gtf_index.GFF_ATTR_TRANSCRIPT_ID)
+        if trx_id is None:
+            continue
+
+        trx_id = gtf_index.strip_version(trx_id)
+        if trx_ids is not None and trx_id not in trx_ids:
+            continue
+
+        trx_idx.append(trx_names.setdefault(trx_id, len(trx_names)))
+        starts.append(int(fields[GFF_START_FIELD]))
+        ends.append(int(fields[GFF_END_FIELD]))
+        features.append(FEATURE_CODES[fields[GFF_FEATURE_FIELD]])
+        neg_strand.append(fields[GFF_STRAND_FIELD] == GFF_NEG_STRAND)
+
+    arrays = {"trx_idx": np.array(trx_idx, dtype=np.int64), "start": np.array(starts, dtype=np.int64),
+              "end": np.array(ends, dtype=np.int64), "feature": np.array(features, dtype=np.int8),
+              "neg_strand": np.array(neg_strand, dtype=bool)}
+
+    return list(trx_names), arrays
+
+
+def sort_five_to_three(arrays, mask):
+    """Orders a subset of features by transcript, then 5' to 3' within each transcript.
+
+    :param dict arrays: feature arrays from load_feature_arrays
+    :param numpy.ndarray mask: boolean mask of features to keep
+    :return dict: sorted feature arrays for the subset
+    """
+
+    subset = {k: v[mask] for k, v in arrays.items()}
+
+    # Negating starts on the minus strand sorts those features in descending genomic order
+    oriented_start = np.where(subset["neg_strand"], -subset["start"], subset["start"])
+    order = np.lexsort((oriented_start, subset["trx_idx"],))
+
+    sorted_subset = {k: v[order] for k, v in subset.items()}
+    return sorted_subset
+
+
+def segmented_cumsum(values, segment_ids):
+    """Computes a cumulative sum that restarts at each segment.
+
+    :param numpy.ndarray values: values sorted by segment
+    :param numpy.ndarray segment_ids: segment ID per value, sorted
+    :return numpy.ndarray: per-segment inclusive cumulative sums
+    """
+
+    cumsum = np.cumsum(values)
+
+    if len(values) == 0:
+        return cumsum
+
+    segment_first = np.flatnonzero(np.r_[True, segment_ids[1:] != segment_ids[:-1]])
+    segment_lens = np.diff(np.r_[segment_first, len(values)])
+    offsets = np.repeat(cumsum[segment_first] - values[segment_first], segment_lens)
+
+    res = cumsum - offsets
+    return res
+
+
+def compute_structure(n_trx, arrays):
+    """Computes exon counts, splice sites, and region lengths for every transcript at once.
+
+    :param int n_trx: number of transcripts
+    :param dict arrays: feature arrays from load_feature_arrays
+    :return dict: per-transcript arrays exons, trx_len, utr5_len, cds_len, utr3_len, and splice site arrays
+    splice_trx_idx and splice_pos
+    """
+
+    exons = sort_five_to_three(arrays, arrays["feature"] == EXON_CODE)
+    exon_lens = exons["end"] - exons["start"] + 1
+    exon_cumsum = segmented_cumsum(exon_lens, exons["trx_idx"])
+
+    # The 5' splice site of each exon but the last is the cumulative transcript length at its end
+    is_last_exon = np.ones(len(exon_lens), dtype=bool)
+    is_last_exon[:-1] = exons["trx_idx"][1:] != exons["trx_idx"][:-1]
+
+    regions = sort_five_to_three(arrays, arrays["feature"] != EXON_CODE)
+    region_lens = regions["end"] - regions["start"] + 1
+    is_cds = regions["feature"] == CDS_CODE
+
+    # A Gencode UTR is 5' until the first CDS of the transcript is seen
+    cds_seen = segmented_cumsum(is_cds.astype(np.int64), regions["trx_idx"]) > 0
+    is_utr5 = (regions["feature"] == UTR5_CODE) | ((regions["feature"] == UTR_CODE) & ~cds_seen)
+    is_utr3 = (regions["feature"] == UTR3_CODE) | ((regions["feature"] == UTR_CODE) & cds_seen)
+
+    structure = {
+        "exons": np.bincount(exons["trx_idx"], minlength=n_trx),
+        "trx_len": np.bincount(exons["trx_idx"], weights=exon_lens, minlength=n_trx).astype(np.int64),
+        "utr5_len": np.bincount(regions["trx_idx"], weights=region_lens * is_utr5, minlength=n_trx).astype(np.int64),
+        "cds_len": np.bincount(regions["trx_idx"], weights=region_lens * is_cds, minlength=n_trx).astype(np.int64),
+        "utr3_len": np.bincount(regions["trx_idx"], weights=region_lens * is_utr3, minlength=n_trx).astype(np.int64),
+        "splice_trx_idx": exons["trx_idx"][~is_last_exon],
+        "splice_pos": exon_cumsum[~is_last_exon],
+    }
+
+    return structure
+
+
+def write_structure(outfile, trx_names, structure, compression=None):
+    """Writes the transcript structure table.
+
+    :param str outfile: output filepath
+    :param list trx_names: transcript IDs, indexed by transcript index
+    :param dict structure: arrays from compute_structure
+    :param str | None compression: gzip, bgzip, or None
+    """
+
+    # Splice sites are sorted by transcript, so each transcript's sites are a contiguous slice
+    splice_bounds = np.searchsorted(structure["splice_trx_idx"], np.arange(len(trx_names) + 1))
+    splice_pos = structure["splice_pos"].astype(str)
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+
+        out_fh.write(FILE_DELIM.join(DEFAULT_HEADER) + FILE_NEWLINE)
+
+        for i, trx_id in enumerate(trx_names):
+
+            trx_splice_pos = splice_pos[splice_bounds[i]:splice_bounds[i + 1]]
+            splice_sites = SPLICE_SITE_DELIM.join(trx_splice_pos) if len(trx_splice_pos) else NA_STR
+
+            res = (trx_id, structure["exons"][i], structure["trx_len"][i], structure["utr5_len"][i],
+                   structure["cds_len"][i], structure["utr3_len"][i], splice_sites,)
+
+            out_fh.write(FILE_DELIM.join(map(str, res)) + FILE_NEWLINE)
+
+
+def workflow(gff, ids=None, protein_coding=False, outdir=DEFAULT_OUTDIR, compression=None):
+    """Computes the structure table for transcripts in a GTF.
+
+    :param str gff: Gencode or Ensembl GTF
+    :param str | None ids: optional transcript IDs without version suffix, one per line
+    :param bool protein_coding: only report protein-coding transcripts
+    :param str outdir: optional output directory
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str: structure table filepath
+    """
+
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    trx_ids = None
+    if ids is not None:
+        with open(ids, "r") as ids_fh:
+            trx_ids = {e.strip() for e in ids_fh} - {""}
+
+    metrics = instrumentation.get_metrics()
+
+    with compressed_io.open_input(gff) as gff_fh, metrics.stage("parse"):
+        trx_names, arrays = load_feature_arrays(gff_fh, trx_ids, protein_coding)
+
+    with metrics.stage("match"):
+        structure = compute_structure(len(trx_names), arrays)
+
+    outfile = compressed_io.get_output_name(
+        os.path.join(outdir, replace_extension(os.path.basename(gff), DEFAULT_EXT)), compression)
+    with metrics.stage("write"):
+        write_structure(outfile, trx_names, structure, compression)
+
+    metrics.add(instrumentation.READ, len(trx_names))
+    metrics.add(instrumentation.WRITTEN, len(trx_names))
+
+    logger.info("Computed structure of %i transcripts." % len(trx_names))
+    return outfile
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["outdir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    logger.info("Started %s" % sys.argv[0])
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(gff=parsed_args["gff"], ids=parsed_args["ids"], protein_coding=parsed_args["protein_coding"],
+             outdir=outdir, compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
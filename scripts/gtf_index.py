@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Builds and queries a persistent transcript-keyed index of a GFF/GTF."""
+
+import argparse
+import compressed_io
+import logging
+import os
+import sqlite3
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+GFF_COMMENT_CHAR = "#"
+GFF_ATTR_FIELD = 8
+GFF_ATTR_TRANSCRIPT_ID = "transcript_id"
+GFF_ATTR_GENE_ID = "gene_id"
+GFF_ATTR_GENE_NAME = "gene_name"
+INDEX_EXT = "tidx"
+INDEX_VERSION = "1"
+INSERT_BATCH_SIZE = 100000
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+INDEX_SCHEMA = (
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE transcripts (trx_id TEXT PRIMARY KEY, gene_id TEXT, gene_name TEXT, first_offset INTEGER)",
+    "CREATE TABLE spans (trx_id TEXT, offset INTEGER, length INTEGER)",
+)
+
+INDEX_POST_BUILD = (
+    "CREATE INDEX spans_trx_id ON spans (trx_id)",
+    "CREATE INDEX transcripts_gene_id ON transcripts (gene_id)",
+    "CREATE INDEX transcripts_gene_name ON transcripts (gene_name)",
+)
+
+# Keys that may be used to look up transcripts in the index
+LOOKUP_KEYS = {GFF_ATTR_TRANSCRIPT_ID: "trx_id", GFF_ATTR_GENE_ID: "gene_id", GFF_ATTR_GENE_NAME: "gene_name"}
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-g", "--gff", type=str, required=True,
+                        help="Gencode/Ensembl GTF to index, plain, gzipped, or bgzipped.")
+
+    parser.add_argument("-x", "--index_file", type=str, default=None,
+                        help="Optional index path. Default the GTF path with extension .%s." % INDEX_EXT)
+
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Flag to rebuild the index even if it is current.")
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def strip_version(feature_id):
+    """Strips the minor version number from an Ensembl ID.
+
+    :param str feature_id: Ensembl ID, e.g. ENST00000335137.4
+    :return str: ID without version, e.g. ENST00000335137
+    """
+
+    return feature_id.split(".")[0]
+
+
+def get_attr(attrs, key):
+    """Gets the value of a GTF attribute without parsing the whole attribute string.
+
+    :param str attrs: GTF attribute field
+    :param str key: attribute name
+    :return str | None: attribute value, or None if the attribute is not present
+    """
+
+    key_start = attrs.find(key + " ")
+
+    # Guard against matching the tail of a longer key, e.g. havana_transcript_id
+    while key_start > 0 and attrs[key_start - 1] not in " ;":
+        key_start = attrs.find(key + " ", key_start + 1)
+
+    if key_start == -1:
+        return None
+
+    val_start = key_start + len(key) + 1
+    val_end = attrs.find(";", val_start)
+    if val_end == -1:
+        val_end = len(attrs)
+
+    return attrs[val_start:val_end].strip().strip('"')
+
+
+def get_index_path(gff, index_file=None):
+    """Gets the path of the index for a GTF.
+
+    :param str gff: GTF filename
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    if index_file is not None:
+        return index_file
+
+    return ".".join((gff, INDEX_EXT,))
+
+
+def get_source_signature(gff):
+    """Gets the values used to detect changes to the source GTF.
+
+    :param str gff: GTF filename
+    :return dict: signature with absolute path, size, and modification time
+    """
+
+    gff_stat = os.stat(gff)
+    signature = {"version": INDEX_VERSION, "source": os.path.abspath(gff),
+                 "size": str(gff_stat.st_size), "mtime_ns": str(gff_stat.st_mtime_ns)}
+    return signature
+
+
+def is_index_current(gff, index_file=None):
+    """Determines if an index exists and was built from the current GTF.
+
+    :param str gff: GTF filename
+    :param str | None index_file: optional explicit index path
+    :return bool: whether the index may be reused
+    """
+
+    index_path = get_index_path(gff, index_file)
+
+    if not os.path.exists(index_path):
+        return False
+
+    try:
+        with sqlite3.connect(index_path) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        return False
+
+    return meta == get_source_signature(gff)
+
+
+def build_index(gff, index_file=None):
+    """Builds a transcript index for a GTF in one pass.
+
+    Consecutive records of a transcript are stored as a single byte span, so a transcript in a
+    transcript-sorted GTF is recovered with one seek and one read. Offsets of a gzipped or bgzipped GTF are into the
+    uncompressed data, so lookups decompress the GTF up to the last requested span.
+
+    :param str gff: GTF filename, plain, gzipped, or bgzipped
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    if gff.endswith((".bz", ".bz2",)):
+        raise NotImplementedError("Byte-offset indexing of bzip2 GTFs is not supported: %s" % gff)
+
+    index_path = get_index_path(gff, index_file)
+    temp_path = ".".join((index_path, "tmp",))
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    logger.info("Building GTF index %s" % index_path)
+
+    conn = sqlite3.connect(temp_path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = OFF")
+    for statement in INDEX_SCHEMA:
+        conn.execute(statement)
+
+    transcripts = {}
+    spans = []
+    span_trx, span_start, span_len = None, 0, 0
+
+    # Offsets are into the uncompressed GTF
+    with compressed_io.open_input(gff, "rb") as gff_fh:
+
+        offset = 0
+        for line in gff_fh:
+
+            line_offset = offset
+            offset += len(line)
+
+            if line.startswith(GFF_COMMENT_CHAR.encode()):
+                continue
+
+            fields = line.decode().rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if len(fields) <= GFF_ATTR_FIELD:
+                continue
+
+            attrs = fields[GFF_ATTR_FIELD]
+            trx_id = get_attr(attrs, GFF_ATTR_TRANSCRIPT_ID)
+            if trx_id is None:
+                continue
+
+            trx_id = strip_version(trx_id)
+
+            if trx_id not in transcripts:
+                gene_id = get_attr(attrs, GFF_ATTR_GENE_ID)
+                transcripts[trx_id] = (trx_id, strip_version(gene_id) if gene_id is not None else None,
+                                       get_attr(attrs, GFF_ATTR_GENE_NAME), line_offset)
+
+            # Extend the current span if the record directly follows the previous one of the same transcript
+            if trx_id == span_trx and span_start + span_len == line_offset:
+                span_len += len(line)
+                continue
+
+            if span_trx is not None:
+                spans.append((span_trx, span_start, span_len,))
+
+            span_trx, span_start, span_len = trx_id, line_offset, len(line)
+
+            if len(spans) >= INSERT_BATCH_SIZE:
+                conn.executemany("INSERT INTO spans VALUES (?, ?, ?)", spans)
+                spans = []
+
+    if span_trx is not None:
+        spans.append((span_trx, span_start, span_len,))
+
+    conn.executemany("INSERT INTO spans VALUES (?, ?, ?)", spans)
+    conn.executemany("INSERT INTO transcripts VALUES (?, ?, ?, ?)", transcripts.values())
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", get_source_signature(gff).items())
+
+    for statement in INDEX_POST_BUILD:
+        conn.execute(statement)
+
+    conn.commit()
+    conn.close()
+
+    # Only replace a prior index once the new one is complete
+    os.replace(temp_path, index_path)
+
+    logger.info("Indexed %i transcripts." % len(transcripts))
+    return index_path
+
+
+def load_index(gff, index_file=None):
+    """Opens the index for a GTF, building it first if it is missing or stale.
+
+    :param str gff: GTF filename
+    :param str | None index_file: optional explicit index path
+    :return sqlite3.Connection: open index connection
+    """
+
+    if not is_index_current(gff, index_file):
+        build_index(gff, index_file)
+
+    conn = sqlite3.connect(get_index_path(gff, index_file))
+    return conn
+
+
+def _select_in(conn, query, values):
+    """Runs a query with an IN clause over an arbitrary number of values.
+
+    :param sqlite3.Connection conn: open index connection
+    :param str query: query with a single {} placeholder for the IN clause parameters
+    :param iterable values: values to bind
+    :return list: result rows
+    """
+
+    values = list(values)
+    res = []
+
+    # Stay under SQLite's host parameter limit
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        res.extend(conn.execute(query.format(",".join("?" * len(chunk))), chunk).fetchall())
+
+    return res
+
+
+def get_trx_ids(conn, ids, key=GFF_ATTR_TRANSCRIPT_ID):
+    """Gets the version-stripped transcript IDs matching transcript IDs, gene IDs, or gene names.
+
+    :param sqlite3.Connection conn: open index connection
+    :param iterable ids: IDs or gene names to look up; Ensembl IDs should be without version
+    :param str key: one of transcript_id, gene_id, or gene_name
+    :return set: transcript IDs present in the index
+    """
+
+    if key not in LOOKUP_KEYS:
+        raise NotImplementedError("Lookup key must be one of %s." % ", ".join(LOOKUP_KEYS))
+
+    rows = _select_in(conn, "SELECT trx_id FROM transcripts WHERE %s IN ({})" % LOOKUP_KEYS[key], ids)
+    trx_ids = {row[0] for row in rows}
+    return trx_ids
+
+
+def get_gene_names(conn, trx_ids):
+    """Gets the gene name of the first record of each transcript, in GTF order.
+
+    :param sqlite3.Connection conn: open index connection
+    :param iterable trx_ids: transcript IDs without version
+    :return list: (transcript ID, gene name or None) tuples
+    """
+
+    rows = _select_in(conn, "SELECT trx_id, gene_name, first_offset FROM transcripts WHERE trx_id IN ({})", trx_ids)
+    res = [(trx_id, gene_name,) for trx_id, gene_name, _ in sorted(rows, key=lambda e: e[2])]
+    return res
+
+
+def get_records(conn, gff, trx_ids):
+    """Gets the GTF lines for transcripts via random access, in GTF order.
+
+    :param sqlite3.Connection conn: open index connection
+    :param str gff: GTF filename the index was built from
+    :param iterable trx_ids: transcript IDs without version
+    :return generator: GTF lines, including newlines
+    """
+
+    spans = sorted(_select_in(conn, "SELECT offset, length FROM spans WHERE trx_id IN ({})", trx_ids))
+
+    # Spans are sorted, so a compressed GTF is only ever seeked forward and decompressed at most once
+    with compressed_io.open_input(gff, "rb", threaded=False) as gff_fh:
+        for offset, length in spans:
+            gff_fh.seek(offset)
+            for line in gff_fh.read(length).decode().splitlines(True):
+                yield line
+
+
+def workflow(gff, index_file=None, force=False):
+    """Builds the GTF index if it is missing, stale, or forced.
+
+    :param str gff: GTF filename
+    :param str | None index_file: optional explicit index path
+    :param bool force: rebuild even if the index is current
+    :return str: index filepath
+    """
+
+    if force or not is_index_current(gff, index_file):
+        return build_index(gff, index_file)
+
+    logger.info("Index for %s is current." % gff)
+    return get_index_path(gff, index_file)
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    logger.setLevel(logging.INFO)
+    logger.info("Started %s" % sys.argv[0])
+
+    workflow(gff=parsed_args["gff"], index_file=parsed_args["index_file"], force=parsed_args["force"])
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""Record counts, per-stage timing, and peak memory for script workflows.
+
+A script's main starts instrumentation from its --metrics and --progress arguments, and its workflow reports into the
+active metrics from get_metrics:
+
+    counts      records read, written, filtered, or any other named count
+    stages      wall and CPU time per named stage (e.g. parse, match, write); time is charged to the innermost active
+                stage only, so a stage that pulls from a timed iterator does not also count the iterator's time
+    progress    optional periodic log lines of counts and throughput
+
+When instrumentation is not started, get_metrics returns a metrics object whose methods do nothing and whose timed
+iterators are the iterables themselves, so instrumented workflows run at full speed.
+"""
+
+import collections
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+READ = "read"
+WRITTEN = "written"
+FILTERED = "filtered"
+UNSTAGED = "other"
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+class _Stage(object):
+    """Context manager charging time to a stage."""
+
+    def __init__(self, metrics, name):
+        """Constructor for _Stage.
+
+        :param Metrics metrics: metrics to charge
+        :param str name: stage name
+        """
+
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics._push(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics._pop()
+        return False
+
+
+class _NullStage(object):
+    """Context manager that does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Metrics(object):
+    """Counts and stage times of one workflow run."""
+
+    def __init__(self, name, progress_interval=None, progress_logger=None):
+        """Constructor for Metrics.
+
+        :param str name: run name, usually the script module name
+        :param float | None progress_interval: seconds between progress lines; None for no progress lines
+        :param logging.Logger | None progress_logger: logger for progress lines; default this module's logger
+        """
+
+        self.name = name
+        self.progress_interval = progress_interval
+        self.progress_logger = progress_logger or logger
+        self.counts = collections.Counter()
+        self.stage_wall = collections.Counter()
+        self.stage_cpu = collections.Counter()
+        self.stage_calls = collections.Counter()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.next_progress = self.start_wall + progress_interval if progress_interval else None
+
+        # Stack of active stages; the bottom entry collects time outside any stage
+        self._stack = [UNSTAGED]
+        self._mark_wall = self.start_wall
+        self._mark_cpu = self.start_cpu
+
+    def _charge(self):
+        """Charges time since the last mark to the innermost active stage."""
+
+        now_wall, now_cpu = time.perf_counter(), time.process_time()
+        stage = self._stack[-1]
+        self.stage_wall[stage] += now_wall - self._mark_wall
+        self.stage_cpu[stage] += now_cpu - self._mark_cpu
+        self._mark_wall, self._mark_cpu = now_wall, now_cpu
+
+    def _push(self, name):
+        self._charge()
+        self._stack.append(name)
+        self.stage_calls[name] += 1
+
+    def _pop(self):
+        self._charge()
+        self._stack.pop()
+
+    def stage(self, name):
+        """Times a block as a stage.
+
+        :param str name: stage name
+        :return _Stage: context manager
+        """
+
+        return _Stage(self, name)
+
+    def timed_iter(self, name, iterable):
+        """Times each step of an iterator as a stage.
+
+        :param str name: stage name
+        :param iterable iterable: iterable to time
+        :return generator: the iterable's items
+        """
+
+        iterator = iter(iterable)
+        while True:
+            self._push(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._pop()
+            yield item
+
+    def counted(self, key, iterable):
+        """Counts the items of an iterator as they are consumed.
+
+        :param str key: count name
+        :param iterable iterable: iterable to count
+        :return generator: the iterable's items
+        """
+
+        for item in iterable:
+            self.add(key)
+            yield item
+
+    def add(self, key, n=1):
+        """Adds to a count, logging progress when the interval has passed.
+
+        :param str key: count name, e.g. read, written, or filtered
+        :param int n: amount to add
+        """
+
+        self.counts[key] += n
+
+        if self.next_progress is not None and time.perf_counter() >= self.next_progress:
+            self.log_progress()
+            self.next_progress = time.perf_counter() + self.progress_interval
+
+    def log_progress(self):
+        """Logs counts and throughput so far."""
+
+        elapsed = max(time.perf_counter() - self.start_wall, 1e-9)
+        counts = ", ".join("%i %s" % (v, k) for k, v in sorted(self.counts.items()))
+        self.progress_logger.warning("%s progress after %.0f s: %s; %.0f records read/s; in %s." % (
+            self.name, elapsed, counts or "no records", self.counts[READ] / elapsed, self._stack[-1]))
+
+    def summary(self):
+        """Summarizes the run so far.
+
+        :return dict: counts, total and per-stage wall and CPU seconds, records per second, and peak memory
+        """
+
+        self._charge()
+        wall = max(time.perf_counter() - self.start_wall, 1e-9)
+
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        rss_scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+
+        res = {
+            "name": self.name,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(time.process_time() - self.start_cpu, 4),
+            "children_cpu_s": round(child_usage.ru_utime + child_usage.ru_stime, 4),
+            "peak_rss_mb": round(self_usage.ru_maxrss / rss_scale, 2),
+            "children_peak_rss_mb": round(child_usage.ru_maxrss / rss_scale, 2),
+            "counts": dict(self.counts),
+            "records_per_s": round(self.counts[READ] / wall, 1),
+            "stages": {name: {"wall_s": round(self.stage_wall[name], 4), "cpu_s": round(self.stage_cpu[name], 4),
+                              "calls": self.stage_calls[name], "wall_fraction": round(self.stage_wall[name] / wall, 4)}
+                       for name in self.stage_wall},
+        }
+
+        return res
+
+
+class _NullMetrics(object):
+    """Metrics that record nothing."""
+
+    name = None
+    counts = collections.Counter()
+    _null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+    def counted(self, key, iterable):
+        return iterable
+
+    def add(self, key, n=1):
+        pass
+
+    def log_progress(self):
+        pass
+
+    def summary(self):
+        return {}
+
+
+NULL_METRICS = _NullMetrics()
+
+# Metrics of the running workflow, set by start
+_active = NULL_METRICS
+_outfile = None
+
+
+def add_arguments(parser):
+    """Adds the instrumentation arguments to a script's parser.
+
+    :param argparse.ArgumentParser parser: parser to add to
+    """
+
+    parser.add_argument("--metrics", type=str, default=None,
+                        help='Optional JSON file for record counts, per-stage timing, throughput, and peak memory.')
+
+    parser.add_argument("--progress", type=float, default=None,
+                        help='Optional seconds between progress log lines.')
+
+
+def start(name, outfile=None, progress_interval=None, progress_logger=None):
+    """Starts instrumentation if a summary file or progress lines were requested.
+
+    :param str name: run name, usually the script module name
+    :param str | None outfile: JSON summary filepath
+    :param float | None progress_interval: seconds between progress lines
+    :param logging.Logger | None progress_logger: logger for progress and summary lines
+    :return Metrics | _NullMetrics: active metrics
+    """
+
+    global _active, _outfile
+
+    if outfile is None and not progress_interval:
+        _active, _outfile = NULL_METRICS, None
+        return _active
+
+    # Scripts run directly are named by their file rather than __main__
+    if name == "__main__":
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+    _active = Metrics(name, progress_interval, progress_logger)
+    _outfile = outfile
+    return _active
+
+
+def get_metrics():
+    """Gets the active metrics.
+
+    :return Metrics | _NullMetrics: metrics started by start, or metrics that record nothing
+    """
+
+    return _active
+
+
+def finish():
+    """Stops instrumentation, writing the JSON summary if one was requested.
+
+    :return dict: summary, empty if instrumentation was not started
+    """
+
+    global _active, _outfile
+
+    metrics, outfile = _active, _outfile
+    _active, _outfile = NULL_METRICS, None
+
+    summary = metrics.summary()
+    if not summary:
+        return summary
+
+    if outfile is not None:
+        with open(outfile, "w") as out_fh:
+            json.dump(summary, out_fh, indent=2)
+
+    if metrics.progress_interval:
+        metrics.log_progress()
+
+    return summary
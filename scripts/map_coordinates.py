@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""Maps positions between genome and transcript or CDS coordinates using GTF exon models.
+
+Exons are held as arrays ordered by transcript, then 5' to 3' as in the region BED scripts, with the transcript
+offset of each exon. Genome to transcript queries binary search a genome-wide index of exons sorted by start, and
+transcript to genome queries binary search the cumulative exon offsets, so millions of positions are converted per
+batch without per-position loops. Genome positions are 1-based as in the GTF; transcript and CDS positions are
+1-based in files and 0-based offsets in the arrays.
+"""
+
+import argparse
+import compressed_io
+import get_region_bed
+import get_transcript_structure
+import gtf_index
+import instrumentation
+import logging
+import numpy as np
+import os
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+FILE_COMMENT_CHAR = "#"
+GFF_COMMENT_CHAR = "#"
+GFF_CONTIG_FIELD = 0
+GFF_FEATURE_FIELD = 2
+GFF_START_FIELD = 3
+GFF_END_FIELD = 4
+GFF_STRAND_FIELD = 6
+GFF_ATTR_FIELD = 8
+GFF_NEG_STRAND = "-"
+GFF_POS_STRAND = "+"
+EXON_FEATURE = "exon"
+CDS_FEATURE = "CDS"
+MODEL_FEATURES = {EXON_FEATURE: get_transcript_structure.EXON_CODE, CDS_FEATURE: get_transcript_structure.CDS_CODE}
+NA_STR = "NA"
+DEFAULT_OUTDIR = "."
+DEFAULT_CHUNK_SIZE = 1000000
+TO_TRANSCRIPT = "transcript"
+TO_GENOME = "genome"
+DIRECTIONS = (TO_TRANSCRIPT, TO_GENOME,)
+TRX_OUTPUT_HEADER = ("Contig", "Position", "Transcript_ID", "Transcript_position", "CDS_position", "Region",)
+GENOME_OUTPUT_HEADER = ("Transcript_ID", "Position", "Contig", "Genome_position", "Strand",)
+TRX_OUTPUT_EXT = "trx_coords.txt"
+GENOME_OUTPUT_EXT = "genome_coords.txt"
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Value of positions that fall outside every exon, transcript, or CDS
+UNMAPPED = -1
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "map_coordinates_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-g", "--gff", type=str, required=True, help="Gencode or Ensembl GTF.")
+
+    parser.add_argument("-p", "--positions", type=str, required=True,
+                        help='Tab-delimited positions. For -d %s, contig and 1-based genome position, e.g. a VCF; '
+                             'for -d %s, transcript ID and 1-based transcript position. Lines starting with # are '
+                             'skipped.' % (TO_TRANSCRIPT, TO_GENOME,))
+
+    parser.add_argument("-d", "--direction", type=str, default=TO_TRANSCRIPT, choices=DIRECTIONS,
+                        help='Coordinate system to map to. Default %s.' % TO_TRANSCRIPT)
+
+    parser.add_argument("-c", "--cds", action="store_true",
+                        help='Flag that -d %s input positions are CDS rather than transcript positions.' % TO_GENOME)
+
+    parser.add_argument("-i", "--ids", type=str, default=None,
+                        help="Optional text file of transcript IDs without version suffix, one per line. "
+                             "Default all transcripts.")
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. The GTF may be plain, gzipped, or '
+                             'bgzipped regardless.')
+
+    parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_OUTDIR,
+                        help='Output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def load_model_features(gff_lines, trx_ids=None):
+    """Loads exon and CDS intervals into arrays.
+
+    :param iterable gff_lines: GTF lines
+    :param set | None trx_ids: transcript IDs without version; None to load all transcripts
+    :return tuple: (list of transcript IDs, list of contigs, dict of arrays trx_idx, contig_idx, start, end, feature,
+    neg_strand)
+    """
+
+    trx_names = {}
+    contig_names = {}
+    trx_idx, contig_idx, starts, ends, features, neg_strand = [], [], [], [], [], []
+
+    for line in gff_lines:
+
+        if line.startswith(GFF_COMMENT_CHAR):
+            continue
+
+        fields = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+        if len(fields) <= GFF_ATTR_FIELD or fields[GFF_FEATURE_FIELD] not in MODEL_FEATURES:
+            continue
+
+        trx_id = gtf_index.get_attr(fields[GFF_ATTR_FIELD], gtf_index.GFF_ATTR_TRANSCRIPT_ID)
+        if trx_id is None:
+            continue
+
+        trx_id = gtf_index.strip_version(trx_id)
+        if trx_ids is not None and trx_id not in trx_ids:
+            continue
+
+        trx_idx.append(trx_names.setdefault(trx_id, len(trx_names)))
+        contig_idx.append(contig_names.setdefault(fields[GFF_CONTIG_FIELD], len(contig_names)))
+        starts.append(int(fields[GFF_START_FIELD]))
+        ends.append(int(fields[GFF_END_FIELD]))
+        features.append(MODEL_FEATURES[fields[GFF_FEATURE_FIELD]])
+        neg_strand.append(fields[GFF_STRAND_FIELD] == GFF_NEG_STRAND)
+
+    arrays = {"trx_idx": np.array(trx_idx, dtype=np.int64), "contig_idx": np.array(contig_idx, dtype=np.int64),
+              "start": np.array(starts, dtype=np.int64), "end": np.array(ends, dtype=np.int64),
+              "feature": np.array(features, dtype=np.int8), "neg_strand": np.array(neg_strand, dtype=bool)}
+
+    return list(trx_names), list(contig_names), arrays
+
+
+def build_model(trx_names, contig_names, arrays):
+    """Builds exon models and the genome exon index.
+
+    :param list trx_names: transcript IDs, indexed by transcript index
+    :param list contig_names: contigs, indexed by contig index
+    :param dict arrays: feature arrays from load_model_features
+    :return dict: transcript, exon, and genome index arrays
+    """
+
+    n_trx = len(trx_names)
+    exons = get_transcript_structure.sort_five_to_three(arrays, arrays["feature"] == get_transcript_structure.EXON_CODE)
+    exon_lens = exons["end"] - exons["start"] + 1
+
+    # Inclusive cumulative lengths less each exon's own length give the 0-based transcript offset of its 5' end
+    exon_trx_start = get_transcript_structure.segmented_cumsum(exon_lens, exons["trx_idx"]) - exon_lens
+
+    exon_first = np.searchsorted(exons["trx_idx"], np.arange(n_trx + 1))
+    has_exons = exon_first[1:] > exon_first[:-1]
+    if not has_exons.all():
+        logger.warning("%i transcripts have no exons and will not be mapped." % np.count_nonzero(~has_exons))
+
+    first_exon = np.minimum(exon_first[:-1], max(len(exon_lens) - 1, 0))
+    trx_len = np.bincount(exons["trx_idx"], weights=exon_lens, minlength=n_trx).astype(np.int64)
+    trx_base = np.r_[0, np.cumsum(trx_len)[:-1]] if n_trx else np.zeros(0, dtype=np.int64)
+
+    model = {
+        "trx_names": trx_names, "trx_lookup": {e: i for i, e in enumerate(trx_names)},
+        "contig_names": contig_names, "contig_lookup": {e: i for i, e in enumerate(contig_names)},
+        "trx_contig": exons["contig_idx"][first_exon] if len(exon_lens) else np.zeros(n_trx, dtype=np.int64),
+        "trx_neg": exons["neg_strand"][first_exon] if len(exon_lens) else np.zeros(n_trx, dtype=bool),
+        "trx_len": trx_len, "exon_trx_idx": exons["trx_idx"], "exon_start": exons["start"], "exon_end": exons["end"],
+        "exon_trx_start": exon_trx_start, "exon_trx_key": trx_base[exons["trx_idx"]] + exon_trx_start,
+        "trx_base": trx_base,
+    }
+
+    add_oriented_keys(model)
+    add_genome_index(model)
+    add_cds_bounds(model, arrays)
+    return model
+
+
+def add_oriented_keys(model):
+    """Adds sorted per-transcript keys of exon 5' ends in transcript orientation.
+
+    Negating coordinates on the minus strand makes 5' to 3' ascending on both strands, and offsetting by transcript
+    index makes the keys of all transcripts one sorted array.
+
+    :param dict model: model from build_model, updated in place
+    """
+
+    max_coord = int(model["exon_end"].max()) + 1 if len(model["exon_end"]) else 1
+    neg = model["trx_neg"][model["exon_trx_idx"]]
+
+    model["oriented_shift"] = max_coord
+    model["oriented_span"] = 2 * max_coord + 1
+    oriented_start = np.where(neg, -model["exon_end"], model["exon_start"])
+    model["exon_oriented_key"] = model["exon_trx_idx"] * model["oriented_span"] + oriented_start + max_coord
+
+
+def add_genome_index(model):
+    """Adds the genome exon index, with exons of all contigs sorted on one axis.
+
+    Each contig is offset past the last exon end of the contig before it. Exons are sorted by start with a running
+    maximum of ends, so the exons overlapping a position lie between the first running maximum reaching it and the
+    last start not past it.
+
+    :param dict model: model from build_model, updated in place
+    """
+
+    n_contigs = len(model["contig_names"])
+    contig_idx = model["trx_contig"][model["exon_trx_idx"]]
+
+    contig_max_end = np.zeros(n_contigs, dtype=np.int64)
+    np.maximum.at(contig_max_end, contig_idx, model["exon_end"])
+    contig_offset = np.r_[0, np.cumsum(contig_max_end + 1)[:-1]] if n_contigs else contig_max_end
+
+    genome_start = contig_offset[contig_idx] + model["exon_start"]
+    order = np.argsort(genome_start, kind="stable")
+
+    model["contig_max_end"] = contig_max_end
+    model["contig_offset"] = contig_offset
+    model["genome_order"] = order
+    model["genome_start"] = genome_start[order]
+    model["genome_end"] = (contig_offset[contig_idx] + model["exon_end"])[order]
+    model["genome_max_end"] = np.maximum.accumulate(model["genome_end"]) if len(order) else model["genome_end"]
+
+
+def add_cds_bounds(model, arrays):
+    """Adds the 0-based transcript offset and length of each CDS.
+
+    :param dict model: model from build_model, updated in place
+    :param dict arrays: feature arrays from load_model_features
+    """
+
+    n_trx = len(model["trx_names"])
+    cds = get_transcript_structure.sort_five_to_three(arrays, arrays["feature"] == get_transcript_structure.CDS_CODE)
+
+    model["cds_len"] = np.bincount(cds["trx_idx"], weights=cds["end"] - cds["start"] + 1,
+                                   minlength=n_trx).astype(np.int64)
+    model["cds_start"] = np.full(n_trx, UNMAPPED, dtype=np.int64)
+
+    # The first CDS of each transcript holds its 5' end
+    cds_trx, first_cds = np.unique(cds["trx_idx"], return_index=True)
+    cds_five = np.where(cds["neg_strand"][first_cds], cds["end"][first_cds], cds["start"][first_cds])
+    model["cds_start"][cds_trx] = locate_in_transcripts(model, cds_trx, cds_five)
+
+
+def locate_in_transcripts(model, trx_idx, positions):
+    """Maps genome positions to offsets in given transcripts.
+
+    :param dict model: model from build_model
+    :param numpy.ndarray trx_idx: transcript index per position
+    :param numpy.ndarray positions: 1-based genome positions
+    :return numpy.ndarray: 0-based transcript offsets, UNMAPPED outside the transcript's exons
+    """
+
+    trx_idx = np.asarray(trx_idx, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    neg = model["trx_neg"][trx_idx]
+
+    shift = model["oriented_shift"]
+    oriented = np.clip(np.where(neg, -positions, positions), -shift, shift)
+    keys = trx_idx * model["oriented_span"] + oriented + shift
+
+    exon = np.searchsorted(model["exon_oriented_key"], keys, side="right") - 1
+    exon_safe = np.maximum(exon, 0)
+
+    start, end = model["exon_start"][exon_safe], model["exon_end"][exon_safe]
+    is_hit = (exon >= 0) & (model["exon_trx_idx"][exon_safe] == trx_idx) & (positions >= start) & (positions <= end)
+
+    offsets = model["exon_trx_start"][exon_safe] + np.where(neg, end - positions, positions - start)
+    res = np.where(is_hit, offsets, UNMAPPED)
+    return res
+
+
+def genome_to_transcript(model, contig_idx, positions):
+    """Maps genome positions to every transcript whose exons contain them.
+
+    :param dict model: model from build_model
+    :param numpy.ndarray contig_idx: contig index per position, negative for contigs absent from the model
+    :param numpy.ndarray positions: 1-based genome positions
+    :return tuple: arrays of query index, transcript index, and 0-based transcript offset, one entry per hit
+    """
+
+    contig_idx = np.asarray(contig_idx, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+
+    contig_safe = np.maximum(contig_idx, 0)
+    is_valid = (contig_idx >= 0) & (positions >= 1) & (positions <= model["contig_max_end"][contig_safe])
+    genome_pos = np.where(is_valid, model["contig_offset"][contig_safe] + positions, 0)
+
+    lo = np.searchsorted(model["genome_max_end"], genome_pos, side="left")
+    hi = np.searchsorted(model["genome_start"], genome_pos, side="right")
+    n_candidates = np.maximum(hi - lo, 0)
+
+    # Expand each query's candidate range, then keep exons that end at or past the position
+    query = np.repeat(np.arange(len(positions)), n_candidates)
+    candidate = lo[query] + np.arange(len(query)) - np.repeat(np.cumsum(n_candidates) - n_candidates, n_candidates)
+    is_hit = model["genome_end"][candidate] >= genome_pos[query]
+    query, candidate = query[is_hit], candidate[is_hit]
+
+    exon = model["genome_order"][candidate]
+    trx_idx = model["exon_trx_idx"][exon]
+    neg = model["trx_neg"][trx_idx]
+    pos = positions[query]
+
+    offsets = model["exon_trx_start"][exon] + np.where(neg, model["exon_end"][exon] - pos,
+                                                       pos - model["exon_start"][exon])
+    return query, trx_idx, offsets
+
+
+def transcript_to_genome(model, trx_idx, offsets, cds=False):
+    """Maps transcript or CDS offsets to genome positions.
+
+    :param dict model: model from build_model
+    :param numpy.ndarray trx_idx: transcript index per offset, negative for transcripts absent from the model
+    :param numpy.ndarray offsets: 0-based transcript offsets, or CDS offsets if cds
+    :param bool cds: offsets are relative to the CDS start
+    :return numpy.ndarray: 1-based genome positions, UNMAPPED outside the transcript or CDS
+    """
+
+    trx_idx = np.asarray(trx_idx, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    trx_safe = np.maximum(trx_idx, 0)
+    is_valid = (trx_idx >= 0) & (offsets >= 0)
+
+    if cds:
+        is_valid &= (model["cds_start"][trx_safe] != UNMAPPED) & (offsets < model["cds_len"][trx_safe])
+        offsets = offsets + model["cds_start"][trx_safe]
+
+    is_valid &= offsets < model["trx_len"][trx_safe]
+
+    keys = model["trx_base"][trx_safe] + offsets
+    exon = np.maximum(np.searchsorted(model["exon_trx_key"], keys, side="right") - 1, 0)
+    exon_offset = offsets - model["exon_trx_start"][exon]
+
+    positions = np.where(model["trx_neg"][trx_safe], model["exon_end"][exon] - exon_offset,
+                         model["exon_start"][exon] + exon_offset)
+
+    res = np.where(is_valid, positions, UNMAPPED)
+    return res
+
+
+def get_cds_offsets(model, trx_idx, offsets):
+    """Converts transcript offsets to CDS offsets.
+
+    :param dict model: model from build_model
+    :param numpy.ndarray trx_idx: transcript index per offset
+    :param numpy.ndarray offsets: 0-based transcript offsets
+    :return tuple: arrays of 0-based CDS offsets, UNMAPPED outside the CDS, and region codes 0 UTR5, 1 CDS, 2 UTR3
+    """
+
+    cds_start = model["cds_start"][trx_idx]
+    cds_offsets = offsets - cds_start
+    is_coding = cds_start != UNMAPPED
+
+    in_cds = is_coding & (cds_offsets >= 0) & (cds_offsets < model["cds_len"][trx_idx])
+    regions = np.where(~is_coding, -1, np.where(cds_offsets < 0, 0, np.where(in_cds, 1, 2)))
+
+    res = np.where(in_cds, cds_offsets, UNMAPPED)
+    return res, regions
+
+
+def load_model(gff, ids=None):
+    """Loads exon models from a GTF.
+
+    :param str gff: Gencode or Ensembl GTF
+    :param str | None ids: optional transcript IDs without version suffix, one per line
+    :return dict: model from build_model
+    """
+
+    trx_ids = None
+    if ids is not None:
+        with open(ids, "r") as ids_fh:
+            trx_ids = {e.strip() for e in ids_fh} - {""}
+
+    with compressed_io.open_input(gff) as gff_fh:
+        trx_names, contig_names, arrays = load_model_features(gff_fh, trx_ids)
+
+    model = build_model(trx_names, contig_names, arrays)
+    return model
+
+
+def iter_position_chunks(positions, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reads the first two fields of a tab-delimited position file in chunks.
+
+    :param str positions: tab-delimited positions
+    :param int chunk_size: positions per chunk
+    :return generator: (list of names, numpy.ndarray of positions) tuples
+    """
+
+    with compressed_io.open_input(positions) as positions_fh:
+
+        names, coords = [], []
+        for line in positions_fh:
+
+            if line.startswith(FILE_COMMENT_CHAR) or not line.strip():
+                continue
+
+            fields = line.rstrip(FILE_NEWLINE).split(FILE_DELIM, 2)
+            names.append(fields[0])
+            coords.append(int(fields[1]))
+
+            if len(names) == chunk_size:
+                yield names, np.array(coords, dtype=np.int64)
+                names, coords = [], []
+
+        if names:
+            yield names, np.array(coords, dtype=np.int64)
+
+
+def write_transcript_coords(out_fh, model, names, positions):
+    """Maps a chunk of genome positions to transcripts and writes one line per hit.
+
+    :param file out_fh: open output file
+    :param dict model: model from build_model
+    :param list names: contig per position
+    :param numpy.ndarray positions: 1-based genome positions
+    :return int: number of positions with no hit
+    """
+
+    contig_lookup = model["contig_lookup"]
+    contig_idx = np.array([contig_lookup.get(e, -1) for e in names], dtype=np.int64)
+
+    query, trx_idx, offsets = genome_to_transcript(model, contig_idx, positions)
+    cds_offsets, regions = get_cds_offsets(model, trx_idx, offsets)
+
+    region_names = (get_region_bed.UTR5_NAME, get_region_bed.CDS_NAME, get_region_bed.UTR3_NAME, NA_STR,)
+    trx_names = model["trx_names"]
+
+    out_fh.write("".join(
+        FILE_DELIM.join((names[q], str(positions[q]), trx_names[t], str(o + 1), str(c + 1) if c >= 0 else NA_STR,
+                         region_names[r])) + FILE_NEWLINE
+        for q, t, o, c, r in zip(query.tolist(), trx_idx.tolist(), offsets.tolist(), cds_offsets.tolist(),
+                                 regions.tolist())))
+
+    n_unmapped = len(positions) - len(np.unique(query))
+    return n_unmapped
+
+
+def write_genome_coords(out_fh, model, names, positions, cds=False):
+    """Maps a chunk of transcript or CDS positions to the genome and writes one line per position.
+
+    :param file out_fh: open output file
+    :param dict model: model from build_model
+    :param list names: transcript ID per position, with or without version
+    :param numpy.ndarray positions: 1-based transcript positions, or CDS positions if cds
+    :param bool cds: positions are CDS positions
+    :return int: number of positions that could not be mapped
+    """
+
+    trx_lookup = model["trx_lookup"]
+    trx_idx = np.array([trx_lookup.get(gtf_index.strip_version(e), -1) for e in names], dtype=np.int64)
+
+    genome_pos = transcript_to_genome(model, trx_idx, positions - 1, cds)
+    trx_safe = np.maximum(trx_idx, 0)
+    contigs = np.array(model["contig_names"] + [NA_STR], dtype=object)[
+        np.where(trx_idx >= 0, model["trx_contig"][trx_safe], -1)]
+    strands = np.where(model["trx_neg"][trx_safe], GFF_NEG_STRAND, GFF_POS_STRAND)
+
+    out_fh.write("".join(
+        FILE_DELIM.join((n, str(p), c, str(g) if g != UNMAPPED else NA_STR, s if g != UNMAPPED else NA_STR)) +
+        FILE_NEWLINE
+        for n, p, c, g, s in zip(names, positions.tolist(), contigs, genome_pos.tolist(), strands)))
+
+    n_unmapped = int(np.count_nonzero(genome_pos == UNMAPPED))
+    return n_unmapped
+
+
+def workflow(gff, positions, direction=TO_TRANSCRIPT, cds=False, ids=None, outdir=DEFAULT_OUTDIR,
+             chunk_size=DEFAULT_CHUNK_SIZE, compression=None):
+    """Maps a file of positions between genome and transcript coordinates.
+
+    :param str gff: Gencode or Ensembl GTF
+    :param str positions: tab-delimited positions
+    :param str direction: coordinate system to map to, transcript or genome
+    :param bool cds: genome-bound input positions are CDS positions
+    :param str | None ids: optional transcript IDs without version suffix, one per line
+    :param str outdir: optional output directory
+    :param int chunk_size: positions per chunk
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :return str: output filepath
+    """
+
+    if direction not in DIRECTIONS:
+        raise NotImplementedError("Direction must be one of %s." % ", ".join(DIRECTIONS))
+
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    metrics = instrumentation.get_metrics()
+
+    with metrics.stage("index"):
+        model = load_model(gff, ids)
+
+    to_transcript = direction == TO_TRANSCRIPT
+    ext = TRX_OUTPUT_EXT if to_transcript else GENOME_OUTPUT_EXT
+    outfile = compressed_io.get_output_name(
+        os.path.join(outdir, get_transcript_structure.replace_extension(os.path.basename(positions), ext)), compression)
+
+    n_positions, n_unmapped = 0, 0
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+
+        out_fh.write(FILE_DELIM.join(TRX_OUTPUT_HEADER if to_transcript else GENOME_OUTPUT_HEADER) + FILE_NEWLINE)
+
+        for names, coords in metrics.timed_iter("parse", iter_position_chunks(positions, chunk_size)):
+
+            with metrics.stage("match"):
+                if to_transcript:
+                    chunk_unmapped = write_transcript_coords(out_fh, model, names, coords)
+                else:
+                    chunk_unmapped = write_genome_coords(out_fh, model, names, coords, cds)
+
+            n_unmapped += chunk_unmapped
+            n_positions += len(names)
+            metrics.add(instrumentation.READ, len(names))
+            metrics.add(instrumentation.WRITTEN, len(names) - chunk_unmapped)
+            metrics.add(instrumentation.FILTERED, chunk_unmapped)
+
+    logger.warning("Mapped %i of %i positions using %i transcripts." % (
+        n_positions - n_unmapped, n_positions, len(model["trx_names"])))
+
+    return outfile
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["outdir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    logger.info("Started %s" % sys.argv[0])
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(gff=parsed_args["gff"], positions=parsed_args["positions"], direction=parsed_args["direction"],
+             cds=parsed_args["cds"], ids=parsed_args["ids"], outdir=outdir, compression=parsed_args["compression"])
+
+    instrumentation.finish()
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
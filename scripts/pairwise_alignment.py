@@ -0,0 +1,730 @@
+#!/usr/bin/env python3
+"""Pairwise alignment of a query against one or many targets: LCS, Smith-Waterman, and Needleman-Wunsch.
+
+Scoring follows lcs, smith_waterman_pairwise, and needleman_wunsch_pairwise in dynamic_programming_functions.r and
+dp.Rmd. A gap of length k scores gap_open + k * gap_extend, so the first gap base scores gap_open + gap_extend and
+each further base gap_extend, as in recurse_gap; the global defaults of gap_open 0 and gap_extend -2 give
+needleman_wunsch_pairwise's linear gap penalty. LCS is a global alignment scoring 1 per match and 0 otherwise.
+
+The DP matrix is filled by anti-diagonals, whose cells are independent, so each diagonal is one set of NumPy operations
+over the query positions, and over many targets at once in the batch API. Only the last two diagonals are kept, so
+scores take linear memory. Alignments are recovered in linear memory with Hirschberg's divide and conquer, in the
+affine gap form of Myers and Miller; local alignments are first bounded by a forward and an anchored reverse pass.
+
+Ties are broken toward the first best cell in column-major order, as which(dpt == max(dpt), arr.ind=TRUE) does.
+Coordinates are 0-based and half-open. Reference cases derived from the R functions are in CASES_FILE and are checked
+with -c.
+"""
+
+import argparse
+import compressed_io
+import get_transcript_structure
+import instrumentation
+import logging
+import numpy as np
+import os
+import pysam
+import sys
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+NA_STR = "NA"
+GAP_CHAR = "-"
+DEFAULT_OUTDIR = "."
+DEFAULT_EXT = "alignments.txt"
+DEFAULT_BATCH_SIZE = 256
+MATRIX_TRACEBACK_CELLS = 16384
+LCS_MODE = "lcs"
+LOCAL_MODE = "local"
+GLOBAL_MODE = "global"
+ALIGNMENT_MODES = {LCS_MODE, LOCAL_MODE, GLOBAL_MODE}
+CASES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pairwise_alignment_cases.txt")
+CASES_HEADER = ("Mode", "Query", "Target", "Score", "Query_start", "Query_end", "Target_start", "Target_end",
+                "Query_alignment", "Target_alignment",)
+COMMENT_CHAR = "#"
+
+# (match, mismatch, gap_open, gap_extend) defaults of the R functions. Intentional differences from them:
+# - smith_waterman_pairwise and needleman_wunsch_pairwise compare substr(v, i, i) to substr(w, j, j) at 1-based DP
+#   cell (i, j), one base past the bases the cell aligns; here cell (i, j) compares query[i - 1] to target[j - 1],
+#   as lcs does with substr(v, i - 1, i - 1)
+# - recurse_gap scores a gap from H and returns 0 at any predecessor scoring 0 or less, and its recursive call drops
+#   gap_open and gap_extend for their defaults; here gaps follow Gotoh's E and F recurrences, a gap of length k
+#   scoring gap_open + k * gap_extend
+# - The R backtrack pointers compare a cell to its raw predecessor scores, without the edge score, and the
+#   smith_waterman_pairwise traceback refers to undefined gap_char and w_list; here alignments are traced through
+#   the recurrences, preferring match or mismatch, then a query gap, then a target gap, as needleman_wunsch_pairwise
+#   does. Divide and conquer traceback of long sequences may pick a different alignment of the same score.
+# - lcs reports only the score; here LCS mode also reports an alignment
+DEFAULT_SCORES = {LCS_MODE: (1, 0, 0, 0,), LOCAL_MODE: (1, -1, -2, -1,), GLOBAL_MODE: (1, -1, 0, -2,)}
+
+NEG_INF = np.iinfo(np.int64).min // 4
+
+OUTPUT_HEADER = ("Target", "Score", "Query_start", "Query_end", "Target_start", "Target_end", "Query_alignment",
+                 "Target_alignment",)
+
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+LOGFILE = "pairwise_alignment_stderr.log"
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-q", "--query", type=str, required=False,
+                        help='Query sequence, or a FASTA whose first record is the query.')
+
+    parser.add_argument("-t", "--targets", type=str, required=False,
+                        help='FASTA of target sequences.')
+
+    parser.add_argument("-m", "--mode", type=str, default=LOCAL_MODE, choices=sorted(ALIGNMENT_MODES),
+                        help='Alignment mode. Default %s.' % LOCAL_MODE)
+
+    parser.add_argument("-M", "--match", type=int, default=None,
+                        help='Match score. Default the mode default of the R functions.')
+
+    parser.add_argument("-X", "--mismatch", type=int, default=None,
+                        help='Mismatch score. Default the mode default of the R functions.')
+
+    parser.add_argument("-g", "--gap_open", type=int, default=None,
+                        help='Gap open score, added once per gap. Default the mode default of the R functions.')
+
+    parser.add_argument("-e", "--gap_extend", type=int, default=None,
+                        help='Gap extend score, added per gap base. Default the mode default of the R functions.')
+
+    parser.add_argument("-a", "--traceback", action="store_true",
+                        help='Flag to report alignments in addition to scores.')
+
+    parser.add_argument("-b", "--batch_size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of targets scored together. Default %i.' % DEFAULT_BATCH_SIZE)
+
+    parser.add_argument("-c", "--check_cases", action="store_true",
+                        help='Flag to check the reference cases in %s instead of aligning.' %
+                             os.path.basename(CASES_FILE))
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional output compression, in background threads. '
+                             'The targets may be plain, gzipped, or bgzipped regardless.')
+
+    parser.add_argument("-o", "--output_dir", type=str, default=DEFAULT_OUTDIR,
+                        help='Optional output directory. Default current working directory.')
+
+    instrumentation.add_arguments(parser)
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def get_scoring(mode=LOCAL_MODE, match=None, mismatch=None, gap_open=None, gap_extend=None):
+    """Gets the scoring scheme of an alignment mode.
+
+    :param str mode: lcs, local, or global
+    :param int | None match: match score, default the mode default
+    :param int | None mismatch: mismatch score, default the mode default
+    :param int | None gap_open: gap open score, default the mode default
+    :param int | None gap_extend: gap extend score, default the mode default
+    :return dict: scoring with match, mismatch, gap_open, gap_extend, and local
+    """
+
+    if mode not in ALIGNMENT_MODES:
+        raise NotImplementedError("Alignment mode must be one of %s." % ", ".join(sorted(ALIGNMENT_MODES)))
+
+    scores = [d if e is None else e for e, d in zip((match, mismatch, gap_open, gap_extend,), DEFAULT_SCORES[mode])]
+
+    if mode == LCS_MODE and scores != list(DEFAULT_SCORES[LCS_MODE]):
+        raise NotImplementedError("LCS mode uses fixed scores.")
+
+    if scores[2] > 0 or scores[3] > 0:
+        raise NotImplementedError("Gap open and extend scores must not be positive.")
+
+    scoring = {"match": scores[0], "mismatch": scores[1], "gap_open": scores[2], "gap_extend": scores[3],
+               "local": mode == LOCAL_MODE}
+    return scoring
+
+
+def encode(seq):
+    """Encodes a sequence as bytes for comparison.
+
+    :param str seq: sequence
+    :return numpy.ndarray: uint8 codes
+    """
+
+    return np.frombuffer(seq.encode(), dtype=np.uint8)
+
+
+def pad_targets(targets):
+    """Encodes targets into one zero-padded array.
+
+    Cells past a target's end never feed cells within it, so padding does not change any of its scores.
+
+    :param list targets: target sequences
+    :return tuple: (targets x max length uint8 codes, target lengths)
+    """
+
+    lens = np.array([len(e) for e in targets], dtype=np.int64)
+    codes = np.zeros((len(targets), max(lens.max(initial=0), 1)), dtype=np.uint8)
+
+    for i, target in enumerate(targets):
+        codes[i, :len(target)] = encode(target)
+
+    return codes, lens
+
+
+def fill_diagonals(query, targets, target_lens, scoring, top_gap=None, keep_matrices=False):
+    """Fills the DP matrices of a query against padded targets by anti-diagonals, keeping linear memory.
+
+    Diagonal arrays are indexed by query position i, so cell (i, j) of diagonal d = i + j reads cell (i, j - 1) and
+    (i - 1, j) of diagonal d - 1 at index i and i - 1, and cell (i - 1, j - 1) of diagonal d - 2 at index i - 1. H is
+    the best score of a cell, E of those ending in a target base against a gap, and F of those ending in a query base
+    against a gap.
+
+    :param numpy.ndarray query: query codes
+    :param numpy.ndarray targets: targets x max length codes from pad_targets
+    :param numpy.ndarray target_lens: target lengths
+    :param dict scoring: scoring from get_scoring
+    :param int | None top_gap: global only; open score of a query gap starting at the top-left corner, 0 if it
+    continues a gap. Default gap_open.
+    :param bool keep_matrices: also keep the full H, E, and F matrices of the first target, for small problems
+    :return dict: per-target best cell score, best_i, and best_j in column-major first order, last-row H and F
+    arrays (targets x max length + 1), and with keep_matrices the matrices h, e, and f
+    """
+
+    match, mismatch = scoring["match"], scoring["mismatch"]
+    g, h = scoring["gap_open"], scoring["gap_extend"]
+    local = scoring["local"]
+    tb = g if top_gap is None else top_gap
+
+    n_targets = targets.shape[0]
+    m = len(query)
+    n = targets.shape[1] if n_targets > 0 else 0
+    shape = (n_targets, m + 1)
+
+    h_diags = [np.full(shape, NEG_INF, dtype=np.int64) for _ in range(3)]
+    e_diags = [np.full(shape, NEG_INF, dtype=np.int64) for _ in range(2)]
+    f_diags = [np.full(shape, NEG_INF, dtype=np.int64) for _ in range(2)]
+
+    # Diagonal 0 is the empty alignment
+    h_diags[1][:, 0] = 0
+    f_diags[1][:, 0] = 0
+
+    best = np.zeros(n_targets, dtype=np.int64)
+    best_i = np.zeros(n_targets, dtype=np.int64)
+    best_j = np.zeros(n_targets, dtype=np.int64)
+
+    last_h = np.full((n_targets, n + 1), NEG_INF, dtype=np.int64)
+    last_f = np.full((n_targets, n + 1), NEG_INF, dtype=np.int64)
+    if m == 0:
+        last_h[:, 0] = 0
+        last_f[:, 0] = 0
+
+    matrices = [np.full((m + 1, n + 1), NEG_INF, dtype=np.int64) for _ in range(3)] if keep_matrices else None
+    if keep_matrices:
+        matrices[0][0, 0] = 0
+
+    for d in range(1, m + n + 1):
+
+        h2, h1, hd = h_diags
+        e1, ed = e_diags
+        f1, fd = f_diags
+
+        lo, hi = max(0, d - n), min(m, d)
+
+        # Top row: target bases against leading query gaps
+        if lo == 0:
+            hd[:, 0] = 0 if local else g + h * d
+            ed[:, 0] = hd[:, 0]
+            fd[:, 0] = NEG_INF
+
+        # Left column: query bases against leading target gaps
+        if hi == d:
+            hd[:, d] = 0 if local else tb + h * d
+            fd[:, d] = hd[:, d]
+            ed[:, d] = NEG_INF
+
+        a, b = max(1, d - n), min(m, d - 1)
+        if a <= b:
+            cur, prev = slice(a, b + 1), slice(a - 1, b)
+
+            # Target bases j - 1 for query bases a - 1 through b - 1 run backwards along the diagonal
+            target_bases = targets[:, d - 1 - b:d - a][:, ::-1]
+            subs = np.where(query[a - 1:b][None, :] == target_bases, match, mismatch)
+
+            np.maximum(e1[:, cur] + h, h1[:, cur] + (g + h), out=ed[:, cur])
+            np.maximum(f1[:, prev] + h, h1[:, prev] + (g + h), out=fd[:, cur])
+            scores = np.maximum(np.maximum(h2[:, prev] + subs, ed[:, cur]), fd[:, cur])
+            if local:
+                np.maximum(scores, 0, out=scores)
+            hd[:, cur] = scores
+
+        # Track the first best cell in column-major order, within each target's own columns
+        i_range = np.arange(lo, hi + 1)
+        j_range = d - i_range
+        cells = np.where(j_range[None, :] <= target_lens[:, None], hd[:, lo:hi + 1], NEG_INF)
+
+        # The largest i on a diagonal has the smallest j
+        rev_idx = cells.shape[1] - 1 - np.argmax(cells[:, ::-1], axis=1)
+        diag_best = cells[np.arange(n_targets), rev_idx]
+        diag_i, diag_j = i_range[rev_idx], j_range[rev_idx]
+        update = (diag_best > best) | ((diag_best == best) & ((diag_j < best_j) | ((diag_j == best_j) &
+                                                                                  (diag_i < best_i))))
+        best = np.where(update, diag_best, best)
+        best_i = np.where(update, diag_i, best_i)
+        best_j = np.where(update, diag_j, best_j)
+
+        if lo <= m <= hi:
+            last_h[:, d - m] = hd[:, m]
+            last_f[:, d - m] = fd[:, m]
+
+        if keep_matrices:
+            for matrix, diag in zip(matrices, (hd, ed, fd,)):
+                matrix[i_range, j_range] = diag[0, lo:hi + 1]
+
+        h_diags = [h1, hd, h2]
+        e_diags = [ed, e1]
+        f_diags = [fd, f1]
+
+    res = {"best": best, "best_i": best_i, "best_j": best_j, "last_h": last_h, "last_f": last_f}
+    if keep_matrices:
+        res.update(zip(("h", "e", "f",), matrices))
+    return res
+
+
+def get_gap_score(length, scoring):
+    """Gets the score of a gap.
+
+    :param int length: gap length
+    :param dict scoring: scoring from get_scoring
+    :return int: score, 0 for no gap
+    """
+
+    if length == 0:
+        return 0
+
+    return scoring["gap_open"] + scoring["gap_extend"] * length
+
+
+def _matrix_traceback(query, target, scoring, top_gap, bottom_gap, columns):
+    """Appends the columns of an optimal global alignment traced back through the full DP matrices.
+
+    :param str query: query sequence
+    :param str target: target sequence
+    :param dict scoring: global scoring from get_scoring
+    :param int top_gap: open score of a query gap at the start, 0 if it continues a gap
+    :param int bottom_gap: open score of a query gap at the end, 0 if it continues a gap
+    :param list columns: (query character, target character) alignment columns, appended in place
+    """
+
+    g, h = scoring["gap_open"], scoring["gap_extend"]
+    target_codes, target_lens = pad_targets([target])
+    filled = fill_diagonals(encode(query), target_codes, target_lens, scoring, top_gap, keep_matrices=True)
+    h_mat, e_mat, f_mat = filled["h"], filled["e"], filled["f"]
+
+    i, j = len(query), len(target)
+    state = "f" if f_mat[i, j] - g + bottom_gap > h_mat[i, j] else "h"
+    rev_columns = []
+
+    while i > 0 and j > 0:
+
+        if state == "h":
+            sub = scoring["match"] if query[i - 1] == target[j - 1] else scoring["mismatch"]
+            if h_mat[i, j] == h_mat[i - 1, j - 1] + sub:
+                rev_columns.append((query[i - 1], target[j - 1],))
+                i, j = i - 1, j - 1
+            else:
+                state = "e" if h_mat[i, j] == e_mat[i, j] else "f"
+
+        elif state == "e":
+            rev_columns.append((GAP_CHAR, target[j - 1],))
+            state = "h" if e_mat[i, j] == h_mat[i, j - 1] + g + h else "e"
+            j -= 1
+
+        else:
+            rev_columns.append((query[i - 1], GAP_CHAR,))
+            state = "h" if f_mat[i, j] == h_mat[i - 1, j] + g + h else "f"
+            i -= 1
+
+    rev_columns.extend((query[k], GAP_CHAR,) for k in range(i - 1, -1, -1))
+    rev_columns.extend((GAP_CHAR, target[k],) for k in range(j - 1, -1, -1))
+    columns.extend(reversed(rev_columns))
+
+
+def _hirschberg(query, target, scoring, top_gap, bottom_gap, columns):
+    """Appends the columns of an optimal global alignment using Myers and Miller's divide and conquer.
+
+    :param str query: query sequence
+    :param str target: target sequence
+    :param dict scoring: global scoring from get_scoring
+    :param int top_gap: open score of a query gap at the start, 0 if it continues a gap
+    :param int bottom_gap: open score of a query gap at the end, 0 if it continues a gap
+    :param list columns: (query character, target character) alignment columns, appended in place
+    """
+
+    m, n = len(query), len(target)
+    g, h = scoring["gap_open"], scoring["gap_extend"]
+
+    if n == 0:
+        columns.extend((e, GAP_CHAR,) for e in query)
+        return
+
+    if m == 0:
+        columns.extend((GAP_CHAR, e,) for e in target)
+        return
+
+    if m == 1:
+
+        # Either delete the query base and insert the target, or align it to its best target base
+        best_score = max(top_gap, bottom_gap) + h + get_gap_score(n, scoring)
+        best_j = -1
+        for j, base in enumerate(target):
+            score = get_gap_score(j, scoring) + (scoring["match"] if base == query else scoring["mismatch"]) + \
+                    get_gap_score(n - j - 1, scoring)
+            if score > best_score:
+                best_score, best_j = score, j
+
+        if best_j < 0:
+            columns.append((query, GAP_CHAR,))
+            columns.extend((GAP_CHAR, e,) for e in target)
+        else:
+            columns.extend((GAP_CHAR, e,) for e in target[:best_j])
+            columns.append((query, target[best_j],))
+            columns.extend((GAP_CHAR, e,) for e in target[best_j + 1:])
+        return
+
+    if (m + 1) * (n + 1) <= MATRIX_TRACEBACK_CELLS:
+        _matrix_traceback(query, target, scoring, top_gap, bottom_gap, columns)
+        return
+
+    mid = m // 2
+    target_codes, target_lens = pad_targets([target])
+    rev_codes, _ = pad_targets([target[::-1]])
+
+    forward = fill_diagonals(encode(query[:mid]), target_codes, target_lens, scoring, top_gap)
+    reverse = fill_diagonals(encode(query[mid:][::-1]), rev_codes, target_lens, scoring, bottom_gap)
+
+    cc, dd = forward["last_h"][0, :n + 1], forward["last_f"][0, :n + 1]
+    rr, ss = reverse["last_h"][0, :n + 1][::-1], reverse["last_f"][0, :n + 1][::-1]
+
+    # Either the split row is crossed at any column, or a query gap spans it and its open score was counted twice
+    joined = cc + rr
+    gapped = dd + ss - g
+    j1, j2 = int(np.argmax(joined)), int(np.argmax(gapped))
+
+    if gapped[j2] > joined[j1]:
+        _hirschberg(query[:mid - 1], target[:j2], scoring, top_gap, 0, columns)
+        columns.extend(((query[mid - 1], GAP_CHAR,), (query[mid], GAP_CHAR,),))
+        _hirschberg(query[mid + 1:], target[j2:], scoring, 0, bottom_gap, columns)
+    else:
+        _hirschberg(query[:mid], target[:j1], scoring, top_gap, g, columns)
+        _hirschberg(query[mid:], target[j1:], scoring, g, bottom_gap, columns)
+
+
+def score_alignment(query_aln, target_aln, scoring):
+    """Scores an alignment.
+
+    :param str query_aln: gapped query
+    :param str target_aln: gapped target
+    :param dict scoring: scoring from get_scoring
+    :return int: alignment score
+    """
+
+    score = 0
+    gap_state = None
+    for q, t in zip(query_aln, target_aln):
+
+        if q == GAP_CHAR or t == GAP_CHAR:
+            state = 0 if q == GAP_CHAR else 1
+            score += scoring["gap_extend"] + (scoring["gap_open"] if state != gap_state else 0)
+            gap_state = state
+            continue
+
+        score += scoring["match"] if q == t else scoring["mismatch"]
+        gap_state = None
+
+    return score
+
+
+def align(query, target, mode=LOCAL_MODE, traceback=True, **scores):
+    """Aligns two sequences.
+
+    :param str query: query sequence
+    :param str target: target sequence
+    :param str mode: lcs, local, or global
+    :param bool traceback: recover the alignment, otherwise only the score and end coordinates
+    :param scores: optional match, mismatch, gap_open, and gap_extend overrides
+    :return dict: score, query_start, query_end, target_start, target_end, query_aln, and target_aln; starts and
+    alignments are None without traceback
+    """
+
+    return align_batch(query, [target], mode, traceback, **scores)[0]
+
+
+def _traceback(query, target, scoring, res):
+    """Recovers the alignment of a scored query and target.
+
+    :param str query: query sequence
+    :param str target: target sequence
+    :param dict scoring: scoring from get_scoring
+    :param dict res: result from align_batch with score and end coordinates, updated in place
+    """
+
+    global_scoring = dict(scoring, local=False)
+    query_start, target_start = 0, 0
+    query_end, target_end = res["query_end"], res["target_end"]
+
+    if scoring["local"]:
+
+        if res["score"] <= 0:
+            res.update({"query_start": query_end, "target_start": target_end, "query_aln": "", "target_aln": ""})
+            return
+
+        # The start is the first cell of an alignment anchored at the end that reaches the best score
+        query_codes = encode(query[:query_end][::-1])
+        target_codes, target_lens = pad_targets([target[:target_end][::-1]])
+        rev = fill_diagonals(query_codes, target_codes, target_lens, global_scoring)
+        query_start = query_end - int(rev["best_i"][0])
+        target_start = target_end - int(rev["best_j"][0])
+
+    columns = []
+    _hirschberg(query[query_start:query_end], target[target_start:target_end], global_scoring,
+                scoring["gap_open"], scoring["gap_open"], columns)
+
+    res.update({"query_start": query_start, "target_start": target_start,
+                "query_aln": "".join(e[0] for e in columns), "target_aln": "".join(e[1] for e in columns)})
+
+
+def align_batch(query, targets, mode=LOCAL_MODE, traceback=False, batch_size=DEFAULT_BATCH_SIZE, **scores):
+    """Aligns one query against many targets, scoring a batch of targets per anti-diagonal pass.
+
+    :param str query: query sequence
+    :param list targets: target sequences
+    :param str mode: lcs, local, or global
+    :param bool traceback: recover alignments, otherwise only scores and end coordinates
+    :param int batch_size: number of targets scored together
+    :param scores: optional match, mismatch, gap_open, and gap_extend overrides
+    :return list: results as from align, in target order
+    """
+
+    scoring = get_scoring(mode, **scores)
+    query_codes = encode(query)
+    results = []
+
+    for i in range(0, len(targets), batch_size):
+
+        batch = targets[i:i + batch_size]
+        target_codes, target_lens = pad_targets(batch)
+        filled = fill_diagonals(query_codes, target_codes, target_lens, scoring)
+
+        for k, target in enumerate(batch):
+
+            if scoring["local"]:
+                score, query_end, target_end = int(filled["best"][k]), int(filled["best_i"][k]), \
+                                               int(filled["best_j"][k])
+            else:
+                score, query_end, target_end = int(filled["last_h"][k, len(target)]), len(query), len(target)
+
+            res = {"score": score, "query_start": None, "query_end": query_end, "target_start": None,
+                   "target_end": target_end, "query_aln": None, "target_aln": None}
+
+            if not scoring["local"]:
+                res.update({"query_start": 0, "target_start": 0})
+
+            if traceback:
+                _traceback(query, target, scoring, res)
+
+            results.append(res)
+
+    return results
+
+
+def check_cases(cases_file=CASES_FILE):
+    """Aligns reference cases at the default scores of their mode and compares the results to those expected.
+
+    :param str cases_file: tab-delimited cases with the fields of CASES_HEADER; lines starting with # are skipped
+    :return list: (line number, field, expected, observed) tuples of each difference
+    """
+
+    differences = []
+    with compressed_io.open_input(cases_file) as cases_fh:
+        for line_number, line in enumerate(cases_fh, 1):
+
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            if line.startswith(COMMENT_CHAR) or tuple(line_split) == CASES_HEADER or not line.strip():
+                continue
+
+            mode, query, target = line_split[:3]
+            expected = dict(zip(("score", "query_start", "query_end", "target_start", "target_end",),
+                                [int(e) for e in line_split[3:8]]))
+            query_aln, target_aln = line_split[8:10]
+
+            res = align(query, target, mode)
+            observed = {e: res[e] for e in expected}
+
+            # Without an expected alignment, the reported one must still be optimal and spell the aligned sequences
+            if query_aln == NA_STR:
+                observed["aligned_score"] = score_alignment(res["query_aln"], res["target_aln"], get_scoring(mode))
+                expected["aligned_score"] = expected["score"]
+                observed["query_aln"] = res["query_aln"].replace(GAP_CHAR, "")
+                expected["query_aln"] = query[expected["query_start"]:expected["query_end"]]
+                observed["target_aln"] = res["target_aln"].replace(GAP_CHAR, "")
+                expected["target_aln"] = target[expected["target_start"]:expected["target_end"]]
+            else:
+                observed.update({"query_aln": res["query_aln"], "target_aln": res["target_aln"]})
+                expected.update({"query_aln": query_aln, "target_aln": target_aln})
+
+            differences.extend((line_number, e, expected[e], observed[e],) for e in expected
+                               if expected[e] != observed[e])
+
+    return differences
+
+
+def read_query(query):
+    """Reads the query sequence.
+
+    :param str query: sequence, or a FASTA whose first record is the query
+    :return str: query sequence
+    """
+
+    if not os.path.exists(query):
+        return query
+
+    with pysam.FastxFile(query, "r") as in_fh:
+        for rec in in_fh:
+            return rec.sequence
+
+    raise NotImplementedError("Query FASTA %s has no records." % query)
+
+
+def iter_target_batches(targets, batch_size=DEFAULT_BATCH_SIZE):
+    """Groups target FASTA records into batches.
+
+    :param str targets: target FASTA
+    :param int batch_size: targets per batch
+    :return generator: (names, sequences) list tuples
+    """
+
+    with pysam.FastxFile(targets, "r") as in_fh:
+
+        names, seqs = [], []
+        for rec in in_fh:
+            names.append(rec.name)
+            seqs.append(rec.sequence)
+
+            if len(seqs) == batch_size:
+                yield names, seqs
+                names, seqs = [], []
+
+        if seqs:
+            yield names, seqs
+
+
+def workflow(query, targets, mode=LOCAL_MODE, traceback=False, batch_size=DEFAULT_BATCH_SIZE,
+             output_dir=DEFAULT_OUTDIR, compression=None, **scores):
+    """Aligns a query against all records of a target FASTA.
+
+    :param str query: query sequence, or a FASTA whose first record is the query
+    :param str targets: target FASTA
+    :param str mode: lcs, local, or global
+    :param bool traceback: report alignments in addition to scores
+    :param int batch_size: number of targets scored together
+    :param str output_dir: output directory
+    :param str | None compression: output compression, gzip, bgzip, or None
+    :param scores: optional match, mismatch, gap_open, and gap_extend overrides
+    :return str: output filepath
+    """
+
+    query_seq = read_query(query)
+    outfile = compressed_io.get_output_name(
+        os.path.join(output_dir, get_transcript_structure.replace_extension(os.path.basename(targets), DEFAULT_EXT)),
+        compression)
+
+    metrics = instrumentation.get_metrics()
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+        out_fh.write(FILE_DELIM.join(OUTPUT_HEADER) + FILE_NEWLINE)
+
+        for names, seqs in metrics.timed_iter("parse", iter_target_batches(targets, batch_size)):
+
+            with metrics.stage("match"):
+                results = align_batch(query_seq, seqs, mode, traceback, batch_size, **scores)
+
+            with metrics.stage("write"):
+                write_results(out_fh, names, results)
+
+            metrics.add(instrumentation.READ, len(seqs))
+            metrics.add(instrumentation.WRITTEN, len(results))
+
+    return outfile
+
+
+def write_results(out_fh, names, results):
+    """Writes alignment results.
+
+    :param file out_fh: open output file
+    :param list names: target names
+    :param list results: results from align_batch
+    """
+
+    for name, res in zip(names, results):
+        fields = [name] + [NA_STR if res[e] is None else str(res[e]) for e in
+                           ("score", "query_start", "query_end", "target_start", "target_end", "query_aln",
+                            "target_aln",)]
+        out_fh.write(FILE_DELIM.join(fields) + FILE_NEWLINE)
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    outdir = parsed_args["output_dir"]
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+
+    log_handler = logging.FileHandler(os.path.join(outdir, LOGFILE))
+    log_handler.setFormatter(LOG_FORMATTER)
+    logger.addHandler(log_handler)
+
+    if parsed_args["check_cases"]:
+        differences = check_cases()
+        for line_number, field, expected, observed in differences:
+            logger.error("Case on line %i of %s: expected %s %s, observed %s." % (
+                line_number, os.path.basename(CASES_FILE), field, expected, observed))
+
+        if differences:
+            sys.exit(1)
+
+        logger.warning("All reference cases in %s passed." % os.path.basename(CASES_FILE))
+        return
+
+    if parsed_args["query"] is None or parsed_args["targets"] is None:
+        raise NotImplementedError("Alignment requires a query and targets.")
+
+    scores = {e: parsed_args[e] for e in ("match", "mismatch", "gap_open", "gap_extend",)}
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
+    workflow(query=parsed_args["query"], targets=parsed_args["targets"], mode=parsed_args["mode"],
+             traceback=parsed_args["traceback"], batch_size=parsed_args["batch_size"], output_dir=outdir,
+             compression=parsed_args["compression"], **scores)
+
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,26 @@
 # !/usr/bin/env/python
-"""Runs filtering of error-free reads."""
+"""Runs filtering of error-free reads, or of reads matching filter expressions."""
 
+import alignment_predicates
 import argparse
+import instrumentation
 import logging
+import multiprocessing
 import os
 import pysam
+import shutil
 import sys
+import tempfile
 
 FILT_SUFFIX = "filt.bam"
 EDIT_DIST = "NM"
 MD_TAG = "MD"
+DEFAULT_THREADS = 1
+CHUNK_SIZE = 10000000
+UNPLACED_CONTIG = "*"
+PART_PREFIX = "part"
+FILTER_NAME_DELIM = "="
+DEFAULT_FILTER = "%s == 0" % EDIT_DIST
 
 __author__ = "Ian Hoskins"
 __credits__ = ["Ian Hoskins"]
@@ -21,12 +32,7 @@ __status__ = "Development"
 
 
 __logger = logging.getLogger(__name__)
-__logger.setLevel(logging.DEBUG)
-__fhandler = logging.FileHandler("stderr.log")
-__fhandler.setLevel(logging.DEBUG)
-__formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-__fhandler.setFormatter(__formatter)
-__logger.addHandler(__fhandler)
+LOGFILE = "stderr.log"
 
 
 def parse_commandline_params(args):
@@ -41,7 +47,21 @@ def parse_commandline_params(args):
     # Add new arguments for command line passing of files, options, etc; see argparse docs
     parser.add_argument("-a", "--alignments", required=True, type=str, help='Input BAM file.')
 
-    parser.add_argument("-o", "--outdir", type=str, help='Output directory.')
+    parser.add_argument("-o", "--outdir", type=str, default=".", help='Output directory.')
+
+    parser.add_argument("-t", "--threads", type=int, default=DEFAULT_THREADS,
+                        help='Number of processes. Indexed BAMs are split into genomic chunks across a process pool; '
+                             'otherwise threads are used for BGZF compression/decompression. Default %i.'
+                             % DEFAULT_THREADS)
+
+    parser.add_argument("-f", "--filter", type=str, action="append", default=None,
+                        help='Filter as NAME=EXPRESSION, writing matching reads to <input>.NAME.%s. May be given '
+                             'multiple times to route reads into several outputs in one pass. Expressions combine '
+                             'NM, MAPQ, LEN, SOFTCLIP, MDMM, other numeric tags, flag names (e.g. unmapped, '
+                             'secondary), FLAG:<mask>, and has(<TAG>) with and/or/not. Default error-free reads (%s) '
+                             'to <input>.%s.' % (FILT_SUFFIX, DEFAULT_FILTER, FILT_SUFFIX))
+
+    instrumentation.add_arguments(parser)
 
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
@@ -65,50 +85,278 @@ def replace_extension(filename, ext, ignore_exts=(".gz", ".bz", ".bz2",)):
     return ext_res
 
 
-def filter_alignments(am, outdir):
-    """Filters alignnments that are error-free.
+def parse_filters(filters=None):
+    """Parses NAME=EXPRESSION filter specifications.
+
+    :param list | None filters: filter specifications; None for the default error-free filter
+    :return list: (name, expression) tuples, with name None for the default filter
+    """
+
+    if not filters:
+        return [(None, DEFAULT_FILTER,)]
+
+    parsed_filters = []
+    for filter_spec in filters:
+
+        if FILTER_NAME_DELIM not in filter_spec:
+            raise NotImplementedError("Filter %s is not of the form NAME=EXPRESSION." % filter_spec)
+
+        name, expression = filter_spec.split(FILTER_NAME_DELIM, 1)
+
+        # Validate the expression before any work is done
+        alignment_predicates.compile_expression(expression)
+        parsed_filters.append((name.strip(), expression,))
+
+    names = [name for name, _ in parsed_filters]
+    if len(set(names)) != len(names):
+        raise NotImplementedError("Filter names must be unique: %s" % ", ".join(names))
+
+    return parsed_filters
+
+
+def get_output_name(am, outdir, name=None):
+    """Gets the output BAM filepath for a filter.
 
     :param str am: input SAM/BAM file
     :param str outdir: output directory name
+    :param str | None name: filter name; None for the default filter
+    :return str: output BAM filepath
     """
 
-    am_filt = replace_extension(am, FILT_SUFFIX)
-    output_bam_name = os.path.join(outdir, am_filt)
+    suffix = FILT_SUFFIX if name is None else ".".join((name, FILT_SUFFIX,))
+    output_bam_name = os.path.join(outdir, replace_extension(os.path.basename(am), suffix))
+    return output_bam_name
 
-    with open(output_bam_name, mode="wb") as output_bam, \
-            pysam.AlignmentFile(am, "rb") as input_af, \
-            pysam.AlignmentFile(output_bam, "wb", header=input_af.header) as output_af:
 
-        for read_aln in input_af.fetch(until_eof=True):
+def route_alignments(alignments, predicates, output_afs):
+    """Writes each alignment to every output whose predicate it satisfies.
 
-            # NM denotes the edit operations (SNPs, InDels) relative to the reference
-            # This value is contained within the optional alignment "tags"
-            # if there are no edits, the read is error-free
-            if int(read_aln.get_tag("NM")) == 0:
+    :param iterable alignments: pysam.AlignedSegment objects
+    :param list predicates: compiled predicates, one per output
+    :param list output_afs: open output pysam.AlignmentFile objects
+    :return tuple: (number of alignments read, list of number of alignments written per output)
+    """
+
+    n_read = 0
+    n_written = [0] * len(predicates)
+    routes = list(enumerate(zip(predicates, output_afs)))
 
+    for read_aln in alignments:
+        n_read += 1
+        for i, (predicate, output_af) in routes:
+            if predicate(read_aln):
                 output_af.write(read_aln)
+                n_written[i] += 1
+
+    return n_read, n_written
+
+
+def get_genomic_chunks(header, chunk_size=CHUNK_SIZE):
+    """Splits the reference into ordered chunks of roughly equal size.
+
+    Large contigs are split into multiple regions, and small contigs are grouped, so tasks are balanced and the
+    number of partial BAMs stays small. Unplaced unmapped reads form the final chunk.
+
+    :param pysam.AlignmentHeader header: alignment header
+    :param int chunk_size: approximate number of reference bases per chunk
+    :return list: chunks, each a list of (contig, start, end) regions in coordinate order
+    """
+
+    chunks = []
+    chunk, chunk_len = [], 0
+
+    for contig, length in zip(header.references, header.lengths):
+        for start in range(0, length, chunk_size):
+
+            end = min(start + chunk_size, length)
+            chunk.append((contig, start, end,))
+            chunk_len += end - start
+
+            if chunk_len >= chunk_size:
+                chunks.append(chunk)
+                chunk, chunk_len = [], 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    chunks.append([(UNPLACED_CONTIG, None, None,)])
+    return chunks
+
+
+def _iter_chunk(input_af, chunk):
+    """Iterates the alignments starting within a genomic chunk.
+
+    :param pysam.AlignmentFile input_af: open indexed input BAM
+    :param list chunk: (contig, start, end) regions
+    :return generator: pysam.AlignedSegment objects
+    """
+
+    for contig, start, end in chunk:
+        for read_aln in input_af.fetch(contig, start, end):
+
+            # Reads overlapping the region start belong to the preceding region
+            if start is not None and read_aln.reference_start < start:
+                continue
+
+            yield read_aln
+
+
+def _filter_chunk(args):
+    """Filters the alignments of a genomic chunk into partial BAMs, one per filter.
+
+    :param tuple args: input BAM, chunk regions, filter expressions, and partial BAM filepaths
+    :return tuple: (number of alignments read, list of number of alignments written per filter)
+    """
+
+    am, chunk, expressions, part_bams = args
+
+    # Compiled predicates cannot be pickled, so each worker compiles its own
+    predicates = [alignment_predicates.compile_expression(e) for e in expressions]
+
+    with pysam.AlignmentFile(am, "rb") as input_af:
+
+        output_afs = [pysam.AlignmentFile(part_bam, "wb", header=input_af.header) for part_bam in part_bams]
+        try:
+            res = route_alignments(_iter_chunk(input_af, chunk), predicates, output_afs)
+        finally:
+            for output_af in output_afs:
+                output_af.close()
 
+    return res
 
-def workflow(alignments, outdir="."):
-    """Filters the reads without error in the alignments.
+
+def filter_alignments_parallel(am, output_bam_names, expressions, threads):
+    """Filters alignments of an indexed, coordinate-sorted BAM across a process pool.
+
+    Each worker writes partial BAMs per genomic chunk; as chunks are disjoint and ordered, the partial BAMs are
+    concatenated without recompression to give coordinate-sorted outputs.
+
+    :param str am: input indexed BAM file
+    :param list output_bam_names: output BAM filepaths, one per filter
+    :param list expressions: filter expressions
+    :param int threads: number of processes
+    :return list: number of alignments written per filter
+    """
+
+    metrics = instrumentation.get_metrics()
+
+    with pysam.AlignmentFile(am, "rb") as input_af:
+        chunks = get_genomic_chunks(input_af.header)
+
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(output_bam_names[0]) or ".")
+
+    try:
+        part_bams = [[os.path.join(temp_dir, "%s.%i.%i.bam" % (PART_PREFIX, i, j)) for j in range(len(expressions))]
+                     for i in range(len(chunks))]
+
+        tasks = [(am, chunk, expressions, part_bams[i],) for i, chunk in enumerate(chunks)]
+
+        chunk_res = []
+        with multiprocessing.Pool(threads) as pool:
+            for n_read, n_written in metrics.timed_iter("filter", pool.imap(_filter_chunk, tasks, chunksize=1)):
+                chunk_res.append(n_written)
+                metrics.add(instrumentation.READ, n_read)
+
+        with metrics.stage("merge"):
+            for j, output_bam_name in enumerate(output_bam_names):
+                pysam.cat("-o", output_bam_name, *[chunk_part_bams[j] for chunk_part_bams in part_bams])
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    n_written = [sum(e) for e in zip(*chunk_res)]
+    return n_written
+
+
+def filter_alignments(am, outdir, threads=DEFAULT_THREADS, filters=None):
+    """Filters alignnments that are error-free, or that match filter expressions.
+
+    All filters are evaluated in a single pass over the input.
+
+    :param str am: input SAM/BAM file
+    :param str outdir: output directory name
+    :param int threads: number of processes for an indexed BAM, otherwise BGZF threads
+    :param list | None filters: NAME=EXPRESSION filter specifications; None to filter error-free reads
+    :return list: output BAM filepaths, one per filter
+    """
+
+    metrics = instrumentation.get_metrics()
+    parsed_filters = parse_filters(filters)
+    output_bam_names = [get_output_name(am, outdir, name) for name, _ in parsed_filters]
+    expressions = [expression for _, expression in parsed_filters]
+
+    with pysam.AlignmentFile(am, "rb", threads=threads) as input_af:
+        is_parallel = threads > 1 and input_af.has_index()
+
+    if is_parallel:
+        n_written = filter_alignments_parallel(am, output_bam_names, expressions, threads)
+
+    else:
+        if threads > 1:
+            __logger.warning("%s is not indexed; filtering in a single process with %i BGZF threads." % (am, threads))
+
+        predicates = [alignment_predicates.compile_expression(e) for e in expressions]
+
+        with pysam.AlignmentFile(am, "rb", threads=threads) as input_af:
+
+            output_afs = [pysam.AlignmentFile(e, "wb", header=input_af.header, threads=threads)
+                          for e in output_bam_names]
+            try:
+                with metrics.stage("filter"):
+                    _, n_written = route_alignments(
+                        metrics.counted(instrumentation.READ, input_af.fetch(until_eof=True)), predicates, output_afs)
+            finally:
+                for output_af in output_afs:
+                    output_af.close()
+
+    metrics.add(instrumentation.WRITTEN, sum(n_written))
+
+    for output_bam_name, expression, n in zip(output_bam_names, expressions, n_written):
+        __logger.info("Wrote %i alignments matching %s to %s." % (n, expression, output_bam_name))
+
+    return output_bam_names
+
+
+def workflow(alignments, outdir=".", threads=DEFAULT_THREADS, filters=None):
+    """Filters the reads without error in the alignments, or the reads matching filter expressions.
 
     :param str alignments: input BAM file
     :param str outdir: Optional output dir for the results
+    :param int threads: number of processes for an indexed BAM, otherwise BGZF threads
+    :param list | None filters: NAME=EXPRESSION filter specifications; None to filter error-free reads
+    :return list: output BAM filepaths
     """
 
-    filter_alignments(am=alignments, outdir=outdir)
+    output_bams = filter_alignments(am=alignments, outdir=outdir, threads=threads, filters=filters)
+    return output_bams
 
 
-def main():
-    """Runs the workflow when called from command line."""
+def main(args=None):
+    """Runs the workflow when called from command line.
 
-    parsed_args = parse_commandline_params(sys.argv[1:])
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
 
-    workflow(alignments=parsed_args["alignments"], outdir=parsed_args["outdir"])
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
+    # Consider putting the following in a logging config file
+    __logger.setLevel(logging.DEBUG)
+    fhandler = logging.FileHandler(LOGFILE)
+    fhandler.setLevel(logging.DEBUG)
+    fhandler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    __logger.addHandler(fhandler)
 
-if __name__ == "__main__":
     __logger.info("Started %s" % sys.argv[0])
-    main()
+
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], __logger)
+
+    workflow(alignments=parsed_args["alignments"], outdir=parsed_args["outdir"], threads=parsed_args["threads"],
+             filters=parsed_args["filter"])
+
+    instrumentation.finish()
+
     __logger.info("Completed %s" % sys.argv[0])
 
+
+if __name__ == "__main__":
+    main()
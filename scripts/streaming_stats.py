@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Mergeable per-column summary statistics over blocks of rows.
+
+Accumulators are updated one block (rows x columns NumPy array) at a time, so a matrix of any number of rows is
+summarized in memory bounded by the block size and the sketch size:
+
+    moments     count, mean, and sum of squared deviations per column, merged across blocks with the parallel form
+                of Welford's algorithm (Chan et al.)
+    sketch      approximate quantiles per column from a stack of compactors; each level holds at most sketch_size
+                rows of weight 2^level, and a full level is sorted per column and every other row promoted
+
+NaN values are ignored by both.
+"""
+
+import numpy as np
+
+SKETCH_SIZE = 128
+
+
+def new_moments(n_cols):
+    """Creates an empty moments accumulator.
+
+    :param int n_cols: number of columns
+    :return dict: accumulator with per-column n, mean, m2, and n_above arrays
+    """
+
+    moments = {"n": np.zeros(n_cols, dtype=np.int64), "mean": np.zeros(n_cols, dtype=np.float64),
+               "m2": np.zeros(n_cols, dtype=np.float64), "n_above": np.zeros(n_cols, dtype=np.int64)}
+    return moments
+
+
+def update_moments(moments, block, threshold=0.0):
+    """Merges a block of rows into a moments accumulator.
+
+    :param dict moments: accumulator from new_moments, updated in place
+    :param numpy.ndarray block: rows x columns values
+    :param float threshold: values above this are counted in n_above
+    """
+
+    block = np.asarray(block, dtype=np.float64)
+    present = ~np.isnan(block)
+
+    n_block = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_block = np.where(n_block > 0, np.nansum(block, axis=0) / n_block, 0.0)
+    m2_block = np.nansum((block - mean_block) ** 2, axis=0)
+
+    n_a = moments["n"]
+    n_total = n_a + n_block
+    delta = mean_block - moments["mean"]
+    safe_total = np.maximum(n_total, 1)
+
+    moments["mean"] += delta * n_block / safe_total
+    moments["m2"] += m2_block + delta ** 2 * n_a * n_block / safe_total
+    moments["n"] = n_total
+    moments["n_above"] += (present & (np.nan_to_num(block, nan=threshold) > threshold)).sum(axis=0)
+
+
+def get_variance(moments, ddof=1):
+    """Gets the per-column variance of a moments accumulator.
+
+    :param dict moments: accumulator from new_moments
+    :param int ddof: delta degrees of freedom; 1 for the sample variance
+    :return numpy.ndarray: variances, NaN where there are too few values
+    """
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = np.where(moments["n"] > ddof, moments["m2"] / (moments["n"] - ddof), np.nan)
+    return variance
+
+
+def new_sketch(n_cols, sketch_size=SKETCH_SIZE):
+    """Creates an empty quantile sketch.
+
+    :param int n_cols: number of columns
+    :param int sketch_size: maximum rows held per level
+    :return dict: sketch with compactor levels
+    """
+
+    sketch = {"n_cols": n_cols, "sketch_size": sketch_size, "levels": [], "offsets": []}
+    return sketch
+
+
+def _compact(sketch, level):
+    """Halves a full level into the next, keeping alternate rows of the per-column sorted values.
+
+    :param dict sketch: sketch from new_sketch, updated in place
+    :param int level: level to compact
+    """
+
+    rows = np.sort(sketch["levels"][level], axis=0)
+
+    # An odd row out stays at this level
+    n_pairs = len(rows) // 2
+    keep = rows[2 * n_pairs:]
+    offset = sketch["offsets"][level]
+    promoted = rows[offset:2 * n_pairs:2]
+
+    # Alternating the kept row of each pair avoids a systematic bias toward lower or higher values
+    sketch["offsets"][level] = 1 - offset
+    sketch["levels"][level] = keep
+
+    if level + 1 == len(sketch["levels"]):
+        sketch["levels"].append(np.empty((0, sketch["n_cols"]), dtype=rows.dtype))
+        sketch["offsets"].append(0)
+
+    sketch["levels"][level + 1] = np.concatenate((sketch["levels"][level + 1], promoted))
+
+
+def update_sketch(sketch, block):
+    """Adds a block of rows to a quantile sketch.
+
+    :param dict sketch: sketch from new_sketch, updated in place
+    :param numpy.ndarray block: rows x columns values
+    """
+
+    if not sketch["levels"]:
+        sketch["levels"].append(np.empty((0, sketch["n_cols"]), dtype=np.float32))
+        sketch["offsets"].append(0)
+
+    sketch["levels"][0] = np.concatenate((sketch["levels"][0], np.asarray(block, dtype=np.float32)))
+
+    level = 0
+    while level < len(sketch["levels"]):
+        if len(sketch["levels"][level]) > sketch["sketch_size"]:
+            _compact(sketch, level)
+        level += 1
+
+
+def get_quantiles(sketch, quantiles):
+    """Gets approximate per-column quantiles from a sketch.
+
+    :param dict sketch: sketch from new_sketch
+    :param list quantiles: quantiles in [0, 1]
+    :return numpy.ndarray: quantiles x columns values, NaN for columns without values
+    """
+
+    res = np.full((len(quantiles), sketch["n_cols"]), np.nan)
+    if not sketch["levels"]:
+        return res
+
+    values = np.concatenate(sketch["levels"])
+    weights = np.concatenate([np.full(len(e), 2 ** i, dtype=np.int64) for i, e in enumerate(sketch["levels"])])
+    if len(values) == 0:
+        return res
+
+    # NaN sorts last and carries no weight
+    order = np.argsort(values, axis=0, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    sorted_weights = np.where(np.isnan(sorted_values), 0, weights[order])
+    cum_weights = np.cumsum(sorted_weights, axis=0)
+    total = cum_weights[-1]
+
+    cols = np.arange(sketch["n_cols"])
+    for i, q in enumerate(quantiles):
+        rank = (cum_weights < np.maximum(q * total, 1)).sum(axis=0)
+        res[i] = np.where(total > 0, sorted_values[np.minimum(rank, len(values) - 1), cols], np.nan)
+
+    return res
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Routes records of a pipe-delimited APPRIS transcriptome FASTA to one or more extraction outputs in one pass.
+
+Each output selects records by transcript ID without version or by gene name, and sets its own RNA conversion and
+minimal-name options. An inverted map from ID to outputs sends each record to every output that selected it, so many
+ID lists cost a single pass over the FASTA, or a single set of faidx lookups when the header index is used.
+"""
+
+import compressed_io
+import instrumentation
+import os
+import pysam
+import transcriptome_index
+
+FILE_NEWLINE = "\n"
+FILE_DELIM = "\t"
+FASTA_HEADER_CHAR = ">"
+FOREGROUND_EXT = ".extracted.fa"
+RNA_TABLE = str.maketrans("T", "U")
+GZIP = compressed_io.GZIP
+BGZIP = compressed_io.BGZIP
+COMPRESSION_TYPES = compressed_io.COMPRESSION_TYPES
+BATCH_OPTION_DELIM = ","
+RNA_OPTION = "rna"
+MINIMAL_NAME_OPTION = "minimal_name"
+BATCH_OPTIONS = {RNA_OPTION, MINIMAL_NAME_OPTION}
+BUFFER_SIZE = 1048576
+
+
+def format_record(name, comment, seq):
+    """Formats a FASTA record as pysam.FastxRecord does.
+
+    :param str name: record name
+    :param str | None comment: optional header comment
+    :param str seq: sequence
+    :return str: FASTA record, including the final newline
+    """
+
+    header = name if comment is None else " ".join((name, comment,))
+    return FASTA_HEADER_CHAR + header + FILE_NEWLINE + seq + FILE_NEWLINE
+
+
+def get_output_name(ids_file, output_dir, compression=None):
+    """Gets the output FASTA filepath for an ID list.
+
+    :param str ids_file: ID list file
+    :param str output_dir: output directory
+    :param str | None compression: gzip, bgzip, or None
+    :return str: output filepath
+    """
+
+    outfile = os.path.join(output_dir, os.path.basename(os.path.splitext(ids_file)[0]) + FOREGROUND_EXT)
+    return compressed_io.get_output_name(outfile, compression)
+
+
+def new_output(ids_file, output_dir, make_rna=False, minimal_name=False, compression=None):
+    """Creates an extraction output for an ID list.
+
+    :param str ids_file: transcript IDs without version or gene names, one per line
+    :param str output_dir: output directory
+    :param bool make_rna: convert DNA to RNA
+    :param bool minimal_name: name records by transcript ID without version
+    :param str | None compression: gzip, bgzip, or None
+    :return dict: output with ids, make_rna, minimal_name, and outfile
+    """
+
+    with open(ids_file, "r") as ids_fh:
+        ids = {e.strip() for e in ids_fh} - {""}
+
+    output = {"ids": ids, "make_rna": make_rna, "minimal_name": minimal_name,
+              "outfile": get_output_name(ids_file, output_dir, compression)}
+    return output
+
+
+def parse_batch(batch, output_dir, compression=None):
+    """Parses a batch file of ID lists and their options.
+
+    :param str batch: file with an ID list path per line, optionally followed by a tab and comma-separated options
+    rna and/or minimal_name
+    :param str output_dir: output directory
+    :param str | None compression: gzip, bgzip, or None
+    :return list: outputs from new_output
+    """
+
+    outputs = []
+    with open(batch, "r") as batch_fh:
+        for line in batch_fh:
+
+            if not line.strip():
+                continue
+
+            line_split = line.rstrip(FILE_NEWLINE).split(FILE_DELIM)
+            options = set(line_split[1].split(BATCH_OPTION_DELIM)) - {""} if len(line_split) > 1 else set()
+
+            if not options <= BATCH_OPTIONS:
+                raise NotImplementedError("Unknown batch options %s; must be among %s." % (
+                    ", ".join(sorted(options - BATCH_OPTIONS)), ", ".join(sorted(BATCH_OPTIONS))))
+
+            outputs.append(new_output(line_split[0], output_dir, RNA_OPTION in options,
+                                      MINIMAL_NAME_OPTION in options, compression))
+
+    outfiles = [output["outfile"] for output in outputs]
+    if len(set(outfiles)) != len(outfiles):
+        raise NotImplementedError("Batch ID list files must have unique basenames.")
+
+    return outputs
+
+
+def open_output(outfile, compression=None):
+    """Opens an output FASTA for binary writing.
+
+    :param str outfile: output filepath
+    :param str | None compression: gzip, bgzip, or None
+    :return file: writable binary file handle
+    """
+
+    return compressed_io.open_output(outfile, "wb", compression)
+
+
+def get_routes(outputs):
+    """Inverts the outputs' ID sets into a map from ID to the outputs selecting it.
+
+    :param list outputs: outputs from new_output
+    :return dict: {ID: list of output indices}
+    """
+
+    routes = {}
+    for i, output in enumerate(outputs):
+        for e in output["ids"]:
+            routes.setdefault(e, []).append(i)
+
+    return routes
+
+
+def iter_records(fasta, values, key, use_index=False, index_file=None):
+    """Iterates the FASTA records whose header field may be selected, in FASTA order.
+
+    :param str fasta: APPRIS transcriptome FASTA
+    :param set values: transcript IDs without version, or gene names
+    :param str key: trx_id or gene_name
+    :param bool use_index: fetch only selected records via the header index and faidx
+    :param str | None index_file: optional header index path
+    :return generator: (name, comment, transcript ID without version, gene name, sequence) tuples
+    """
+
+    if use_index:
+
+        conn = transcriptome_index.load_index(fasta, index_file)
+        records = transcriptome_index.get_records(conn, values, key)
+        conn.close()
+
+        for (_, name, comment, trx_id, gene_name), seq in transcriptome_index.iter_sequences(fasta, records):
+            yield name, comment, trx_id, gene_name, seq
+        return
+
+    with pysam.FastxFile(fasta, "r") as in_fh:
+        for rec in in_fh:
+            _, _, trx_id, gene_name = transcriptome_index.parse_header(rec.name)
+            yield rec.name, rec.comment, trx_id, gene_name, rec.sequence
+
+
+def extract_records(fasta, outputs, key, use_index=False, index_file=None, compression=None):
+    """Writes the selected records of every output in a single pass over the FASTA.
+
+    :param str fasta: APPRIS transcriptome FASTA
+    :param list outputs: outputs from new_output
+    :param str key: trx_id to select by transcript ID, or gene_name to select by gene name
+    :param bool use_index: fetch only selected records via the header index and faidx
+    :param str | None index_file: optional header index path
+    :param str | None compression: gzip, bgzip, or None
+    :return list: number of records written per output
+    """
+
+    routes = get_routes(outputs)
+    buffers = [[] for _ in outputs]
+    buffer_sizes = [0] * len(outputs)
+    counters = [0] * len(outputs)
+    key_idx = 2 if key == transcriptome_index.TRX_KEY else 3
+
+    output_fhs = [open_output(output["outfile"], compression) for output in outputs]
+    metrics = instrumentation.get_metrics()
+    records = metrics.counted(instrumentation.READ, iter_records(fasta, set(routes), key, use_index, index_file))
+
+    try:
+        for record in metrics.timed_iter("parse", records):
+
+            name, comment, trx_id, _, seq = record
+            output_indices = routes.get(record[key_idx])
+            if output_indices is None:
+                continue
+
+            # The RNA sequence is shared by all outputs requesting it
+            rna_seq = None
+            for i in output_indices:
+
+                output = outputs[i]
+                if output["make_rna"] and rna_seq is None:
+                    rna_seq = seq.translate(RNA_TABLE)
+
+                fasta_rec = format_record(trx_id if output["minimal_name"] else name, comment,
+                                          rna_seq if output["make_rna"] else seq)
+
+                buffers[i].append(fasta_rec)
+                buffer_sizes[i] += len(fasta_rec)
+                counters[i] += 1
+
+                if buffer_sizes[i] >= BUFFER_SIZE:
+                    with metrics.stage("write"):
+                        output_fhs[i].write("".join(buffers[i]).encode())
+                    buffers[i], buffer_sizes[i] = [], 0
+
+        with metrics.stage("write"):
+            for output_fh, output_buffer in zip(output_fhs, buffers):
+                output_fh.write("".join(output_buffer).encode())
+
+    finally:
+        for output_fh in output_fhs:
+            output_fh.close()
+
+    metrics.add(instrumentation.WRITTEN, sum(counters))
+    return counters
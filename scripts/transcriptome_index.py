@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Builds and queries a persistent header-field index of a pipe-delimited APPRIS transcriptome FASTA.
+
+Record names are indexed by transcript ID without version (header field 0) and gene name (header field 5), so
+selected records are fetched with faidx random access instead of streaming the whole FASTA.
+"""
+
+import argparse
+import compressed_io
+import logging
+import os
+import pysam
+import sqlite3
+import sys
+
+FILE_NEWLINE = "\n"
+FASTA_HEADER_CHAR = ">"
+HEADER_DELIM = "|"
+TRX_IDX = 0
+GENE_IDX = 5
+TRX_EXT = "."
+INDEX_EXT = "hidx"
+INDEX_VERSION = "1"
+TRX_KEY = "trx_id"
+GENE_KEY = "gene_name"
+LOOKUP_KEYS = {TRX_KEY, GENE_KEY}
+LOG_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+__author__ = "Ian Hoskins"
+__credits__ = ["Ian Hoskins"]
+__license__ = "GPLv3"
+__maintainer__ = "Ian Hoskins"
+__email__ = "ianjameshoskins@utexas.edu"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMATTER)
+logger.addHandler(console_handler)
+
+INDEX_SCHEMA = (
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE records (rank INTEGER PRIMARY KEY, name TEXT, comment TEXT, trx_id TEXT, gene_name TEXT)",
+)
+
+INDEX_POST_BUILD = (
+    "CREATE INDEX records_trx_id ON records (trx_id)",
+    "CREATE INDEX records_gene_name ON records (gene_name)",
+)
+
+
+def parse_commandline_params(args):
+    """Parses command line parameters.
+
+    :param list args: command line arguments, no script name
+    :return argparse.Namespace: namespace object with dict-like access
+    """
+
+    parser = argparse.ArgumentParser(description="%s arguments" % __name__)
+
+    parser.add_argument("-f", "--fasta", type=str, required=True,
+                        help="APPRIS transcriptome FASTA with pipe-delimited headers, uncompressed or bgzipped.")
+
+    parser.add_argument("-x", "--index_file", type=str, default=None,
+                        help="Optional index path. Default the FASTA path with extension .%s." % INDEX_EXT)
+
+    parser.add_argument("-F", "--force", action="store_true",
+                        help="Flag to rebuild the index even if it is current.")
+
+    parsed_args = vars(parser.parse_args(args))
+    return parsed_args
+
+
+def get_index_path(fasta, index_file=None):
+    """Gets the path of the header index for a FASTA.
+
+    :param str fasta: FASTA filename
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    if index_file is not None:
+        return index_file
+
+    return ".".join((fasta, INDEX_EXT,))
+
+
+def get_source_signature(fasta):
+    """Gets the values used to detect changes to the source FASTA.
+
+    :param str fasta: FASTA filename
+    :return dict: signature with absolute path, size, and modification time
+    """
+
+    fasta_stat = os.stat(fasta)
+    signature = {"version": INDEX_VERSION, "source": os.path.abspath(fasta),
+                 "size": str(fasta_stat.st_size), "mtime_ns": str(fasta_stat.st_mtime_ns)}
+    return signature
+
+
+def is_index_current(fasta, index_file=None):
+    """Determines if an index exists and was built from the current FASTA.
+
+    :param str fasta: FASTA filename
+    :param str | None index_file: optional explicit index path
+    :return bool: whether the index may be reused
+    """
+
+    index_path = get_index_path(fasta, index_file)
+
+    if not os.path.exists(index_path):
+        return False
+
+    try:
+        with sqlite3.connect(index_path) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        return False
+
+    return meta == get_source_signature(fasta)
+
+
+def parse_header(header):
+    """Splits a FASTA header line into the record name, comment, and indexed fields.
+
+    :param str header: header line without the leading >
+    :return tuple: (name, comment or None, transcript ID without version, gene name or None)
+    """
+
+    header_split = header.rstrip(FILE_NEWLINE).split(None, 1)
+    name = header_split[0]
+    comment = header_split[1] if len(header_split) > 1 else None
+
+    name_split = name.split(HEADER_DELIM)
+    trx_id = name_split[TRX_IDX].split(TRX_EXT)[0]
+    gene_name = name_split[GENE_IDX] if len(name_split) > GENE_IDX else None
+
+    return name, comment, trx_id, gene_name
+
+
+def build_index(fasta, index_file=None):
+    """Builds a header-field index of a FASTA in one pass over its header lines.
+
+    :param str fasta: FASTA filename
+    :param str | None index_file: optional explicit index path
+    :return str: index filepath
+    """
+
+    index_path = get_index_path(fasta, index_file)
+    temp_path = ".".join((index_path, "tmp",))
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    logger.info("Building FASTA header index %s" % index_path)
+
+    conn = sqlite3.connect(temp_path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = OFF")
+    for statement in INDEX_SCHEMA:
+        conn.execute(statement)
+
+    with compressed_io.open_input(fasta) as fasta_fh:
+        records = [(rank,) + parse_header(line[1:]) for rank, line in
+                   enumerate(e for e in fasta_fh if e.startswith(FASTA_HEADER_CHAR))]
+
+    conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?)", records)
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", get_source_signature(fasta).items())
+
+    for statement in INDEX_POST_BUILD:
+        conn.execute(statement)
+
+    conn.commit()
+    conn.close()
+
+    # Only replace a prior index once the new one is complete
+    os.replace(temp_path, index_path)
+
+    logger.info("Indexed %i records." % len(records))
+    return index_path
+
+
+def load_index(fasta, index_file=None):
+    """Opens the header index for a FASTA, building it and the faidx index first if missing or stale.
+
+    :param str fasta: FASTA filename
+    :param str | None index_file: optional explicit index path
+    :return sqlite3.Connection: open index connection
+    """
+
+    if not is_index_current(fasta, index_file):
+        build_index(fasta, index_file)
+
+    # pysam only builds a missing faidx index, so a stale one must be removed first
+    fai = ".".join((fasta, "fai",))
+    if os.path.exists(fai) and os.path.getmtime(fai) < os.path.getmtime(fasta):
+        os.remove(fai)
+
+    conn = sqlite3.connect(get_index_path(fasta, index_file))
+    return conn
+
+
+def get_records(conn, values, key=TRX_KEY):
+    """Gets the records whose header field matches any of the values, in FASTA order.
+
+    :param sqlite3.Connection conn: open index connection
+    :param iterable values: transcript IDs without version, or gene names
+    :param str key: trx_id or gene_name
+    :return list: (rank, name, comment or None, transcript ID without version, gene name) tuples
+    """
+
+    if key not in LOOKUP_KEYS:
+        raise NotImplementedError("Lookup key must be one of %s." % ", ".join(sorted(LOOKUP_KEYS)))
+
+    values = list(values)
+    rows = []
+
+    # Stay under SQLite's host parameter limit
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        query = "SELECT rank, name, comment, trx_id, gene_name FROM records WHERE %s IN (%s)" % \
+                (key, ",".join("?" * len(chunk)))
+        rows.extend(conn.execute(query, chunk).fetchall())
+
+    rows.sort()
+    return rows
+
+
+def iter_sequences(fasta, records):
+    """Fetches the sequences of indexed records via faidx random access.
+
+    :param str fasta: FASTA filename, uncompressed or bgzipped
+    :param list records: records from get_records
+    :return generator: (record, sequence) tuples
+    """
+
+    with pysam.FastaFile(fasta) as fasta_fa:
+        for record in records:
+            yield record, fasta_fa.fetch(reference=record[1])
+
+
+def workflow(fasta, index_file=None, force=False):
+    """Builds the FASTA header index if it is missing, stale, or forced.
+
+    :param str fasta: FASTA filename
+    :param str | None index_file: optional explicit index path
+    :param bool force: rebuild even if the index is current
+    :return str: index filepath
+    """
+
+    if force or not is_index_current(fasta, index_file):
+        return build_index(fasta, index_file)
+
+    logger.info("Index for %s is current." % fasta)
+    return get_index_path(fasta, index_file)
+
+
+def main():
+    """Runs the workflow when called from command line."""
+
+    parsed_args = parse_commandline_params(sys.argv[1:])
+
+    logger.setLevel(logging.INFO)
+    logger.info("Started %s" % sys.argv[0])
+
+    workflow(fasta=parsed_args["fasta"], index_file=parsed_args["index_file"], force=parsed_args["force"])
+
+    logger.info("Completed %s" % sys.argv[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,15 @@
 """Trims reads from a BAM based on flanking sequences."""
 
 import argparse
+import collections
+import compressed_io
+import flank_matcher
+import instrumentation
 import logging
+import multiprocessing
+import numpy as np
 import os
 import pysam
-import regex
 import sys
 
 FASTQ_QNAME_CHAR = "@"
@@ -57,7 +62,21 @@ console_handler.setFormatter(LOG_FORMATTER)
 logger.addHandler(console_handler)
 
 MM_ALLOWANCE = 1
-SAM_QUAL_FIELD = 10
+BATCH_SIZE = 10000
+DEFAULT_THREADS = 1
+PHRED_OFFSET = 33
+MISSING_QUALS = b"*"
+PHRED_TO_ASCII = bytes(min(q + PHRED_OFFSET, 126) for q in range(256))
+CACHE_SIZE = 1000000
+COUNTS_EXT = "trim.counts.txt"
+COUNTS_HEADER = ("Sequence", "Count", "Mean_quality")
+QUAL_DELIM = ","
+NA_STR = "NA"
+
+# Flanks, trimming options, and the match cache are set up once per worker process
+_flanks = None
+_trim_kwargs = None
+_match_cache = None
 
 
 def parse_commandline_params(args):
@@ -78,61 +97,376 @@ def parse_commandline_params(args):
     parser.add_argument("-e", "--mm_allowance", type=int, default=MM_ALLOWANCE,
                         help='Mismatch allowance for matching the flanking sequences. Default %i.' % MM_ALLOWANCE)
 
+    parser.add_argument("-m", "--match_mode", type=str, default=flank_matcher.SUBSTITUTION_MODE,
+                        choices=sorted(flank_matcher.MATCH_MODES),
+                        help='Count mismatches only (substitution) or also indels (edit) against the allowance. '
+                             'Default %s.' % flank_matcher.SUBSTITUTION_MODE)
+
+    parser.add_argument("-t", "--threads", type=int, default=DEFAULT_THREADS,
+                        help='Number of worker processes for flank matching and trimming. Default %i.'
+                             % DEFAULT_THREADS)
+
+    parser.add_argument("-c", "--collapse", action="store_true",
+                        help='Flag to collapse trimmed reads to a table of unique sequences with counts and '
+                             'per-position mean quality, memoizing flank matches per unique read sequence.')
+
+    parser.add_argument("-n", "--no_fastq", action="store_true",
+                        help='Flag to write only the collapsed table and not the per-read FASTQ. Requires --collapse.')
+
+    parser.add_argument("-s", "--cache_size", type=int, default=CACHE_SIZE,
+                        help='Maximum unique read sequences to memoize per process with --collapse. Default %i.'
+                             % CACHE_SIZE)
+
+    parser.add_argument("-z", "--compression", type=str, default=None, choices=sorted(compressed_io.COMPRESSION_TYPES),
+                        help='Optional compression of the FASTQ and count table, in background threads.')
+
     parser.add_argument("-o", "--output_dir", type=str, default=".",
                         help='Optional output directory. Default current working directory.')
 
+    instrumentation.add_arguments(parser)
+
     parsed_args = vars(parser.parse_args(args))
     return parsed_args
 
 
-def workflow(bam, flank_sequences, mm_allowance=MM_ALLOWANCE, output_dir="."):
+def iter_batches(input_af, batch_size=BATCH_SIZE):
+    """Groups reads into batches for matching.
+
+    :param pysam.AlignmentFile input_af: open input BAM
+    :param int batch_size: reads per batch
+    :return generator: (index of first read, list of sequences, list of Phred quality bytes) tuples
+    """
+
+    metrics = instrumentation.get_metrics()
+    first_index = 0
+    seqs, quals = [], []
+
+    for align_seg in input_af.fetch(until_eof=True):
+
+        # Take qualities from the quality array rather than serializing the whole record
+        read_quals = align_seg.query_qualities
+        seqs.append(align_seg.query_sequence)
+        quals.append(read_quals.tobytes() if read_quals is not None else None)
+
+        if len(seqs) == batch_size:
+            metrics.add(instrumentation.READ, len(seqs))
+            yield first_index, seqs, quals
+            first_index += len(seqs)
+            seqs, quals = [], []
+
+    if seqs:
+        metrics.add(instrumentation.READ, len(seqs))
+        yield first_index, seqs, quals
+
+
+def match_flanks(seqs, flank_left, flank_right):
+    """Matches both flanks against a list of reads.
+
+    :param list seqs: read sequences
+    :param dict flank_left: compiled left flank
+    :param dict flank_right: compiled right flank
+    :return list: (left flank start, right flank end, rejected by the seed prefilter) tuples, -1 for missing flanks
+    """
+
+    # Reads lacking an exact seed of either flank cannot match both, so skip fuzzy matching for them
+    left_bounds = flank_matcher.find_seed_bounds(flank_left, seqs)
+    right_bounds = flank_matcher.find_seed_bounds(flank_right, seqs)
+    no_seed = (left_bounds == flank_matcher.NO_HIT) | (right_bounds == flank_matcher.NO_HIT)
+    left_bounds[no_seed] = flank_matcher.NO_HIT
+    right_bounds[no_seed] = flank_matcher.NO_HIT
+
+    # Need to search each sequence for the flanking nucleotides
+    left_starts, _, _ = flank_matcher.match_seeded(flank_left, seqs, left_bounds)
+    _, right_ends, _ = flank_matcher.match_seeded(flank_right, seqs, right_bounds)
+
+    hits = list(zip(left_starts.tolist(), right_ends.tolist(), no_seed.tolist()))
+    return hits
+
+
+def match_flanks_cached(seqs, flank_left, flank_right, match_cache, cache_size=CACHE_SIZE):
+    """Matches both flanks, memoizing the result per unique read sequence in a bounded LRU cache.
+
+    :param list seqs: read sequences
+    :param dict flank_left: compiled left flank
+    :param dict flank_right: compiled right flank
+    :param collections.OrderedDict match_cache: cache of read sequence to match result, updated in place
+    :param int cache_size: maximum number of cached read sequences
+    :return list: (left flank start, right flank end, rejected by the seed prefilter) tuples, -1 for missing flanks
+    """
+
+    batch_hits = {}
+    for seq in seqs:
+        if seq not in batch_hits and seq in match_cache:
+            match_cache.move_to_end(seq)
+            batch_hits[seq] = match_cache[seq]
+
+    # Only unique sequences not seen before are matched
+    misses = list(dict.fromkeys(seq for seq in seqs if seq not in batch_hits))
+    for seq, hit in zip(misses, match_flanks(misses, flank_left, flank_right)):
+        batch_hits[seq] = hit
+        match_cache[seq] = hit
+
+    while len(match_cache) > cache_size:
+        match_cache.popitem(last=False)
+
+    hits = [batch_hits[seq] for seq in seqs]
+    return hits
+
+
+def collapse_trimmed(trimmed):
+    """Sums counts and per-position qualities of each unique trimmed sequence.
+
+    :param dict trimmed: {trimmed sequence: list of Phred quality bytes, None for reads without qualities}
+    :return dict: {trimmed sequence: [count, number of reads with qualities, numpy.ndarray per-position quality sums]}
+    """
+
+    counts = {}
+    for trim_seq, trim_quals in trimmed.items():
+
+        present = [e for e in trim_quals if e is not None]
+        qual_matrix = np.frombuffer(b"".join(present), dtype=np.uint8).reshape(len(present), len(trim_seq))
+        counts[trim_seq] = [len(trim_quals), len(present), qual_matrix.sum(axis=0, dtype=np.int64)]
+
+    return counts
+
+
+def merge_counts(counts, batch_counts):
+    """Merges the collapsed counts of a batch into running totals.
+
+    :param dict counts: running totals from collapse_trimmed, updated in place
+    :param dict batch_counts: batch counts from collapse_trimmed
+    """
+
+    for trim_seq, (n_reads, n_quals, qual_sums) in batch_counts.items():
+
+        if trim_seq not in counts:
+            counts[trim_seq] = [n_reads, n_quals, qual_sums]
+            continue
+
+        totals = counts[trim_seq]
+        totals[0] += n_reads
+        totals[1] += n_quals
+        totals[2] += qual_sums
+
+
+def write_counts(outfile, counts, compression=None):
+    """Writes the unique-sequence count table, most abundant sequences first.
+
+    :param str outfile: output filepath
+    :param dict counts: totals from merge_counts
+    :param str | None compression: gzip, bgzip, or None
+    """
+
+    with compressed_io.open_output(outfile, compression=compression) as out_fh:
+
+        out_fh.write(FILE_DELIM.join(COUNTS_HEADER) + FILE_NEWLINE)
+
+        for trim_seq, (n_reads, n_quals, qual_sums) in sorted(counts.items(), key=lambda e: (-e[1][0], e[0])):
+
+            mean_quals = NA_STR if n_quals == 0 else QUAL_DELIM.join("%.1f" % e for e in qual_sums / n_quals)
+            out_fh.write(FILE_DELIM.join((trim_seq, str(n_reads), mean_quals,)) + FILE_NEWLINE)
+
+
+def trim_batch(batch, flank_left, flank_right, match_cache=None, cache_size=CACHE_SIZE, collapse=False,
+               write_fastq=True):
+    """Trims a batch of reads to the span between their matched flanks.
+
+    :param tuple batch: (index of first read, list of sequences, list of Phred quality bytes)
+    :param dict flank_left: compiled left flank
+    :param dict flank_right: compiled right flank
+    :param collections.OrderedDict | None match_cache: optional cache of flank matches per read sequence
+    :param int cache_size: maximum number of cached read sequences
+    :param bool collapse: collapse trimmed reads to unique sequences
+    :param bool write_fastq: format trimmed reads as FASTQ
+    :return tuple: (FASTQ text or None, collapsed counts or None, number of reads without matches to both flanks,
+    number of those rejected by the seed prefilter)
+    """
+
+    first_index, seqs, quals = batch
+
+    if match_cache is None:
+        hits = match_flanks(seqs, flank_left, flank_right)
+    else:
+        hits = match_flanks_cached(seqs, flank_left, flank_right, match_cache, cache_size)
+
+    fastq_entries = []
+    trimmed = collections.defaultdict(list)
+    filtered_seqs = 0
+    rejected_seqs = 0
+    for i, (seq, read_quals, (flank_left_idx, flank_right_idx, no_seed)) in \
+            enumerate(zip(seqs, quals, hits), first_index):
+
+        if flank_left_idx == flank_matcher.NO_HIT or flank_right_idx == flank_matcher.NO_HIT:
+            filtered_seqs += 1
+            rejected_seqs += no_seed
+            continue
+
+        # If we match both the left and right flank we can extracte the sequence
+        trim_seq = seq[flank_left_idx:flank_right_idx]
+        trim_quals = None if read_quals is None else read_quals[flank_left_idx:flank_right_idx]
+
+        if collapse:
+            trimmed[trim_seq].append(trim_quals)
+
+        if write_fastq:
+
+            if trim_quals is None:
+                trim_quals_ascii = MISSING_QUALS[flank_left_idx:flank_right_idx].decode()
+            else:
+                trim_quals_ascii = trim_quals.translate(PHRED_TO_ASCII).decode()
+
+            fastq_entries.append(FILE_NEWLINE.join((FASTQ_QNAME_CHAR + str(i), trim_seq, "+", trim_quals_ascii)))
+
+    fastq_text = "".join(fastq_entry + FILE_NEWLINE for fastq_entry in fastq_entries) if write_fastq else None
+    counts = collapse_trimmed(trimmed) if collapse else None
+    return fastq_text, counts, filtered_seqs, rejected_seqs
+
+
+def _init_worker(flank_left, flank_right, trim_kwargs):
+    """Stores the compiled flanks and trimming options in a worker process.
+
+    :param dict flank_left: compiled left flank
+    :param dict flank_right: compiled right flank
+    :param dict trim_kwargs: keyword arguments for trim_batch
+    """
+
+    global _flanks, _trim_kwargs, _match_cache
+    _flanks = (flank_left, flank_right,)
+    _trim_kwargs = trim_kwargs
+    _match_cache = collections.OrderedDict() if trim_kwargs["collapse"] else None
+
+
+def _trim_batch_worker(batch):
+    """Trims a batch of reads in a worker process.
+
+    :param tuple batch: batch from iter_batches
+    :return tuple: result of trim_batch
+    """
+
+    return trim_batch(batch, *_flanks, match_cache=_match_cache, **_trim_kwargs)
+
+
+def iter_trimmed_batches(batches, flank_left, flank_right, threads=DEFAULT_THREADS, collapse=False,
+                         write_fastq=True, cache_size=CACHE_SIZE):
+    """Trims batches, optionally across a process pool, yielding results in input order.
+
+    The reading process is the producer and the consumer of this generator the writer. At most two batches per
+    worker are in flight, so memory stays bounded when reading outpaces matching. With collapse, each process keeps
+    its own match cache.
+
+    :param iterable batches: batches from iter_batches
+    :param dict flank_left: compiled left flank
+    :param dict flank_right: compiled right flank
+    :param int threads: number of worker processes
+    :param bool collapse: collapse trimmed reads to unique sequences, memoizing flank matches
+    :param bool write_fastq: format trimmed reads as FASTQ
+    :param int cache_size: maximum number of cached read sequences per process
+    :return generator: results of trim_batch
+    """
+
+    trim_kwargs = {"collapse": collapse, "write_fastq": write_fastq, "cache_size": cache_size}
+
+    if threads <= 1:
+        _init_worker(flank_left, flank_right, trim_kwargs)
+        for batch in batches:
+            yield _trim_batch_worker(batch)
+        return
+
+    with multiprocessing.Pool(threads, initializer=_init_worker, initargs=(flank_left, flank_right, trim_kwargs,)) \
+            as pool:
+
+        pending = collections.deque()
+        for batch in batches:
+
+            pending.append(pool.apply_async(_trim_batch_worker, (batch,)))
+
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def workflow(bam, flank_sequences, mm_allowance=MM_ALLOWANCE, output_dir=".",
+             match_mode=flank_matcher.SUBSTITUTION_MODE, threads=DEFAULT_THREADS, collapse=False, no_fastq=False,
+             cache_size=CACHE_SIZE, compression=None):
     """Runs the BAM trimming workflow.
 
     :param str bam: input BAM
     :param str flank_sequences: comma-separated flanking sequences
     :param int mm_allowance: mismatch allowance for matching the flanking sequences, default 3
     :param str output_dir: optional output directory
+    :param str match_mode: substitution to allow mismatches only, or edit to also allow indels
+    :param int threads: number of worker processes for matching and trimming
+    :param bool collapse: write a table of unique trimmed sequences with counts and per-position mean quality
+    :param bool no_fastq: do not write the per-read FASTQ; requires collapse
+    :param int cache_size: maximum number of read sequences to memoize per process with collapse
+    :param str | None compression: output compression, gzip, bgzip, or None
     """
 
+    if no_fastq and not collapse:
+        raise NotImplementedError("Skipping the FASTQ requires collapsing reads to a count table.")
+
     flank_sequences_split = flank_sequences.split(",")
 
-    # Use regex to enable fuzzy matching
-    flank_left_re = regex.compile("(%s){s<=%i}" % (flank_sequences_split[0].upper(), mm_allowance))
-    flank_right_re = regex.compile("(%s){s<=%i}" % (flank_sequences_split[1].upper(), mm_allowance))
+    # Bit-parallel fuzzy matching of each flank across batches of reads
+    flank_left = flank_matcher.compile_flank(flank_sequences_split[0], mm_allowance, match_mode)
+    flank_right = flank_matcher.compile_flank(flank_sequences_split[1], mm_allowance, match_mode)
+
+    # Compression runs in background threads, so the FASTQ writes do not hold up matching
+    output_fn = compressed_io.get_output_name(
+        os.path.join(output_dir, replace_extension(os.path.basename(bam), "trim.fq")), compression)
+    output_fh = None if no_fastq else compressed_io.open_output(output_fn, compression=compression)
+
+    metrics = instrumentation.get_metrics()
+    counts = {}
+    filtered_seqs = 0
+    rejected_seqs = 0
 
-    output_fn = os.path.join(output_dir, replace_extension(os.path.basename(bam), "trim.fq"))
+    with pysam.AlignmentFile(bam, mode="rb", check_sq=False) as input_af:
 
-    with pysam.AlignmentFile(bam, mode="rb", check_sq=False) as input_af, open(output_fn, "w") as output_fh:
+        batches = metrics.timed_iter("parse", iter_batches(input_af))
+        trimmed_batches = iter_trimmed_batches(
+            batches, flank_left, flank_right, threads, collapse, not no_fastq, cache_size)
 
-        filtered_seqs = 0
-        for i, align_seg in enumerate(input_af.fetch(until_eof=True)):
+        for fastq_text, batch_counts, batch_filtered, batch_rejected in metrics.timed_iter("match", trimmed_batches):
 
-            # Need to search each sequence for the flanking nucleotides
-            flank_left = flank_left_re.search(align_seg.query_sequence)
-            flank_right = flank_right_re.search(align_seg.query_sequence)
+            with metrics.stage("write"):
+                if output_fh is not None:
+                    output_fh.write(fastq_text)
 
-            if not (flank_left and flank_right):
-                filtered_seqs += 1
-                continue
+                if collapse:
+                    merge_counts(counts, batch_counts)
 
-            # If we match both the left and right flank we can extracte the sequence
-            flank_left_idx = flank_left.span()[0]
-            flank_right_idx = flank_right.span()[1]
+            filtered_seqs += batch_filtered
+            rejected_seqs += batch_rejected
+            metrics.add(instrumentation.FILTERED, batch_filtered)
 
-            trim_seq = align_seg.query_sequence[flank_left_idx:flank_right_idx]
-            trim_quals_ascii = align_seg.to_string().split(FILE_DELIM)[SAM_QUAL_FIELD][flank_left_idx:flank_right_idx]
-            fastq_entry = FILE_NEWLINE.join((FASTQ_QNAME_CHAR + str(i), trim_seq, "+", trim_quals_ascii))
+    if output_fh is not None:
+        output_fh.close()
 
-            output_fh.write(fastq_entry + FILE_NEWLINE)
+    metrics.add(instrumentation.WRITTEN, metrics.counts[instrumentation.READ] - filtered_seqs)
 
-        logger.warning(
-            "Filtered out %i reads that did not have matches to both flanking sequences." % filtered_seqs)
+    if collapse:
+        with metrics.stage("write"):
+            counts_fn = os.path.join(output_dir, replace_extension(os.path.basename(bam), COUNTS_EXT))
+            write_counts(compressed_io.get_output_name(counts_fn, compression), counts, compression)
+        logger.info("Collapsed trimmed reads to %i unique sequences." % len(counts))
 
+    logger.warning(
+        "Filtered out %i reads that did not have matches to both flanking sequences." % filtered_seqs)
 
-def main():
-    """Runs the workflow when called from command line."""
+    logger.warning("%i of these reads lacked an exact flank seed and were rejected before fuzzy matching."
+                   % rejected_seqs)
 
-    parsed_args = parse_commandline_params(sys.argv[1:])
+
+def main(args=None):
+    """Runs the workflow when called from command line.
+
+    :param list | None args: command line arguments, no script name; None to use sys.argv
+    """
+
+    parsed_args = parse_commandline_params(sys.argv[1:] if args is None else args)
 
     outdir = parsed_args["output_dir"]
     if not os.path.exists(outdir):
@@ -144,8 +478,15 @@ def main():
 
     logger.info("Started %s" % sys.argv[0])
 
+    instrumentation.start(__name__, parsed_args["metrics"], parsed_args["progress"], logger)
+
     workflow(bam=parsed_args["bam"], flank_sequences=parsed_args["flank_sequences"],
-             mm_allowance=parsed_args["mm_allowance"], output_dir=parsed_args["output_dir"])
+             mm_allowance=parsed_args["mm_allowance"], output_dir=parsed_args["output_dir"],
+             match_mode=parsed_args["match_mode"], threads=parsed_args["threads"], collapse=parsed_args["collapse"],
+             no_fastq=parsed_args["no_fastq"], cache_size=parsed_args["cache_size"],
+             compression=parsed_args["compression"])
+
+    instrumentation.finish()
 
     logger.info("Completed %s" % sys.argv[0])
 